@@ -1,55 +1,180 @@
 #!/usr/bin/env python3
 
 import flask
+import json
+import logging
 import os
+import time
 from flask_cors import CORS
-from RAG_Core import PDFRAGSystem
+from instrumentation import trace_request, span, render_metrics, REQUEST_SECONDS, REQUESTS
+from lazy import Lazy
 
-app = flask.Flask(__name__)
-CORS(app)
-rag_system = PDFRAGSystem(api_key=os.getenv("OPENAI_API_KEY"), search_endpoint=os.getenv("SEARCH_ENDPOINT"), search_api_key=os.getenv("SEARCH_API_KEY"), index_name=os.getenv("INDEX_NAME"))
+MAX_BATCH_QUERIES = 100
 
+# LOG_LEVEL=DEBUG also logs retrieved documents and a JSON trace of every request
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "WARNING").upper(), format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
-@app.route("/")
+routes = flask.Blueprint("rag", __name__)
+
+
+def create_rag_system():
+    # Imported here so that importing App (e.g. in the gunicorn master before it forks) stays cheap
+    from RAG_Core import PDFRAGSystem
+    return PDFRAGSystem(api_key=os.getenv("OPENAI_API_KEY"), search_endpoint=os.getenv("SEARCH_ENDPOINT"), search_api_key=os.getenv("SEARCH_API_KEY"), index_name=os.getenv("INDEX_NAME"), local_index_path=os.getenv("LOCAL_INDEX_PATH"), retrieval_mode=os.getenv("RETRIEVAL_MODE"), reranker=os.getenv("RERANKER"), expansion=os.getenv("EXPANSION"), chunk_store_path=os.getenv("CHUNK_STORE_PATH"), multi_query=os.getenv("MULTI_QUERY"), acronyms_path=os.getenv("ACRONYMS_PATH"), request_timeout=float(os.getenv("REQUEST_TIMEOUT", "30")), search_workers=int(os.getenv("THREADS", "32")))
+
+
+_rag_system = Lazy(create_rag_system)
+
+
+def get_rag_system():
+    """This process's PDFRAGSystem, created on first use so each gunicorn worker builds its own after fork."""
+    return _rag_system.get()
+
+
+def close_rag_system():
+    if _rag_system.built:
+        _rag_system.get().close()
+
+
+def create_app():
+    """Flask app factory; cheap, as the RAG system and its clients are only built on first use."""
+    app = flask.Flask(__name__)
+    CORS(app)
+    app.register_blueprint(routes)
+    return app
+
+
+@routes.before_app_request
+def start_timer():
+    flask.g.request_start = time.perf_counter()
+
+@routes.after_app_request
+def record_request(response):
+    # For /retrieve_stream this is the time to the start of the stream, not to its end
+    endpoint = (flask.request.endpoint or "unknown").removeprefix(routes.name + ".")
+    REQUEST_SECONDS.observe(time.perf_counter() - flask.g.request_start, endpoint=endpoint)
+    REQUESTS.inc(endpoint=endpoint, status=response.status_code)
+    return response
+
+@routes.route("/")
 def home():
     return "System initialized!"
 
-@app.route("/process_pdfs", methods=["POST"])
+@routes.route("/ready", methods=["GET"])
+def ready():
+    """Readiness probe: 200 once connections to OpenAI and Azure Search are open, 503 until then."""
+    try:
+        rag_system = get_rag_system()
+        if not rag_system.ready:
+            rag_system.warm_up()
+    except Exception as e:
+        return flask.jsonify({"ready": False, "error": str(e)}), 503
+    return flask.jsonify({"ready": True})
+
+@routes.route("/process_pdfs", methods=["POST"])
 def process_pdfs():
     """Endpoint to process PDFs and create embeddings."""
     try:
-        result = rag_system.load_pdfs()
+        result = get_rag_system().load_pdfs()
         return flask.jsonify({"message": result})
     except Exception as e:
         return flask.jsonify({"error": str(e)}), 500
 
-@app.route("/retrieve", methods=["POST"])
+@routes.route("/retrieve", methods=["POST"])
 def retrieve():
     """Endpoint to query the RAG system."""
-    print("Retrieving information...")
     data = flask.request.json
     user_query = data.get("user_query", "")
-    print(f"Query received: {user_query}")
+    logger.debug("Query received: %s", user_query)
 
     if not user_query:
         return flask.jsonify({"error": "No query provided"}), 400
 
     try:
+        rag_system = get_rag_system()
         if not rag_system.retriever:
             return flask.jsonify({"error": "PDFs must be processed before querying."}), 400
 
-        response = rag_system.get_response(user_query)
-        return flask.jsonify({
-            "answer": response["answer"],
-            "sources": response["sources"],
-            "error": response.get("error", "")
-        })
+        with trace_request("retrieve"):
+            response = rag_system.get_response(user_query)
+            with span("serialization"):
+                return flask.jsonify({
+                    "answer": response["answer"],
+                    "sources": response["sources"],
+                    "error": response.get("error", "")
+                })
+    except Exception as e:
+        return flask.jsonify({"error": str(e)}), 500
+
+@routes.route("/retrieve_batch", methods=["POST"])
+def retrieve_batch():
+    """Answer a list of queries concurrently; each result carries its own error field."""
+    data = flask.request.json
+    user_queries = data.get("user_queries", [])
+
+    if not user_queries or not isinstance(user_queries, list):
+        return flask.jsonify({"error": "No queries provided"}), 400
+    if len(user_queries) > MAX_BATCH_QUERIES:
+        return flask.jsonify({"error": f"At most {MAX_BATCH_QUERIES} queries per batch"}), 400
+
+    try:
+        responses = get_rag_system().get_responses(user_queries)
+        with span("serialization"):
+            return flask.jsonify({
+                "results": [
+                    {
+                        "user_query": query,
+                        "answer": response["answer"],
+                        "sources": response["sources"],
+                        "error": response.get("error", "")
+                    }
+                    for query, response in zip(user_queries, responses)
+                ]
+            })
     except Exception as e:
         return flask.jsonify({"error": str(e)}), 500
 
+@routes.route("/retrieve_stream", methods=["POST"])
+def retrieve_stream():
+    """Streaming variant of /retrieve, served as Server-Sent Events: sources first, then answer tokens."""
+    data = flask.request.json
+    user_query = data.get("user_query", "")
+
+    if not user_query:
+        return flask.jsonify({"error": "No query provided"}), 400
+
+    rag_system = get_rag_system()
+
+    def events():
+        with trace_request("retrieve_stream"):
+            for event, payload in rag_system.get_response_stream(user_query):
+                yield f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+    return flask.Response(
+        flask.stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@routes.route("/cache_stats", methods=["GET"])
+def cache_stats():
+    """Hit rate and latency saved per response cache tier."""
+    return flask.jsonify(get_rag_system().response_cache.stats())
+
+@routes.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus scrape endpoint: per-stage and per-endpoint latency histograms, token and cache counters."""
+    return flask.Response(render_metrics(), mimetype="text/plain; version=0.0.4")
+
+# Module-level app for `gunicorn App:app` and `flask --app App run`
+app = create_app()
+
 if __name__ == "__main__":
     try:
         print("Initializing RAG system...")
+        get_rag_system()
     except Exception as e:
         print(f"Error initializing RAG system: {str(e)}")
-    app.run(debug=True, port=5000)
+    # Development server only; serve production traffic with `gunicorn -c gunicorn.conf.py App:app`
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1", port=5000, threaded=True)
@@ -1,33 +1,63 @@
 #!/usr/bin/env python3
 import os
-import openai
 import logging
-import traceback
-import uuid
-import ast
+import multiprocessing
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from response_cache import ResponseCache, normalize_query
+from retrievers import BaseRetriever
+from local_index import LocalVectorIndex, LocalVectorRetriever, IndexWriter, new_index_version, publish_index
+from chunking import find_pdfs, extract_pdf_text, chunk_documents
+from embedding_cache import EmbeddingCache, embed_with_cache
+from context_builder import ContextBuilder
+from rerank import RerankingRetriever, make_scorer
+from hybrid import BM25Retriever, HybridRetriever
+from instrumentation import span, observe, record_tokens, record_cache
+from openai_transport import OpenAITransport, SingleFlight
+from chunk_store import ChunkStore, ParentExpandingRetriever
+from query_rewrite import MultiQueryRetriever, make_rewriter
+from lazy import lazy_property, is_built
 
-class AzureCognitiveSearchRetriever:
+logger = logging.getLogger(__name__)
+
+# Where load_pdfs writes the local index when no path is configured
+DEFAULT_INDEX_PATH = "local_index"
+
+class AzureCognitiveSearchRetriever(BaseRetriever):
     """
     A retriever to query Azure Cognitive Search vector index.
+    query_mode is "keyword" (full-text search), "vector" (embedding_fn + the index's vector field)
+    or "hybrid" (both in one request, fused by Azure).
     """
-    def __init__(self, search_client, embedding_fn, k=5):
+    def __init__(self, search_client, embedding_fn, k=5, query_mode="keyword", vector_field="text_vector"):
+        super().__init__(k)
         self.search_client = search_client
         self.embedding_fn = embedding_fn
-        self.k = k
+        self.query_mode = query_mode
+        self.vector_field = vector_field
 
-    def get_relevant_documents(self, query):
-        # Generate the query embedding
+    def get_relevant_documents(self, query, k=None):
+        k = k or self.k
+        search_args = {"top": k, "include_total_count": True}
+        if self.query_mode in ("keyword", "hybrid"):
+            search_args["search_text"] = query
+        if self.query_mode in ("vector", "hybrid"):
+            from azure.search.documents.models import VectorizedQuery
+            # Generate the query embedding
+            with span("embedding"):
+                vector = self.embedding_fn([query])[0]
+            search_args["vector_queries"] = [
+                VectorizedQuery(vector=vector, k_nearest_neighbors=k, fields=self.vector_field)
+            ]
 
-        # Perform vector search
-        results = self.search_client.search(
-            search_text=query,  # Empty for pure vector search
-            top=self.k,
-            include_total_count=True
-        )
+        # Perform the search
+        results = self.search_client.search(**search_args)
 
         # Parse results into a list of documents
         docs = []
@@ -38,56 +68,394 @@ class AzureCognitiveSearchRetriever:
                     "chunk_id": result.get("chunk_id"),
                     "parent_id": result.get("parent_id"),
                     "title": result.get("title")
-                }
+                },
+                "score": result.get("@search.score")
             }
             docs.append(doc)
 
         return docs
 
 class PDFRAGSystem:
-    def __init__(self, api_key, search_endpoint, search_api_key, index_name, model_name="gpt-4o-mini"):
+    def __init__(self, api_key, search_endpoint, search_api_key, index_name, model_name="gpt-4o-mini",
+                 cache_size=1024, cache_ttl=3600, semantic_cache_threshold=None, batch_workers=8,
+                 local_index_path=None, retrieval_mode=None, retrieval_k=5, context_token_budget=3000,
+                 reranker=None, rerank_fetch_k=50, rerank_budget=0.5, request_timeout=30, pool_size=64,
+                 openai_max_retries=4, expansion=None, expansion_window=1, expansion_max_chars=8000,
+                 chunk_store_path=None, multi_query=None, multi_query_count=3, acronyms_path=None,
+                 search_workers=32):
         self.api_key = api_key
         self.model_name = model_name
+        self.request_timeout = request_timeout
+        self.ready = False
 
-        # Initialize embeddings and LLM
-        self.embeddings = OpenAIEmbeddings(openai_api_key=self.api_key)
-        self.llm = ChatOpenAI(
-            model_name=self.model_name,
-            openai_api_key=self.api_key,
-            temperature=0
+        # One keep-alive connection pool per backend, shared by every request thread in this process.
+        # OpenAI calls go through OpenAITransport: identical in-flight requests are sent once, a
+        # token bucket tuned from the rate limit headers paces them, and 429/5xx are retried there
+        self.openai_transport = OpenAITransport(
+            httpx.HTTPTransport(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)),
+            max_retries=openai_max_retries,
+            max_delay=request_timeout
         )
+        self.http_client = httpx.Client(
+            transport=self.openai_transport,
+            timeout=httpx.Timeout(request_timeout, connect=10)
+        )
+        self.search_session = requests.Session()
+        self.search_session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size))
 
-        # Azure Cognitive Search Clients
+        # Embeddings, LLM, search client, retriever, reranker and context builder are built on
+        # first use (see the lazy properties below), so constructing this object is cheap and
+        # the langchain/azure imports are only paid by processes that make those calls
         self.search_endpoint = search_endpoint
         self.search_api_key = search_api_key
         self.index_name = index_name
 
-        self.search_client = SearchClient(
+        # Initialize the retriever: a local in-process index when one is given, Azure otherwise.
+        # retrieval_mode is "keyword", "vector" or "hybrid" (keyword + vector fused with RRF);
+        # by default Azure keeps its keyword search and a local index uses vector search
+        self._default_retrieval_mode = retrieval_mode is None
+        if retrieval_mode is None:
+            retrieval_mode = "vector" if local_index_path else "keyword"
+        self.retrieval_mode = retrieval_mode
+        self.retrieval_k = retrieval_k
+        self.local_index_path = local_index_path
+        # load_pdfs publishes each new local index by repointing a symlink; every request checks
+        # where it points, so all server processes switch to a new index (reload_if_index_changed)
+        self._index_version = self._current_index_version()
+        self._reload_lock = threading.Lock()
+        # Threads in the search pools shared by all requests; match the server's request threads
+        self.search_workers = search_workers
+        # Optional second stage: over-fetch rerank_fetch_k chunks and rerank them with a local
+        # scorer ("cross-encoder" or "lexical"), falling back to first-stage order after rerank_budget seconds
+        self.reranker = reranker
+        self.rerank_fetch_k = rerank_fetch_k
+        self.rerank_budget = rerank_budget
+        # Optional small-to-big step: widen each final hit to its neighboring chunks ("neighbors",
+        # expansion_window per side) or to up to expansion_max_chars of its parent ("parent"), read
+        # from the local index's chunks, or from chunk_store_path (a local index directory) for Azure
+        self.expansion = expansion
+        self.expansion_window = expansion_window
+        self.expansion_max_chars = expansion_max_chars
+        self.chunk_store_path = chunk_store_path
+        # Optional multi-query retrieval: also search with rewrites of the question, from the LLM
+        # ("llm", multi_query_count of them) or an acronym dictionary ("acronyms", DEFAULT_ACRONYMS
+        # plus acronyms_path), all in parallel, and fuse the rankings with RRF before reranking
+        self.multi_query = multi_query
+        self.multi_query_count = multi_query_count
+        self.acronyms_path = acronyms_path
+        self.context_token_budget = context_token_budget
+
+        # Response cache: exact match on the normalized query, plus an optional semantic tier
+        # that reuses answers for near-identical questions (cosine >= semantic_cache_threshold)
+        self.response_cache = ResponseCache(
+            max_entries=cache_size,
+            ttl=cache_ttl,
+            embed_fn=(lambda query: self.embeddings.embed_query(query)) if semantic_cache_threshold is not None else None,
+            similarity_threshold=semantic_cache_threshold
+        )
+
+        # Concurrent requests for the same (normalized) question share one generation
+        self.in_flight = SingleFlight()
+
+        # Shared worker pool for get_responses, so concurrent batches together stay under batch_workers
+        self.batch_executor = ThreadPoolExecutor(max_workers=batch_workers, thread_name_prefix="rag-batch")
+
+    @lazy_property
+    def embeddings(self):
+        from langchain_openai import OpenAIEmbeddings
+        return OpenAIEmbeddings(
+            openai_api_key=self.api_key,
+            http_client=self.http_client,
+            request_timeout=self.request_timeout,
+            max_retries=0
+        )
+
+    @lazy_property
+    def llm(self):
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(
+            model_name=self.model_name,
+            openai_api_key=self.api_key,
+            temperature=0,
+            stream_usage=True,
+            http_client=self.http_client,
+            request_timeout=self.request_timeout,
+            max_retries=0
+        )
+
+    @lazy_property
+    def search_client(self):
+        """Azure Cognitive Search client, or None without a search endpoint."""
+        if not self.search_endpoint:
+            return None
+        from azure.core.credentials import AzureKeyCredential
+        from azure.core.pipeline.transport import RequestsTransport
+        from azure.search.documents import SearchClient
+        return SearchClient(
             endpoint=self.search_endpoint,
             index_name=self.index_name,
-            credential=AzureKeyCredential(self.search_api_key)
+            credential=AzureKeyCredential(self.search_api_key),
+            transport=RequestsTransport(session=self.search_session, session_owner=False),
+            connection_timeout=10,
+            read_timeout=self.request_timeout
         )
 
-        # Initialize the retriever
-        self.retriever = AzureCognitiveSearchRetriever(
-            search_client=self.search_client,
-            embedding_fn=self.embeddings.embed_documents,
-            k=5
-        )
+    @lazy_property
+    def rerank_scorer(self):
+        return make_scorer(self.reranker) if self.reranker else None
 
-    def get_response(self, user_query):
-        """Get response for a user query using the vectorized data from Azure Cognitive Search."""
+    @lazy_property
+    def context_builder(self):
+        # Prompt context: near-duplicate chunks dropped, capped at context_token_budget tokens
+        return ContextBuilder(model_name=self.model_name, token_budget=self.context_token_budget)
+
+    @lazy_property
+    def retriever(self):
+        return self._build_retriever()
+
+    @property
+    def _searches_per_query(self):
+        # Multi-query runs the question and each rewrite concurrently, each taking pool threads
+        return self.multi_query_count + 1 if self.multi_query else 1
+
+    def _build_retriever(self):
+        index = version = None
+        if self.local_index_path:
+            # Open the version the path resolves to now, even if it is repointed meanwhile
+            version = os.path.realpath(self.local_index_path)
+            index = LocalVectorIndex(version)
+            keyword = BM25Retriever(index.documents, k=self.retrieval_k)
+            vector = LocalVectorRetriever(index=index, embedding_fn=self.embeddings.embed_query, k=self.retrieval_k)
+        else:
+            keyword = AzureCognitiveSearchRetriever(
+                search_client=self.search_client,
+                embedding_fn=self.embeddings.embed_documents,
+                k=self.retrieval_k
+            )
+            vector = AzureCognitiveSearchRetriever(
+                search_client=self.search_client,
+                embedding_fn=self.embeddings.embed_documents,
+                k=self.retrieval_k,
+                query_mode="vector"
+            )
+        if self.retrieval_mode == "keyword":
+            retriever = keyword
+        elif self.retrieval_mode == "vector":
+            retriever = vector
+        elif self.retrieval_mode == "hybrid":
+            retriever = HybridRetriever(keyword, vector, k=self.retrieval_k, workers=self.search_workers * self._searches_per_query)
+        else:
+            raise ValueError(f"Unknown retrieval_mode: {self.retrieval_mode}")
+        if self.multi_query:
+            rewriter = make_rewriter(self.multi_query, self.llm, self.multi_query_count, self.acronyms_path)
+            retriever = MultiQueryRetriever(retriever, rewriter, k=self.retrieval_k, workers=self.search_workers * self._searches_per_query)
+        if self.rerank_scorer is not None:
+            retriever = RerankingRetriever(
+                retriever, self.rerank_scorer, k=self.retrieval_k,
+                fetch_k=self.rerank_fetch_k, latency_budget=self.rerank_budget
+            )
+        if self.expansion:
+            if self.chunk_store_path:
+                store = ChunkStore.load(self.chunk_store_path)
+            elif index is not None:
+                store = ChunkStore(index.documents)
+            else:
+                raise ValueError("expansion needs a local index or chunk_store_path")
+            retriever = ParentExpandingRetriever(
+                retriever, store, k=self.retrieval_k, mode=self.expansion,
+                window=self.expansion_window, max_chars=self.expansion_max_chars
+            )
+        if version is not None:
+            self._index_version = version
+        return retriever
+
+    def _current_index_version(self):
+        """Directory the local index path (or load_pdfs' default) resolves to, None if it doesn't exist."""
+        path = self.local_index_path or DEFAULT_INDEX_PATH
+        return os.path.realpath(path) if os.path.exists(path) else None
+
+    def _use_local_index(self, path):
+        """Serve from the local index at path, replacing the retriever if it was already built."""
+        self.local_index_path = path
+        if self._default_retrieval_mode:
+            self.retrieval_mode = "vector"
+        if is_built(self, "retriever"):
+            old = self.retriever
+            self.retriever = self._build_retriever()
+            # Requests still searching with the old chain get request_timeout to finish before its pools shut down
+            timer = threading.Timer(self.request_timeout, old.close)
+            timer.daemon = True
+            timer.start()
+        else:
+            self._index_version = self._current_index_version()
+        self.invalidate_cache()
+
+    def reload_if_index_changed(self):
+        """
+        Switch to a local index published by another process since this one loaded its own; under
+        gunicorn, load_pdfs runs in a single worker. One readlink, so cheap enough for every request.
+        """
+        version = self._current_index_version()
+        if version is None or version == self._index_version:
+            return
+        with self._reload_lock:
+            if version != self._index_version:
+                logger.info("Local index changed to %s, reloading the retriever", version)
+                self._use_local_index(self.local_index_path or DEFAULT_INDEX_PATH)
+
+    def load_pdfs(self, pdf_folder="downloaded_pdfs", index_path=None, chunk_size=2000, chunk_overlap=200,
+                  batch_size=256, workers=None, embedding_cache_path="embedding_cache.sqlite3", dtype="float32",
+                  quantization=None):
+        """
+        Extract, chunk and embed every PDF under pdf_folder into a local vector index, then switch
+        the retriever to it. PDFs are parsed in a process pool a few at a time and chunks are
+        embedded in batches of batch_size, so memory stays bounded regardless of corpus size.
+        Embeddings are cached by chunk content, so re-ingestion only embeds changed chunks.
+        quantization ("int8" or "pq") also writes compressed codes for search; see quantization.py.
+        The index is built in a new version directory, and index_path is then atomically repointed
+        at it; other server processes switch over on their next request.
+        """
+        index_path = index_path or self.local_index_path or DEFAULT_INDEX_PATH
+        build_path = new_index_version(index_path)
+        writer = IndexWriter(build_path, dtype=dtype)
+        cache = EmbeddingCache(embedding_cache_path, model=self.embeddings.model)
+        pending = []
+        files = find_pdfs(pdf_folder)
+        failed = 0
+
+        def flush(batch):
+            vectors = embed_with_cache([doc["page_content"] for doc in batch], self.embeddings.embed_documents, cache)
+            writer.append(vectors, batch)
+
+        workers = workers or os.cpu_count() or 1
         try:
-            # Retrieve relevant documents
+            # Spawn rather than fork: the caller may be a multi-threaded server worker, and forking
+            # a process with threads can copy locks that are held and never released in the child
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                window = 2 * workers
+                # Submit a bounded window of files so parsed text never piles up in memory
+                for start in range(0, len(files), window):
+                    for path, text, error in pool.map(extract_pdf_text, files[start:start + window]):
+                        if error:
+                            print(f"Could not parse {path}: {error}")
+                            failed += 1
+                            continue
+                        pending.extend(chunk_documents(path, text, pdf_folder, chunk_size, chunk_overlap))
+                        while len(pending) >= batch_size:
+                            flush(pending[:batch_size])
+                            pending = pending[batch_size:]
+            if pending:
+                flush(pending)
+            writer.close(quantization=quantization)
+        except BaseException:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise
+        finally:
+            cache.close()
+
+        publish_index(index_path, build_path)
+        self._use_local_index(index_path)
+        return (
+            f"Processed {len(files) - failed} PDFs into {writer.rows} chunks "
+            f"({cache.misses} embedded, {cache.hits} from cache, {failed} failed)"
+        )
+
+    def warm_up(self):
+        """
+        Build the lazily created clients and retriever, then open connections to every backend
+        before taking traffic: one embedding call (OpenAI) and one document count (Azure Search).
+        Sets self.ready; raises if a backend is unreachable.
+        """
+        # Touching the lazy properties builds them now rather than on the first request
+        self.retriever
+        self.context_builder
+        self.embeddings.embed_query("warm up")
+        if self.search_client is not None:
+            self.search_client.get_document_count()
+        self.ready = True
+
+    def close(self):
+        """Stop accepting work, let in-flight batch requests finish, then release pooled connections."""
+        self.ready = False
+        self.batch_executor.shutdown(wait=True)
+        if is_built(self, "retriever"):
+            self.retriever.close()
+        self.http_client.close()
+        if is_built(self, "search_client") and self.search_client is not None:
+            self.search_client.close()
+        self.search_session.close()
+
+    def invalidate_cache(self):
+        """Drop cached responses; call whenever the search index is refreshed."""
+        self.response_cache.invalidate()
+
+    def _cache_lookup(self, user_query):
+        # Before the lookup, so answers cached from a replaced index are dropped first
+        self.reload_if_index_changed()
+        with span("cache_lookup"):
+            cached, tier, embedding = self.response_cache.lookup(user_query)
+        record_cache(tier or "miss")
+        return cached, embedding
+
+    def _retrieve_context(self, user_query):
+        # "search" covers the whole retriever call, including any query embedding it does
+        with span("search"):
             relevant_docs = self.retriever.get_relevant_documents(user_query)
-            print(f"Found {len(relevant_docs)} relevant documents.")
-            print(relevant_docs)
+        logger.info("Found %d relevant documents.", len(relevant_docs))
+        logger.debug("Relevant documents: %s", relevant_docs)
+
+        # Build the context from the retrieved documents, deduplicated and within the token budget
+        with span("context"):
+            context = self.context_builder.build(relevant_docs)
+        record_tokens(context=context["tokens"])
+        return context
+
+    def _record_usage(self, message):
+        usage = getattr(message, "usage_metadata", None)
+        if usage:
+            record_tokens(prompt=usage.get("input_tokens"), completion=usage.get("output_tokens"))
+
+    def get_response(self, user_query):
+        """Get response for a user query, serving repeated questions from the response cache."""
+        start = time.perf_counter()
+        cached, embedding = self._cache_lookup(user_query)
+        if cached is not None:
+            return cached
+        return self.in_flight.do(normalize_query(user_query), self._generate_and_cache, user_query, embedding, start)
+
+    def _generate_and_cache(self, user_query, embedding, start):
+        response = self._generate_response(user_query)
+        if not response.get("error"):
+            self.response_cache.put(user_query, response, cost=time.perf_counter() - start, embedding=embedding)
+        return response
 
-            # Build the context from the retrieved documents
-            context = "\n\n".join([doc["page_content"] for doc in relevant_docs])
+    def get_responses(self, user_queries):
+        """
+        Answer many queries concurrently on the batch worker pool. Identical queries (after
+        normalization) are answered once. Returns one response per query, in input order;
+        failures are reported per query through the "error" field as in get_response.
+        """
+        unique = {}
+        for query in user_queries:
+            unique.setdefault(normalize_query(query), query)
+        futures = {
+            key: self.batch_executor.submit(self.get_response, query) for key, query in unique.items()
+        }
+        responses = {}
+        for key, future in futures.items():
+            try:
+                responses[key] = future.result()
+            except Exception as e:
+                responses[key] = {
+                    "answer": "Sorry, there was an error processing your request.",
+                    "sources": [],
+                    "error": str(e)
+                }
+        return [dict(responses[normalize_query(query)]) for query in user_queries]
 
-            # Construct the prompt
-            prompt = f"""You are a helpful AI assistant. Use the following context to answer the question.
+    def _build_prompt(self, user_query, context):
+        # Construct the prompt
+        return f"""You are a helpful AI assistant. Use the following context to answer the question.
             If you cannot find the answer in the context, say so - don't make up information.
 
             Context:
@@ -99,26 +467,79 @@ class PDFRAGSystem:
             Answer:
             """
 
+    def _extract_sources(self, relevant_docs):
+        # Extract source filenames (if available in metadata)
+        sources = []
+        for doc in relevant_docs:
+            sources.append(doc["page_content"])
+        # Deduplicate while keeping retrieval order
+        return list(dict.fromkeys(sources))
+
+    def _generate_response(self, user_query):
+        """Get response for a user query using the vectorized data from Azure Cognitive Search."""
+        try:
+            # Retrieve relevant documents and build the context
+            context = self._retrieve_context(user_query)
+            prompt = self._build_prompt(user_query, context["context"])
+
             # Call the LLM
-            response = self.llm(prompt)
+            with span("llm"):
+                response = self.llm.invoke(prompt)
+            self._record_usage(response)
             answer = response.content.strip()
 
-            # Extract source filenames (if available in metadata)
-            sources = []
-            for doc in relevant_docs:
-                meta = doc["metadata"]
-                if isinstance(meta, str):
-                    meta = ast.literal_eval(meta)
-                sources.append(doc["page_content"])
             return {
                 "answer": answer,
-                "sources": list(set(sources))
+                "sources": self._extract_sources(context["docs"])
             }
 
         except Exception as e:
-            print("Exception in get_response:", traceback.format_exc())
+            logger.exception("Exception in get_response")
             return {
                 "answer": "Sorry, there was an error processing your request.",
                 "sources": [],
                 "error": str(e)
-            }
\ No newline at end of file
+            }
+
+    def get_response_stream(self, user_query):
+        """
+        Streaming variant of get_response. Yields (event, data) pairs: ("sources", list) once
+        retrieval finishes, ("token", str) for each piece of the answer as the model produces it,
+        then ("done", response dict) or ("error", message).
+        """
+        start = time.perf_counter()
+        cached, embedding = self._cache_lookup(user_query)
+        if cached is not None:
+            yield "sources", cached["sources"]
+            yield "token", cached["answer"]
+            yield "done", cached
+            return
+
+        try:
+            context = self._retrieve_context(user_query)
+            sources = self._extract_sources(context["docs"])
+            yield "sources", sources
+
+            tokens = []
+            llm_start = time.perf_counter()
+            for chunk in self.llm.stream(self._build_prompt(user_query, context["context"])):
+                # With stream_usage the final chunk carries the token counts and no content
+                self._record_usage(chunk)
+                if chunk.content:
+                    if not tokens:
+                        observe("llm_first_token", time.perf_counter() - llm_start)
+                    tokens.append(chunk.content)
+                    yield "token", chunk.content
+            observe("llm", time.perf_counter() - llm_start)
+
+            response = {
+                "answer": "".join(tokens).strip(),
+                "sources": sources
+            }
+        except Exception as e:
+            logger.exception("Exception in get_response_stream")
+            yield "error", str(e)
+            return
+
+        self.response_cache.put(user_query, response, cost=time.perf_counter() - start, embedding=embedding)
+        yield "done", response
@@ -0,0 +1,512 @@
+#!/usr/bin/env python3
+"""
+Offline load test of the /retrieve endpoint against local stand-ins for OpenAI and Azure Search.
+
+    python benchmark.py run [--concurrency 1 8 32] [--requests 200] [--chat-latency lognormal:0.8,0.4]
+    python benchmark.py compare benchmarks/<old>.json benchmarks/<new>.json [--threshold 0.1]
+    python benchmark.py startup [--repeats 5]
+
+`run` starts a stub HTTP server that answers the OpenAI chat/embeddings API and Azure Search
+(search and document count), each after a delay drawn from its latency distribution. It then
+starts App.py (gunicorn or the Flask server) pointed at the stub and drives /retrieve with each
+concurrency level in turn. Latency percentiles, throughput and server memory are written to
+benchmarks/<timestamp>-<commit>.json. `compare` prints two result files side by side and exits
+non-zero when p95, p99, throughput or memory regressed by more than the threshold. `run` also
+records the cold start: seconds from launching the server until /ready answers 200.
+`startup` times the imports a fresh process pays (App, eval_script, building the RAG system).
+
+Latency distributions are "fixed:S", "uniform:LOW,HIGH" or "lognormal:MEDIAN,SIGMA", in seconds.
+"""
+import argparse
+import base64
+import itertools
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import requests
+
+from instrumentation import FLUSH_SECONDS
+
+RESULTS_DIR = "benchmarks"
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Numbers the queries across all levels of a run, so unique queries never repeat
+_query_ids = itertools.count()
+
+
+class LatencyDistribution:
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        values = [float(value) for value in params.split(",")] if params else []
+        if kind == "fixed" and len(values) == 1:
+            self._sample = lambda rng: values[0]
+        elif kind == "uniform" and len(values) == 2:
+            self._sample = lambda rng: rng.uniform(*values)
+        elif kind == "lognormal" and len(values) == 2:
+            median, sigma = values
+            self._sample = lambda rng: median * rng.lognormvariate(0.0, sigma)
+        else:
+            raise ValueError(f"Bad latency distribution: {spec}")
+
+    def sample(self, rng=random):
+        return max(0.0, self._sample(rng))
+
+
+class StubBackend:
+    """
+    Local HTTP stand-in for the OpenAI API (/v1/chat/completions, /v1/embeddings) and an Azure
+    Search index (docs/search.post.search, docs/$count). Responses are synthetic but shaped like
+    the real ones, so requests go through the same clients, connection pools and parsing.
+    """
+    def __init__(self, chat_latency, embedding_latency, search_latency, dim=1536, chunk_words=300, answer_words=80):
+        self.chat_latency = chat_latency
+        self.embedding_latency = embedding_latency
+        self.search_latency = search_latency
+        self.dim = dim
+        self.answer_words = answer_words
+        rng = random.Random(0)
+        vocabulary = [f"term{i}" for i in range(5000)]
+        self.chunks = [" ".join(rng.choices(vocabulary, k=chunk_words)) for _ in range(500)]
+        self.server = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        backend = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status, payload, content_type="application/json"):
+                body = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if "/docs/$count" in self.path:
+                    time.sleep(backend.search_latency.sample())
+                    return self._reply(200, len(backend.chunks))
+                self._reply(404, {"error": self.path})
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path.startswith("/v1/chat/completions"):
+                    return self._reply(200, backend.chat(body))
+                if self.path.startswith("/v1/embeddings"):
+                    return self._reply(200, backend.embed(body))
+                if "/docs/search.post.search" in self.path:
+                    return self._reply(200, backend.search(body))
+                self._reply(404, {"error": self.path})
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def chat(self, body):
+        time.sleep(self.chat_latency.sample())
+        prompt_tokens = sum(len(str(message.get("content", "")).split()) for message in body.get("messages", []))
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "stub"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(["answer"] * self.answer_words)},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": self.answer_words,
+                "total_tokens": prompt_tokens + self.answer_words
+            }
+        }
+
+    def embed(self, body):
+        time.sleep(self.embedding_latency.sample())
+        inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+        data = []
+        for i, text in enumerate(inputs):
+            # Inputs may be strings or token id lists; either way the vector is deterministic
+            rng = np.random.default_rng(zlib.crc32(repr(text).encode("utf-8")))
+            vector = rng.standard_normal(self.dim).astype(np.float32)
+            if body.get("encoding_format") == "base64":
+                vector = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                vector = vector.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        return {"object": "list", "data": data, "model": body.get("model", "stub"),
+                "usage": {"prompt_tokens": len(inputs), "total_tokens": len(inputs)}}
+
+    def search(self, body):
+        time.sleep(self.search_latency.sample())
+        top = body.get("top") or 50
+        start = zlib.crc32(str(body.get("search", "")).encode("utf-8")) % len(self.chunks)
+        value = []
+        for rank in range(top):
+            row = (start + rank) % len(self.chunks)
+            value.append({
+                "@search.score": 10.0 / (rank + 1),
+                "chunk": self.chunks[row],
+                "chunk_id": f"chunk-{row}",
+                "parent_id": f"parent-{row // 10}",
+                "title": f"document-{row // 10}.pdf"
+            })
+        return {"@odata.count": len(self.chunks), "value": value}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def process_tree_rss(pid):
+    """Resident memory in bytes of pid and all its descendants (Linux /proc only; None elsewhere)."""
+    total, stack = 0, [pid]
+    try:
+        while stack:
+            current = stack.pop()
+            with open(f"/proc/{current}/status") as file:
+                for line in file:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as file:
+                    stack.extend(int(child) for child in file.read().split())
+    except FileNotFoundError:
+        return total or None
+    return total
+
+
+def start_server(args, stub, port, log_file):
+    env = dict(os.environ)
+    env.update({
+        "OPENAI_API_KEY": "stub",
+        "OPENAI_BASE_URL": stub.url + "/v1",
+        "OPENAI_API_BASE": stub.url + "/v1",
+        "SEARCH_ENDPOINT": stub.url,
+        "SEARCH_API_KEY": "stub",
+        "INDEX_NAME": "benchmark",
+        "WEB_CONCURRENCY": str(args.workers),
+        "THREADS": str(args.threads),
+        "LOG_LEVEL": "warning"
+    })
+    if args.server == "gunicorn":
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "--bind", f"127.0.0.1:{port}",
+                   "--access-logfile", os.devnull, "App:app"]
+    else:
+        command = [sys.executable, "-m", "flask", "--app", "App", "run", "--port", str(port), "--with-threads"]
+    started = time.monotonic()
+    process = subprocess.Popen(command, cwd=HERE, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}; see {log_file.name}")
+        try:
+            if requests.get(url + "/ready", timeout=5).status_code == 200:
+                return process, url, time.monotonic() - started
+        except (requests.ConnectionError, requests.Timeout):
+            # Workers are still importing; the listening socket accepts before they can answer
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Server not ready after {args.startup_timeout}s; see {log_file.name}")
+
+
+def stage_means(metrics_text):
+    """{stage: [sum seconds, count]} from a /metrics scrape."""
+    stages = {}
+    for line in metrics_text.splitlines():
+        for suffix, slot in (("_sum", 0), ("_count", 1)):
+            prefix = f"rag_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                stage, value = line[len(prefix):].split("\"} ")
+                stages.setdefault(stage, [0.0, 0])[slot] = float(value)
+    return stages
+
+
+def run_level(url, queries, concurrency, total_requests, pid, unique_queries=True):
+    counter = itertools.count()
+    latencies, errors = [], 0
+    lock = threading.Lock()
+    peak_rss = [process_tree_rss(pid) or 0]
+    done = threading.Event()
+
+    def sample_memory():
+        while not done.wait(0.2):
+            peak_rss[0] = max(peak_rss[0], process_tree_rss(pid) or 0)
+
+    def worker():
+        nonlocal errors
+        session = requests.Session()
+        while True:
+            i = next(counter)
+            if i >= total_requests:
+                break
+            query = queries[i % len(queries)]
+            if unique_queries:
+                # A distinct query per request keeps the response cache out of the measurement
+                query = f"{query} (request {next(_query_ids)})"
+            start = time.perf_counter()
+            try:
+                response = session.post(url + "/retrieve", json={"user_query": query}, timeout=300)
+                failed = response.status_code != 200 or bool(response.json().get("error"))
+            except requests.RequestException:
+                failed = True
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                errors += failed
+        session.close()
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    done.set()
+    sampler.join()
+
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(wall, 3),
+        "throughput_rps": round(len(latencies) / wall, 2),
+        "latency_ms": {
+            "p50": round(float(np.percentile(latencies_ms, 50)), 2),
+            "p95": round(float(np.percentile(latencies_ms, 95)), 2),
+            "p99": round(float(np.percentile(latencies_ms, 99)), 2),
+            "mean": round(float(latencies_ms.mean()), 2),
+            "max": round(float(latencies_ms.max()), 2)
+        },
+        "rss_mb": round((process_tree_rss(pid) or 0) / 2**20, 1),
+        "peak_rss_mb": round(peak_rss[0] / 2**20, 1)
+    }
+
+
+def git_revision():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=HERE, capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown", False
+
+
+def load_questions(path):
+    import csv
+    with open(path, "r") as file:
+        return [line[1] for line in csv.reader(file, delimiter="\t") if len(line) >= 3]
+
+
+def run(args):
+    stub = StubBackend(
+        LatencyDistribution(args.chat_latency),
+        LatencyDistribution(args.embedding_latency),
+        LatencyDistribution(args.search_latency),
+        chunk_words=args.chunk_words
+    ).start()
+    os.makedirs(os.path.join(HERE, RESULTS_DIR), exist_ok=True)
+    queries = load_questions(os.path.join(HERE, args.qa))
+    commit, dirty = git_revision()
+    timestamp = time.strftime("%Y%m%dT%H%M%S")
+
+    with open(os.path.join(HERE, RESULTS_DIR, "server.log"), "w") as log_file:
+        process, url, startup = start_server(args, stub, free_port(), log_file)
+        print(f"ready after {startup:.2f}s")
+        levels = []
+        try:
+            if args.warmup:
+                run_level(url, queries, min(args.concurrency), args.warmup, process.pid)
+            for concurrency in args.concurrency:
+                before = stage_means(requests.get(url + "/metrics").text)
+                level = run_level(url, queries, concurrency, args.requests, process.pid, not args.repeat_queries)
+                # Let the other gunicorn workers write out their metrics for this level
+                time.sleep(FLUSH_SECONDS + 0.5 if args.server == "gunicorn" else 0)
+                level["stage_ms"] = {}
+                for stage, (total, count) in sorted(stage_means(requests.get(url + "/metrics").text).items()):
+                    old_total, old_count = before.get(stage, (0.0, 0))
+                    if count > old_count:
+                        level["stage_ms"][stage] = round((total - old_total) / (count - old_count) * 1000, 2)
+                levels.append(level)
+                print(format_level(level))
+        finally:
+            process.terminate()
+            process.wait(timeout=60)
+            stub.stop()
+
+    result = {
+        "commit": commit,
+        "dirty": dirty,
+        "timestamp": timestamp,
+        "config": {
+            "server": args.server,
+            "workers": args.workers,
+            "threads": args.threads,
+            "chat_latency": args.chat_latency,
+            "embedding_latency": args.embedding_latency,
+            "search_latency": args.search_latency,
+            "chunk_words": args.chunk_words,
+            "requests": args.requests,
+            "repeat_queries": args.repeat_queries,
+            "retrieval_mode": os.getenv("RETRIEVAL_MODE") or "default",
+            "reranker": os.getenv("RERANKER") or None,
+            "python": sys.version.split()[0]
+        },
+        "startup_seconds": round(startup, 3),
+        "levels": levels
+    }
+    path = args.output or os.path.join(HERE, RESULTS_DIR, f"{timestamp}-{commit}{'-dirty' if dirty else ''}.json")
+    with open(path, "w") as file:
+        json.dump(result, file, indent=2)
+    print(f"Saved {path}")
+
+
+# (name, code timed in a fresh interpreter)
+STARTUP_STEPS = (
+    ("interpreter", "pass"),
+    ("import App", "import App"),
+    ("import App + RAG system", "import App; App.get_rag_system()"),
+    ("import eval_script", "import eval_script")
+)
+
+
+def startup(repeats=5):
+    """Median seconds of each STARTUP_STEPS entry, each run in a new Python process without credentials."""
+    env = {key: value for key, value in os.environ.items() if key not in ("OPENAI_API_KEY", "SEARCH_API_KEY")}
+    env["OPENAI_API_KEY"] = "unused"
+    timings = {}
+    for name, code in STARTUP_STEPS:
+        script = f"import time; start = time.perf_counter(); {code}; print(time.perf_counter() - start)"
+        runs = [
+            float(subprocess.run([sys.executable, "-c", script], cwd=HERE, env=env, capture_output=True, text=True, check=True).stdout)
+            for _ in range(repeats)
+        ]
+        timings[name] = sorted(runs)[len(runs) // 2]
+        print(f"{name:<26} {timings[name] * 1000:>8.0f} ms")
+    return timings
+
+
+def format_level(level):
+    latency = level["latency_ms"]
+    return (
+        f"c={level['concurrency']:<4} {level['throughput_rps']:>8.1f} req/s  "
+        f"p50 {latency['p50']:>8.1f}  p95 {latency['p95']:>8.1f}  p99 {latency['p99']:>8.1f} ms  "
+        f"errors {level['errors']:<4} rss {level['rss_mb']:.0f} MB (peak {level['peak_rss_mb']:.0f})"
+    )
+
+
+def compare(base_path, new_path, threshold):
+    """Print per-concurrency deltas; returns True if any metric regressed by more than threshold."""
+    with open(base_path) as file:
+        base = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+    if base["config"] != new["config"]:
+        changed = sorted(key for key in set(base["config"]) | set(new["config"]) if base["config"].get(key) != new["config"].get(key))
+        print(f"warning: configs differ in {', '.join(changed)}")
+
+    # (name, getter, True if higher is better)
+    columns = (
+        ("p50 ms", lambda level: level["latency_ms"]["p50"], False),
+        ("p95 ms", lambda level: level["latency_ms"]["p95"], False),
+        ("p99 ms", lambda level: level["latency_ms"]["p99"], False),
+        ("req/s", lambda level: level["throughput_rps"], True),
+        ("peak MB", lambda level: level["peak_rss_mb"], False)
+    )
+    gated = {"p95 ms", "p99 ms", "req/s", "peak MB"}
+    print(f"{base['commit']} -> {new['commit']}")
+    if "startup_seconds" in base and "startup_seconds" in new:
+        print(f"startup {base['startup_seconds']:.2f}s -> {new['startup_seconds']:.2f}s")
+    regressed = False
+    base_levels = {level["concurrency"]: level for level in base["levels"]}
+    for level in new["levels"]:
+        old = base_levels.get(level["concurrency"])
+        if old is None:
+            continue
+        cells = []
+        for name, get, higher_is_better in columns:
+            before, after = get(old), get(level)
+            change = (after - before) / before if before else 0.0
+            worse = -change if higher_is_better else change
+            flag = ""
+            if name in gated and worse > threshold:
+                flag, regressed = " !", True
+            cells.append(f"{name} {before:.1f} -> {after:.1f} ({change:+.0%}){flag}")
+        print(f"c={level['concurrency']:<4} " + "  ".join(cells))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    bench = commands.add_parser("run", help="load-test /retrieve against stubbed backends")
+    bench.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    bench.add_argument("--requests", type=int, default=200, help="requests per concurrency level")
+    bench.add_argument("--warmup", type=int, default=20, help="unmeasured requests before the first level")
+    bench.add_argument("--chat-latency", default="lognormal:0.8,0.4")
+    bench.add_argument("--embedding-latency", default="lognormal:0.05,0.3")
+    bench.add_argument("--search-latency", default="lognormal:0.08,0.3")
+    bench.add_argument("--chunk-words", type=int, default=300, help="words per stub search result")
+    bench.add_argument("--server", choices=["gunicorn", "flask"], default="gunicorn")
+    bench.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    bench.add_argument("--threads", type=int, default=32, help="gunicorn threads per worker")
+    bench.add_argument("--repeat-queries", action="store_true", help="reuse qa.tsv questions verbatim so the response cache can hit")
+    bench.add_argument("--qa", default="qa.tsv")
+    bench.add_argument("--startup-timeout", type=float, default=120)
+    bench.add_argument("--output", help="result path (default benchmarks/<timestamp>-<commit>.json)")
+
+    cold = commands.add_parser("startup", help="time module imports in fresh processes")
+    cold.add_argument("--repeats", type=int, default=5)
+
+    diff = commands.add_parser("compare", help="compare two result files")
+    diff.add_argument("base")
+    diff.add_argument("new")
+    diff.add_argument("--threshold", type=float, default=0.1, help="relative change counted as a regression")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    elif args.command == "startup":
+        startup(args.repeats)
+    elif compare(args.base, args.new, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+import threading
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+
+from retrievers import BaseRetriever
+from corpus_store import CorpusStore, chunk_position, load_documents
+
+
+def stitch(chunks):
+    """Join consecutive chunks of one document, dropping the text each repeats from the previous one."""
+    text = ""
+    for chunk in chunks:
+        if text:
+            probe = chunk[:32]
+            # Overlaps come from the splitter, so they are exact: a suffix of text is a prefix of chunk
+            start = text.find(probe, max(0, len(text) - len(chunk)))
+            while start != -1 and not chunk.startswith(text[start:]):
+                start = text.find(probe, start + 1)
+            text = text[:start] + chunk if start != -1 else text + "\n\n" + chunk
+        else:
+            text = chunk
+    return text
+
+
+class ChunkStore:
+    """
+    Chunks grouped by parent_id in reading order, for expanding retrieved chunks into their
+    neighbors or whole parent. documents is the same rows a LocalVectorIndex holds (or that an
+    exported Azure index was written to). A CorpusStore already carries the parent grouping;
+    for a plain list it is built here. parent_chunks() resolves many parents in one call and
+    keeps the most recently used parents' chunk texts in an LRU of cache_parents entries.
+    """
+    def __init__(self, documents, cache_parents=256):
+        self.documents = documents
+        self.cache_parents = cache_parents
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._corpus = documents if isinstance(documents, CorpusStore) else None
+        if self._corpus is not None:
+            return
+        rows = defaultdict(list)
+        for row, document in enumerate(documents):
+            metadata = document["metadata"]
+            if metadata.get("parent_id"):
+                position = chunk_position(metadata.get("chunk_id"))
+                rows[metadata["parent_id"]].append((row if position is None else position, row))
+        self._rows = {}
+        self._locations = {}
+        for parent_id, entries in rows.items():
+            ordered = [row for _, row in sorted(entries)]
+            self._rows[parent_id] = ordered
+            for index, row in enumerate(ordered):
+                self._locations[documents[row]["metadata"].get("chunk_id")] = (parent_id, index)
+
+    @classmethod
+    def load(cls, path, cache_parents=256):
+        """Load the chunks of a local index directory."""
+        return cls(load_documents(path), cache_parents)
+
+    def _parent_rows(self, parent_id):
+        if self._corpus is not None:
+            return self._corpus.rows_of_parent(parent_id)
+        return self._rows.get(parent_id, [])
+
+    def locate(self, chunk_id):
+        """(parent_id, index within the parent) of a chunk, or None if the store doesn't have it."""
+        if self._corpus is None:
+            return self._locations.get(chunk_id)
+        row = self._corpus.row_of(chunk_id) if chunk_id else None
+        if row is None or self._corpus.parent[row] < 0:
+            return None
+        parent_id = self._corpus.parent_ids[int(self._corpus.parent[row])]
+        index = int(np.flatnonzero(self._corpus.rows_of_parent(parent_id) == row)[0])
+        return parent_id, index
+
+    def chunk_ids(self, parent_id, low, high):
+        """Ids of the chunks at positions low..high (inclusive) of a parent."""
+        rows = self._parent_rows(parent_id)[low:high + 1]
+        if self._corpus is not None:
+            return [self._corpus.chunk_ids[row] for row in rows]
+        return [self.documents[row]["metadata"].get("chunk_id") for row in rows]
+
+    def parent_chunks(self, parent_ids):
+        """{parent_id: [chunk text, ...] in reading order} for every known parent in parent_ids."""
+        found, missing = {}, []
+        with self._lock:
+            for parent_id in parent_ids:
+                chunks = self._cache.get(parent_id)
+                if chunks is not None:
+                    self._cache.move_to_end(parent_id)
+                    found[parent_id] = chunks
+                    self.hits += 1
+                elif len(self._parent_rows(parent_id)):
+                    missing.append(parent_id)
+                    self.misses += 1
+        text = self._corpus.text if self._corpus is not None else None
+        for parent_id in missing:
+            rows = self._parent_rows(parent_id)
+            found[parent_id] = [text[row] if text is not None else self.documents[row]["page_content"] for row in rows]
+        if missing:
+            with self._lock:
+                for parent_id in missing:
+                    self._cache[parent_id] = found[parent_id]
+                while len(self._cache) > self.cache_parents:
+                    self._cache.popitem(last=False)
+        return found
+
+
+class ParentExpandingRetriever(BaseRetriever):
+    """
+    Small-to-big retrieval: ranks chunks with retriever, then widens each hit from the chunk
+    store before it goes into the prompt. mode "neighbors" adds `window` chunks on each side;
+    mode "parent" grows the window outwards up to max_chars of the parent document. Windows
+    that overlap or touch within a parent are merged into one document, ranked by its best hit.
+    Hits the store doesn't know are passed through unchanged.
+    """
+    def __init__(self, retriever, store, k=5, mode="neighbors", window=1, max_chars=8000):
+        super().__init__(k)
+        if mode not in ("neighbors", "parent"):
+            raise ValueError(f"Unknown expansion mode: {mode}")
+        self.retriever = retriever
+        self.store = store
+        self.mode = mode
+        self.window = window
+        self.max_chars = max_chars
+
+    def _window(self, chunks, index):
+        if self.mode == "neighbors":
+            return max(0, index - self.window), min(len(chunks) - 1, index + self.window)
+        low = high = index
+        size = len(chunks[index])
+        while low > 0 or high < len(chunks) - 1:
+            grew = False
+            for side in (-1, 1):
+                candidate = low - 1 if side < 0 else high + 1
+                if 0 <= candidate < len(chunks) and size + len(chunks[candidate]) <= self.max_chars:
+                    size += len(chunks[candidate])
+                    low, high = min(low, candidate), max(high, candidate)
+                    grew = True
+            if not grew:
+                break
+        return low, high
+
+    def get_relevant_documents(self, query, k=None):
+        hits = self.retriever.get_relevant_documents(query, k or self.k)
+        locations = [self.store.locate(doc["metadata"].get("chunk_id")) for doc in hits]
+        parents = self.store.parent_chunks({location[0] for location in locations if location})
+
+        # (rank of best hit, document) per output; windows are collected per parent and merged
+        windows = defaultdict(list)
+        results = []
+        for rank, (doc, location) in enumerate(zip(hits, locations)):
+            if location is None or location[0] not in parents:
+                results.append((rank, doc))
+                continue
+            parent_id, index = location
+            low, high = self._window(parents[parent_id], index)
+            windows[parent_id].append([low, high, rank, doc])
+
+        for parent_id, spans in windows.items():
+            chunks = parents[parent_id]
+            spans.sort(key=lambda span: span[0])
+            merged = [spans[0]]
+            for low, high, rank, doc in spans[1:]:
+                last = merged[-1]
+                if low <= last[1] + 1:
+                    last[1] = max(last[1], high)
+                    if rank < last[2]:
+                        last[2], last[3] = rank, doc
+                else:
+                    merged.append([low, high, rank, doc])
+            for low, high, rank, doc in merged:
+                results.append((rank, {
+                    "page_content": stitch(chunks[low:high + 1]),
+                    "metadata": {
+                        **doc["metadata"],
+                        "chunk_ids": self.store.chunk_ids(parent_id, low, high)
+                    },
+                    "score": doc.get("score")
+                }))
+
+        results.sort(key=lambda result: result[0])
+        return [doc for _, doc in results]
+
+    def close(self):
+        self.retriever.close()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import re
+
+
+def find_pdfs(folder):
+    paths = []
+    for root, _, files in os.walk(folder):
+        for file in files:
+            if file.lower().endswith(".pdf"):
+                paths.append(os.path.join(root, file))
+    return sorted(paths)
+
+
+def extract_pdf_text(path):
+    """Return (path, text, error). Top-level so it can run in a process pool."""
+    from PyPDF2 import PdfReader
+
+    try:
+        reader = PdfReader(path)
+        pages = [page.extract_text() or "" for page in reader.pages]
+        return path, "\n\n".join(pages), None
+    except Exception as e:
+        return path, "", str(e)
+
+
+def split_text(text, chunk_size=2000, chunk_overlap=200):
+    """
+    Split text into chunks of at most chunk_size characters, consecutive chunks sharing about
+    chunk_overlap characters. Cuts prefer paragraph, then line, then word boundaries.
+    """
+    if chunk_overlap >= chunk_size:
+        raise ValueError("chunk_overlap must be smaller than chunk_size")
+    text = re.sub(r"[ \t]+", " ", text).strip()
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = min(start + chunk_size, len(text))
+        if end < len(text):
+            window = text[start:end]
+            # Don't accept a boundary in the first half of the window, or chunks get tiny
+            for separator in ("\n\n", "\n", " "):
+                cut = window.rfind(separator, chunk_size // 2)
+                if cut != -1:
+                    end = start + cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= len(text):
+            break
+        start = max(end - chunk_overlap, start + 1)
+        # Begin overlapping chunks on a word boundary
+        space = text.find(" ", start, end)
+        if space != -1:
+            start = space + 1
+    return chunks
+
+
+def parent_id_for(path, root):
+    return hashlib.sha1(os.path.relpath(path, root).encode("utf-8")).hexdigest()[:16]
+
+
+def chunk_documents(path, text, root, chunk_size=2000, chunk_overlap=200):
+    """Chunk one file's text into documents with the same metadata fields as the Azure index."""
+    parent_id = parent_id_for(path, root)
+    title = os.path.basename(path)
+    return [
+        {
+            "page_content": chunk,
+            "metadata": {
+                "chunk_id": f"{parent_id}_chunk_{i}",
+                "parent_id": parent_id,
+                "title": title
+            }
+        }
+        for i, chunk in enumerate(split_text(text, chunk_size, chunk_overlap))
+    ]
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import logging
+import re
+import zlib
+
+import numpy as np
+import tiktoken
+
+logger = logging.getLogger(__name__)
+
+MERSENNE_PRIME = (1 << 61) - 1
+CHARS_PER_TOKEN = 4
+
+
+class EstimatedEncoding:
+    """
+    Stands in for a tiktoken encoding that couldn't be loaded (tiktoken downloads it on first
+    use): one "token" per CHARS_PER_TOKEN characters, the estimate eval_runner.py uses too.
+    """
+    def encode(self, text):
+        return [text[i:i + CHARS_PER_TOKEN] for i in range(0, len(text), CHARS_PER_TOKEN)]
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+def load_encoding(model_name):
+    """The model's tiktoken encoding (cl100k_base for unknown models), or an EstimatedEncoding."""
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("Couldn't load the tokenizer for %s, estimating %d characters per token: %s", model_name, CHARS_PER_TOKEN, e)
+        return EstimatedEncoding()
+
+
+class ContextBuilder:
+    """
+    Assembles the prompt context from retrieved documents: orders them by score, drops
+    near-duplicates (MinHash estimate of word-shingle Jaccard similarity at or above
+    dedup_threshold), and fills up to token_budget tokens, truncating the last chunk that fits
+    partially when at least min_chunk_tokens of it would remain.
+    """
+    def __init__(self, model_name="gpt-4o-mini", token_budget=3000, dedup_threshold=0.8,
+                 shingle_size=5, num_hashes=64, min_chunk_tokens=50, separator="\n\n"):
+        self.encoding = load_encoding(model_name)
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+        self.shingle_size = shingle_size
+        self.min_chunk_tokens = min_chunk_tokens
+        self.separator = separator
+        self._separator_tokens = len(self.encoding.encode(separator))
+        rng = np.random.default_rng(0)
+        # a < 2**31 and crc32 shingle hashes < 2**32 keep a*x + b below 2**64, so uint64 never wraps
+        self._a = rng.integers(1, 1 << 31, size=num_hashes, dtype=np.uint64)
+        self._b = rng.integers(0, MERSENNE_PRIME, size=num_hashes, dtype=np.uint64)
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.encoding.encode(text))
+
+    def minhash(self, text: str):
+        words = re.findall(r"\w+", text.lower())
+        size = min(self.shingle_size, len(words)) or 1
+        shingles = {" ".join(words[i:i + size]) for i in range(max(len(words) - size + 1, 1))}
+        hashes = np.array([zlib.crc32(shingle.encode("utf-8")) for shingle in shingles], dtype=np.uint64)
+        # (a*x + b) mod p for every (hash function, shingle) pair
+        permuted = (self._a[:, None] * hashes[None, :] + self._b[:, None]) % MERSENNE_PRIME
+        return permuted.min(axis=1)
+
+    def build(self, docs):
+        """
+        Return {"context", "docs", "tokens", "original_tokens", "duplicates", "truncated"}, where
+        "docs" are the documents that made it into the context, in retrieval order.
+        """
+        original_tokens = 0
+        # Stable sort: documents without a score keep their retrieval order
+        order = sorted(range(len(docs)), key=lambda i: -(docs[i].get("score") or 0.0))
+        signatures = []
+        selected = {}
+        duplicates = 0
+        truncated = False
+        used = 0
+        for i in order:
+            text = docs[i]["page_content"]
+            tokens = self.encoding.encode(text)
+            original_tokens += len(tokens)
+            if self.dedup_threshold is not None:
+                signature = self.minhash(text)
+                if any(np.mean(signature == other) >= self.dedup_threshold for other in signatures):
+                    duplicates += 1
+                    continue
+                signatures.append(signature)
+            separator = self._separator_tokens if selected else 0
+            if self.token_budget is not None and used + separator + len(tokens) > self.token_budget:
+                remaining = self.token_budget - used - separator
+                if remaining >= self.min_chunk_tokens:
+                    selected[i] = self.encoding.decode(tokens[:remaining])
+                    used += separator + remaining
+                    truncated = True
+                continue
+            selected[i] = text
+            used += separator + len(tokens)
+
+        # The prompt lists context by relevance; sources are reported in retrieval order
+        context = self.separator.join(selected[i] for i in order if i in selected)
+        return {
+            "context": context,
+            "docs": [docs[i] for i in sorted(selected)],
+            "tokens": used,
+            "original_tokens": original_tokens,
+            "duplicates": duplicates,
+            "truncated": truncated
+        }
+
+
+def main():
+    import csv
+    import os
+    import statistics
+    import time
+    from RAG_Core import PDFRAGSystem
+
+    rag_system = PDFRAGSystem(api_key=os.getenv("OPENAI_API_KEY"), search_endpoint=os.getenv("SEARCH_ENDPOINT"), search_api_key=os.getenv("SEARCH_API_KEY"), index_name=os.getenv("INDEX_NAME"), local_index_path=os.getenv("LOCAL_INDEX_PATH"), retrieval_mode=os.getenv("RETRIEVAL_MODE"))
+    with open("qa.tsv", "r") as file:
+        questions = [line[1] for line in csv.reader(file, delimiter="\t") if len(line) >= 3]
+
+    builder = rag_system.context_builder
+    original, built, seconds = [], [], []
+    for question in questions:
+        docs = rag_system.retriever.get_relevant_documents(question)
+        start = time.perf_counter()
+        result = builder.build(docs)
+        seconds.append(time.perf_counter() - start)
+        original.append(builder.count_tokens("\n\n".join(doc["page_content"] for doc in docs)))
+        built.append(result["tokens"])
+
+    print(f"questions: {len(questions)}")
+    print(f"context tokens (joined verbatim): mean {statistics.mean(original):.0f}, total {sum(original)}")
+    print(f"context tokens (context builder): mean {statistics.mean(built):.0f}, total {sum(built)}")
+    print(f"saved: {1 - sum(built) / max(sum(original), 1):.1%}")
+    print(f"build latency: mean {statistics.mean(seconds) * 1000:.2f} ms, max {max(seconds) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
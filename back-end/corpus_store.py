@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+from array import array
+from collections.abc import Sequence
+
+import numpy as np
+
+CORPUS_DIR = "corpus"
+DOCUMENTS_FILE = "documents.jsonl"
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def chunk_position(chunk_id):
+    """Order of a chunk within its parent: the trailing number of its id ("<parent>_chunk_3" -> 3)."""
+    match = re.search(r"(\d+)$", chunk_id or "")
+    return int(match.group(1)) if match else None
+
+
+class StringColumn:
+    """Strings stored as one contiguous UTF-8 blob plus an (n + 1) int64 offsets array, both memory-mapped."""
+    def __init__(self, path, name):
+        self.offsets = np.load(os.path.join(path, f"{name}.offsets.npy"), mmap_mode="r")
+        blob_path = os.path.join(path, f"{name}.bin")
+        if os.path.getsize(blob_path):
+            self.blob = np.memmap(blob_path, dtype=np.uint8, mode="r")
+        else:
+            self.blob = np.empty(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, i) -> memoryview:
+        """The UTF-8 bytes of string i, without copying them out of the mapping."""
+        return memoryview(self.blob[self.offsets[i]:self.offsets[i + 1]])
+
+    def __getitem__(self, i) -> str:
+        return str(self.raw(i), "utf-8")
+
+
+class StringColumnWriter:
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.offsets = array("q", [0])
+        self._blob = open(os.path.join(path, f"{name}.bin"), "wb")
+
+    def append(self, value: str):
+        data = (value or "").encode("utf-8")
+        self._blob.write(data)
+        self.offsets.append(self.offsets[-1] + len(data))
+
+    def close(self):
+        self._blob.close()
+        np.save(os.path.join(self.path, f"{self.name}.offsets.npy"), np.frombuffer(self.offsets, dtype=np.int64))
+
+
+class CorpusStore(Sequence):
+    """
+    Read-only columnar store of a chunked corpus, memory-mapped so every worker process on a
+    host shares one copy through the page cache:
+      text, chunk_id       string columns (offsets + UTF-8 blob), one entry per chunk row
+      parent, position     int32 columns: parent number and order within the parent
+      parent_id            string column, one entry per parent
+      title, titles        int32 column of title numbers into the deduplicated titles column
+      parent_rows          chunk rows grouped by parent in reading order (CSR via parent_offsets)
+      chunk_hashes         sorted 64-bit chunk_id hashes with their rows (chunk_hash_rows)
+    Rows are addressed by the same integer ids as the embedding matrix. Indexing returns the
+    {"page_content", "metadata"} dicts the retrievers use, built only for the rows asked for.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.text = StringColumn(path, "text")
+        self.chunk_ids = StringColumn(path, "chunk_id")
+        self.parent = np.load(os.path.join(path, "parent.npy"), mmap_mode="r")
+        self.position = np.load(os.path.join(path, "position.npy"), mmap_mode="r")
+        self.parent_ids = StringColumn(path, "parent_id")
+        self.title = np.load(os.path.join(path, "title.npy"), mmap_mode="r")
+        self.titles = StringColumn(path, "titles")
+        self.parent_rows = np.load(os.path.join(path, "parent_rows.npy"), mmap_mode="r")
+        self.parent_offsets = np.load(os.path.join(path, "parent_offsets.npy"), mmap_mode="r")
+        self.chunk_hashes = np.load(os.path.join(path, "chunk_hashes.npy"), mmap_mode="r")
+        self.chunk_hash_rows = np.load(os.path.join(path, "chunk_hash_rows.npy"), mmap_mode="r")
+        # Parents are few compared to chunks, so their id lookup can be an ordinary dict
+        self._parent_numbers = {self.parent_ids[i]: i for i in range(len(self.parent_ids))}
+
+    def __len__(self):
+        return len(self.text)
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        row = int(row)
+        if row < 0:
+            row += len(self)
+        return {"page_content": self.text[row], "metadata": self.metadata(row)}
+
+    def metadata(self, row):
+        parent, title = int(self.parent[row]), int(self.title[row])
+        return {
+            "chunk_id": self.chunk_ids[row] or None,
+            "parent_id": self.parent_ids[parent] if parent >= 0 else None,
+            "title": self.titles[title] if title >= 0 else None
+        }
+
+    def row_of(self, chunk_id):
+        """Row of a chunk id, or None."""
+        target = np.uint64(_hash(chunk_id))
+        i = int(np.searchsorted(self.chunk_hashes, target))
+        while i < len(self.chunk_hashes) and self.chunk_hashes[i] == target:
+            row = int(self.chunk_hash_rows[i])
+            if self.chunk_ids[row] == chunk_id:
+                return row
+            i += 1
+        return None
+
+    def rows_of_parent(self, parent_id):
+        """Chunk rows of a parent in reading order (an empty array for an unknown parent)."""
+        parent = self._parent_numbers.get(parent_id)
+        if parent is None:
+            return self.parent_rows[:0]
+        return self.parent_rows[self.parent_offsets[parent]:self.parent_offsets[parent + 1]]
+
+
+class CorpusWriter:
+    """
+    Streams documents into a CorpusStore directory; nothing but the offsets and small per-row
+    integer columns is held in memory, so corpora larger than RAM can be written.
+    """
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.text = StringColumnWriter(path, "text")
+        self.chunk_ids = StringColumnWriter(path, "chunk_id")
+        self.parent = array("i")
+        self.position = array("i")
+        self.title = array("i")
+        self.hashes = array("Q")
+        self._parents = {}
+        self._counts = []
+        self._titles = {}
+
+    def append(self, documents):
+        for document in documents:
+            metadata = document["metadata"]
+            chunk_id = metadata.get("chunk_id") or ""
+            self.text.append(document["page_content"])
+            self.chunk_ids.append(chunk_id)
+            self.hashes.append(_hash(chunk_id))
+            title = metadata.get("title")
+            self.title.append(-1 if title is None else self._titles.setdefault(title, len(self._titles)))
+            parent_id = metadata.get("parent_id")
+            if parent_id is None:
+                self.parent.append(-1)
+                self.position.append(0)
+                continue
+            parent = self._parents.get(parent_id)
+            if parent is None:
+                parent = self._parents[parent_id] = len(self._counts)
+                self._counts.append(0)
+            position = chunk_position(chunk_id)
+            self.parent.append(parent)
+            self.position.append(self._counts[parent] if position is None else position)
+            self._counts[parent] += 1
+
+    def close(self):
+        self.text.close()
+        self.chunk_ids.close()
+        for name, values in (("parent_id", self._parents), ("titles", self._titles)):
+            column = StringColumnWriter(self.path, name)
+            for value in values:
+                column.append(value)
+            column.close()
+        np.save(os.path.join(self.path, "title.npy"), np.frombuffer(self.title, dtype=np.int32))
+
+        parent = np.frombuffer(self.parent, dtype=np.int32)
+        position = np.frombuffer(self.position, dtype=np.int32)
+        np.save(os.path.join(self.path, "parent.npy"), parent)
+        np.save(os.path.join(self.path, "position.npy"), position)
+
+        rows = np.arange(len(parent), dtype=np.int64)
+        grouped = rows[parent >= 0]
+        order = np.lexsort((grouped, position[grouped], parent[grouped]))
+        np.save(os.path.join(self.path, "parent_rows.npy"), grouped[order])
+        counts = np.bincount(parent[grouped], minlength=len(self._counts))
+        np.save(os.path.join(self.path, "parent_offsets.npy"), np.concatenate([[0], np.cumsum(counts)]).astype(np.int64))
+
+        hashes = np.frombuffer(self.hashes, dtype=np.uint64)
+        order = np.argsort(hashes, kind="stable")
+        np.save(os.path.join(self.path, "chunk_hashes.npy"), hashes[order])
+        np.save(os.path.join(self.path, "chunk_hash_rows.npy"), rows[order])
+
+
+def build_corpus(index_path):
+    """Write the corpus store of an index directory from its documents.jsonl (older indexes)."""
+    target = os.path.join(index_path, CORPUS_DIR)
+    writer = CorpusWriter(target + ".tmp")
+    count = 0
+    with open(os.path.join(index_path, DOCUMENTS_FILE), "r", encoding="utf-8") as file:
+        batch = []
+        for line in file:
+            batch.append(json.loads(line))
+            if len(batch) >= 10000:
+                writer.append(batch)
+                count += len(batch)
+                batch = []
+        writer.append(batch)
+        count += len(batch)
+    writer.close()
+    if os.path.exists(target):
+        shutil.rmtree(target)
+    os.replace(target + ".tmp", target)
+    return count
+
+
+def load_documents(index_path):
+    """The chunk rows of an index directory: its CorpusStore, or a list read from documents.jsonl."""
+    corpus_path = os.path.join(index_path, CORPUS_DIR)
+    if os.path.exists(corpus_path):
+        return CorpusStore(corpus_path)
+    with open(os.path.join(index_path, DOCUMENTS_FILE), "r", encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped corpus store of a local index from its documents.jsonl.")
+    parser.add_argument("index_path")
+    args = parser.parse_args()
+    print(f"Wrote {build_corpus(args.index_path)} chunks to {os.path.join(args.index_path, CORPUS_DIR)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,205 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
+import json
 import os
-from azure.storage.blob import BlobServiceClient
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from types import SimpleNamespace
 
 # Replace with your Azure Storage account connection string
 CONNECTION_STRING = os.getenv("AZURE_STORAGE_CONNECTION_STRING")
 CONTAINER_NAME = "all-docs"  # Replace with your container name
+MANIFEST_FILE = ".upload_manifest.json"
+EXTENSIONS = ('.pdf', '.docx')
 
-def upload_files_to_blob(root_folder):
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def load_manifest(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+def save_manifest(path, manifest):
+    # Write to a temporary file first so an interrupted run never leaves a truncated manifest
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(manifest, file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+def scan_files(root_folder):
+    """Map blob name -> local path for every .pdf/.docx under root_folder."""
+    files = {}
+    for root, _, names in os.walk(root_folder):
+        for name in names:
+            if name.endswith(EXTENSIONS):
+                files[name] = os.path.join(root, name)  # Use only the file name as the blob name
+    return files
+
+
+class FilesystemContainer:
+    """
+    Local stand-in for azure.storage.blob.ContainerClient, storing blobs as files in a directory.
+    Implements the subset used by upload_files_to_blob so the pipeline can run without Azure.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def exists(self):
+        return os.path.isdir(self.path)
+
+    def create_container(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def upload_blob(self, name, data, overwrite=False, metadata=None, max_concurrency=1, **kwargs):
+        target = os.path.join(self.path, name)
+        if os.path.exists(target) and not overwrite:
+            raise FileExistsError(target)
+        with open(target + ".part", "wb") as file:
+            shutil.copyfileobj(data, file)
+        os.replace(target + ".part", target)
+        with open(target + ".metadata.json", "w") as file:
+            json.dump(metadata or {}, file)
+
+    def delete_blob(self, name, **kwargs):
+        for path in (os.path.join(self.path, name), os.path.join(self.path, name + ".metadata.json")):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def list_blobs(self, **kwargs):
+        for name in sorted(os.listdir(self.path)):
+            if name.endswith((".metadata.json", ".part")):
+                continue
+            with open(os.path.join(self.path, name + ".metadata.json")) as file:
+                yield SimpleNamespace(name=name, metadata=json.load(file))
+
+
+def azure_container(connection_string=CONNECTION_STRING, container_name=CONTAINER_NAME,
+                    max_block_size=4 * 1024 * 1024, max_single_put_size=8 * 1024 * 1024):
+    from azure.storage.blob import BlobServiceClient
+
+    # Files above max_single_put_size are split into max_block_size blocks and uploaded in parallel
+    blob_service_client = BlobServiceClient.from_connection_string(
+        connection_string,
+        max_block_size=max_block_size,
+        max_single_put_size=max_single_put_size
+    )
+    return blob_service_client.get_container_client(container_name)
+
+
+def upload_files_to_blob(root_folder, container_client, manifest_path=None, workers=8, block_concurrency=4, delete_missing=True):
+    """
+    Upload new or changed .pdf/.docx files under root_folder and delete blobs whose source file
+    is gone. A local manifest of content hashes decides what changed; files whose size and mtime
+    match the manifest are not re-hashed.
+    """
+    manifest_path = manifest_path or os.path.join(root_folder, MANIFEST_FILE)
+    manifest = load_manifest(manifest_path)
+    files = scan_files(root_folder)
+    stats = {"uploaded": 0, "unchanged": 0, "deleted": 0, "failed": 0, "bytes": 0}
+    lock = threading.Lock()
+
+    # Ensure the container exists (create if it doesn't)
+    if not container_client.exists():
+        container_client.create_container()
+
+    def fingerprint(blob_name, file_path):
+        stat = os.stat(file_path)
+        entry = manifest.get(blob_name)
+        if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry["sha256"], stat
+        return file_sha256(file_path), stat
+
+    def sync(blob_name, file_path):
+        sha256, stat = fingerprint(blob_name, file_path)
+        entry = {"sha256": sha256, "size": stat.st_size, "mtime": stat.st_mtime}
+        if manifest.get(blob_name, {}).get("sha256") == sha256:
+            return blob_name, entry, False
+        with open(file_path, "rb") as data:
+            container_client.upload_blob(
+                blob_name, data, overwrite=True, metadata={"sha256": sha256},
+                max_concurrency=block_concurrency
+            )
+        print(f"Uploaded: {file_path} as {blob_name}")
+        return blob_name, entry, True
+
+    start = time.perf_counter()
     try:
-        # Create a BlobServiceClient object
-        blob_service_client = BlobServiceClient.from_connection_string(CONNECTION_STRING)
-        container_client = blob_service_client.get_container_client(CONTAINER_NAME)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(sync, name, path): name for name, path in files.items()}
+            for future in as_completed(futures):
+                try:
+                    blob_name, entry, uploaded = future.result()
+                except Exception as ex:
+                    print(f"An error occurred uploading {futures[future]}: {ex}")
+                    stats["failed"] += 1
+                    continue
+                with lock:
+                    manifest[blob_name] = entry
+                if uploaded:
+                    stats["uploaded"] += 1
+                    stats["bytes"] += entry["size"]
+                else:
+                    stats["unchanged"] += 1
+
+        if delete_missing:
+            # Only blobs this pipeline uploaded (i.e. in the manifest) are candidates for deletion
+            for blob_name in sorted(set(manifest) - set(files)):
+                try:
+                    container_client.delete_blob(blob_name)
+                    print(f"Deleted: {blob_name}")
+                except Exception as ex:
+                    print(f"An error occurred deleting {blob_name}: {ex}")
+                    continue
+                del manifest[blob_name]
+                stats["deleted"] += 1
+    finally:
+        save_manifest(manifest_path, manifest)
 
-        # Ensure the container exists (create if it doesn't)
-        if not container_client.exists():
-            container_client.create_container()
+    elapsed = time.perf_counter() - start
+    stats["seconds"] = elapsed
+    stats["files_per_sec"] = stats["uploaded"] / elapsed if elapsed else 0.0
+    stats["bytes_per_sec"] = stats["bytes"] / elapsed if elapsed else 0.0
+    return stats
 
-        # Traverse the root folder and find .pdf and .docx files
-        for root, _, files in os.walk(root_folder):
-            for file in files:
-                if file.endswith(('.pdf', '.docx')):
-                    file_path = os.path.join(root, file)
-                    blob_name = file  # Use only the file name as the blob name
 
-                    # Upload the file to Azure Blob Storage
-                    blob_client = container_client.get_blob_client(blob_name)
-                    with open(file_path, "rb") as data:
-                        blob_client.upload_blob(data, overwrite=True)
-                    
-                    print(f"Uploaded: {file_path} as {blob_name}")
+def main():
+    parser = argparse.ArgumentParser(description="Sync downloaded documents to Azure Blob Storage.")
+    parser.add_argument("root_folder", nargs="?", default="downloaded_pdfs", help="folder containing the files")
+    parser.add_argument("--workers", type=int, default=8, help="files uploaded in parallel")
+    parser.add_argument("--block-concurrency", type=int, default=4, help="parallel block uploads per large file")
+    parser.add_argument("--manifest", default=None, help=f"defaults to <root_folder>/{MANIFEST_FILE}")
+    parser.add_argument("--keep-missing", action="store_true", help="don't delete blobs whose source file is gone")
+    parser.add_argument("--local-container", default=None, help="upload to this directory instead of Azure")
+    args = parser.parse_args()
 
-    except Exception as ex:
-        print(f"An error occurred: {ex}")
+    if args.local_container:
+        container_client = FilesystemContainer(args.local_container)
+    else:
+        container_client = azure_container()
 
+    stats = upload_files_to_blob(
+        args.root_folder, container_client, manifest_path=args.manifest, workers=args.workers,
+        block_concurrency=args.block_concurrency, delete_missing=not args.keep_missing
+    )
+    print(
+        f"{stats['uploaded']} uploaded, {stats['unchanged']} unchanged, {stats['deleted']} deleted, "
+        f"{stats['failed']} failed in {stats['seconds']:.1f}s "
+        f"({stats['files_per_sec']:.1f} files/s, {stats['bytes_per_sec'] / 1e6:.1f} MB/s)"
+    )
 
-# Replace with the path to your root folder containing the files
-ROOT_FOLDER = "/Users/shiven/Desktop/RAGatouille/back-end/downloaded_pdfs"
 
-upload_files_to_blob(ROOT_FOLDER)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+
+class EmbeddingCache:
+    """
+    Persistent float32 embeddings keyed by a hash of model + chunk text, so re-ingesting a
+    corpus only embeds chunks whose content changed.
+    """
+    def __init__(self, path="embedding_cache.sqlite3", model="text-embedding-ada-002"):
+        self.path = path
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+        self._conn.commit()
+
+    def key(self, text: str) -> str:
+        return hashlib.sha256((self.model + "\0" + text).encode("utf-8")).hexdigest()
+
+    def get_many(self, texts):
+        """Return a list aligned with texts holding a vector or None for each."""
+        keys = [self.key(text) for text in texts]
+        found = {}
+        with self._lock:
+            # SQLite limits the number of bound parameters per statement
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})", batch
+                ).fetchall()
+                found.update(rows)
+        vectors = [np.frombuffer(found[key], dtype=np.float32) if key in found else None for key in keys]
+        hits = sum(vector is not None for vector in vectors)
+        self.hits += hits
+        self.misses += len(vectors) - hits
+        return vectors
+
+    def put_many(self, texts, vectors):
+        rows = [(self.key(text), np.asarray(vector, dtype=np.float32).tobytes()) for text, vector in zip(texts, vectors)]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def embed_with_cache(texts, embed_documents, cache=None):
+    """Embed texts in one embed_documents call for the cache misses; returns an (n, dim) array."""
+    vectors = cache.get_many(texts) if cache is not None else [None] * len(texts)
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        fresh = embed_documents([texts[i] for i in missing])
+        for i, vector in zip(missing, fresh):
+            vectors[i] = np.asarray(vector, dtype=np.float32)
+        if cache is not None:
+            cache.put_many([texts[i] for i in missing], [vectors[i] for i in missing])
+    return np.stack(vectors) if vectors else np.empty((0, 0), dtype=np.float32)
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+import asyncio
+import random
+import re
+import time
+
+
+def estimate_tokens(messages, completion_tokens=16):
+    """Rough token count for a chat request (~4 characters per token)."""
+    chars = sum(len(message["content"]) for message in messages)
+    return chars // 4 + completion_tokens
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter for requests-per-minute and tokens-per-minute.
+    Either limit can be None to leave it unbounded.
+    """
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self._request_budget = float(requests_per_minute or 0)
+        self._token_budget = float(tokens_per_minute or 0)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self._updated
+        self._updated = now
+        if self.requests_per_minute:
+            self._request_budget = min(
+                self.requests_per_minute,
+                self._request_budget + elapsed * self.requests_per_minute / 60
+            )
+        if self.tokens_per_minute:
+            self._token_budget = min(
+                self.tokens_per_minute,
+                self._token_budget + elapsed * self.tokens_per_minute / 60
+            )
+
+    def _wait_time(self, tokens):
+        wait = max(0.0, self._paused_until - time.monotonic())
+        if self.requests_per_minute and self._request_budget < 1:
+            wait = max(wait, (1 - self._request_budget) * 60 / self.requests_per_minute)
+        if self.tokens_per_minute:
+            # A single request larger than the whole budget only has to wait for a full bucket
+            needed = min(tokens, self.tokens_per_minute)
+            if self._token_budget < needed:
+                wait = max(wait, (needed - self._token_budget) * 60 / self.tokens_per_minute)
+        return wait
+
+    def pause(self, seconds):
+        """Hold back every caller for the next `seconds`, e.g. after a 429."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def update_from_headers(self, headers, headroom=0.9):
+        """
+        Tune the limits from OpenAI's x-ratelimit-* response headers: adopt headroom times the
+        account's limits, and never let the local budget exceed what the server says remains.
+        """
+        self._refill()
+        for kind, limit_attr, budget_attr in (("requests", "requests_per_minute", "_request_budget"),
+                                              ("tokens", "tokens_per_minute", "_token_budget")):
+            limit = _header_number(headers, f"x-ratelimit-limit-{kind}")
+            remaining = _header_number(headers, f"x-ratelimit-remaining-{kind}")
+            if limit:
+                if not getattr(self, limit_attr):
+                    # First sighting of this limit: start from what the server says remains
+                    setattr(self, budget_attr, limit * headroom if remaining is None else remaining)
+                setattr(self, limit_attr, limit * headroom)
+            if remaining is not None and getattr(self, limit_attr):
+                setattr(self, budget_attr, min(getattr(self, budget_attr), remaining))
+
+    async def acquire(self, tokens=0):
+        async with self._lock:
+            while True:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    break
+                await asyncio.sleep(wait)
+            if self.requests_per_minute:
+                self._request_budget -= 1
+            if self.tokens_per_minute:
+                self._token_budget -= min(tokens, self.tokens_per_minute)
+
+
+def _header_number(headers, name):
+    try:
+        return float(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_duration(value):
+    """Seconds in an OpenAI reset header such as "20ms", "1s" or "6m0s"; None if unparseable."""
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value or "")
+    if not parts:
+        return None
+    scale = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+    return sum(float(number) * scale[unit] for number, unit in parts)
+
+
+def server_delay(headers, rate_limited=False):
+    """Seconds the server asks callers to wait: its Retry-After or, for a 429, the rate limit reset; None if unsaid."""
+    delay = _header_number(headers, "retry-after-ms")
+    delay = delay / 1000 if delay is not None else _header_number(headers, "retry-after")
+    if delay is None and rate_limited:
+        resets = [parse_duration(headers.get(f"x-ratelimit-reset-{kind}")) for kind in ("requests", "tokens")]
+        resets = [reset for reset in resets if reset]
+        delay = max(resets) if resets else None
+    return delay
+
+
+def backoff_delay(attempt, headers=None, base_delay=1.0, max_delay=60.0, rate_limited=False):
+    """
+    Seconds to wait before retry number attempt + 1: the server_delay when given, with a little
+    jitter so waiting callers don't return in lockstep; otherwise exponential backoff with full jitter.
+    """
+    delay = server_delay(headers, rate_limited) if headers is not None else None
+    if delay is not None:
+        return min(max_delay, delay * random.uniform(1.0, 1.2))
+    return random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+
+
+async def run_concurrently(items, fn, concurrency=8, progress=None):
+    """
+    Run the coroutine function fn over items with at most `concurrency` in flight.
+    Results are returned in input order regardless of completion order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    results = [None] * len(items)
+
+    async def run_one(index, item):
+        async with semaphore:
+            results[index] = await fn(item)
+        if progress is not None:
+            progress.update(1)
+
+    await asyncio.gather(*(run_one(i, item) for i, item in enumerate(items)))
+    return results
@@ -1,12 +1,36 @@
+import argparse
+import asyncio
 import csv
 import json
-from RAG_Core import PDFRAGSystem
 import os
 import sys
 import tqdm
-import openai
+from eval_runner import RateLimiter, estimate_tokens, run_concurrently
+from openai_transport import openai_client, async_openai_client
+from result_writer import JsonlResultWriter, row_key
+from judge_cache import JudgeCache, cached_completion
+from metrics_config import combined_prompt, combined_response_format
+from lazy import Lazy
 
-client = openai.OpenAI()
+JUDGE_MODEL = "gpt-4o-mini"
+METRICS = ("accuracy", "relevance", "groundedness")
+
+# Retries, header-tuned rate limiting and coalescing of identical in-flight judge calls
+# happen in the shared OpenAI transport, for both the sync and async judges. The clients are
+# built on first use, so importing this module (e.g. from judge_batch.py) needs no credentials
+_client = Lazy(openai_client)
+_async_client = Lazy(async_openai_client)
+
+
+def get_client():
+    return _client.get()
+
+
+def get_async_client():
+    return _async_client.get()
+
+# Set by main() unless --no-judge-cache is given
+judge_cache = None
 
 accuracy_prompt = """ 
 You are tasked with evaluating the accuracy of a response generated by an AI model. You will be provided with the following: 
@@ -23,26 +47,30 @@ Your goal is to assign an accuracy score between 0 and 5 based on how well the A
 Please respond with a single integer between 0 and 5, which is your score. Do not add any text before the score no matter what.
 Here is your input:
 """
-def accuracy(question: str, generated: str, answer: str) -> float:
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": accuracy_prompt
-            },
-            {
-                "role": "user",
-                "content": "original question:" + question + "\n llm generated answer: " + generated + "\n human labeled answer" + answer
-            }
-        ]
-    )
+def accuracy_messages(question: str, generated: str, answer: str) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": accuracy_prompt
+        },
+        {
+            "role": "user",
+            "content": "original question:" + question + "\n llm generated answer: " + generated + "\n human labeled answer" + answer
+        }
+    ]
+
+
+def parse_score(content: str) -> float:
     try:
-        accuracy = int(response.choices[0].message.content[0])
+        score = int(content[0])
     except:
         print("error")
-        accuracy = -1
-    return accuracy / 5
+        score = -1
+    return score / 5
+
+
+def accuracy(question: str, generated: str, answer: str) -> float:
+    return parse_score(cached_completion(get_client(), judge_cache, JUDGE_MODEL, accuracy_messages(question, generated, answer)))
 
 
 relevance_prompt = """
@@ -62,26 +90,21 @@ Here is your input:
 """
 
 
+def relevance_messages(question: str, generated: str, ground_truth: str) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": relevance_prompt
+        },
+        {
+            "role": "user",
+            "content": "original question:" + question + "\n llm generated answer: " + generated + "\n ground truth" + ground_truth
+        }
+    ]
+
+
 def relevance(question: str, generated: str, ground_truth: str) -> float:
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": relevance_prompt
-            },
-            {
-                "role": "user",
-                "content": "original question:" + question + "\n llm generated answer: " + generated + "\n ground truth" + ground_truth
-            }
-        ]
-    )
-    try:
-        relevance = int(response.choices[0].message.content[0])
-    except:
-        print("error")
-        relevance = -1
-    return relevance / 5
+    return parse_score(cached_completion(get_client(), judge_cache, JUDGE_MODEL, relevance_messages(question, generated, ground_truth)))
 
 
 groundedness_prompt = """
@@ -103,60 +126,205 @@ Please respond with a single integer between 0 and 5, which is your score. Do no
 
 Here is your input:
 """
+def groundedness_messages(question: str, generated: str, retrieved: list[str]) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": groundedness_prompt
+        },
+        {
+            "role": "user",
+            "content": "original question:" + question + "llm generated answer: " + generated + "\n   retrieved context: " + str(retrieved)
+        }
+    ]
+
+
 def groundedness(question: str, generated: str, retrieved: list[str]) -> float:
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
-        messages=[
-            {
-                "role": "system",
-                "content": groundedness_prompt
-            },
-            {
-                "role": "user",
-                "content": "original question:" + question + "llm generated answer: " + generated + "\n   retrieved context: " + str(retrieved)
-            }
-        ]
-    )
+    return parse_score(cached_completion(get_client(), judge_cache, JUDGE_MODEL, groundedness_messages(question, generated, retrieved)))
+
+
+async def judge_content_async(messages: list[dict], limiter: RateLimiter, **params) -> str:
+    """Async counterpart of cached_completion, paced by the --rpm/--tpm limiter."""
+    key = None
+    if judge_cache is not None:
+        key = judge_cache.key(JUDGE_MODEL, messages, **params)
+        content = judge_cache.get(key)
+        if content is not None:
+            return content
+
+    await limiter.acquire(estimate_tokens(messages))
+    response = await get_async_client().chat.completions.create(model=JUDGE_MODEL, messages=messages, **params)
+    content = response.choices[0].message.content
+    if judge_cache is not None:
+        judge_cache.put(key, content)
+    return content
+
+
+async def judge_async(messages: list[dict], limiter: RateLimiter) -> float:
+    """Async counterpart of the judge functions above: same model, same messages, same parsing."""
+    return parse_score(await judge_content_async(messages, limiter))
+
+
+def combined_messages(question: str, generated: str, answer: str, ground_truth: str, retrieved: list[str]) -> list[dict]:
+    return [
+        {
+            "role": "system",
+            "content": combined_prompt
+        },
+        {
+            "role": "user",
+            "content": "original question:" + question + "\n llm generated answer: " + generated + "\n human labeled answer" + answer + "\n ground truth" + ground_truth + "\n   retrieved context: " + str(retrieved)
+        }
+    ]
+
+
+def parse_scores(content: str) -> dict:
+    """Parse a combined judge reply into the same 0-1 scale as parse_score (-0.2 when unparseable)."""
     try:
-        groundedness = int(response.choices[0].message.content[0])
+        scores = json.loads(content)
+        return {metric: int(scores[metric]) / 5 for metric in METRICS}
     except:
         print("error")
-        groundedness = -1
-    return groundedness / 5
-
-rag_system = PDFRAGSystem(api_key=os.getenv("OPENAI_API_KEY"), search_endpoint=os.getenv("SEARCH_ENDPOINT"), search_api_key=os.getenv("SEARCH_API_KEY"), index_name=os.getenv("INDEX_NAME"))
-
-data = []
-with open('qa.tsv', 'r') as file:
-    tsv_reader = csv.reader(file, delimiter='\t')
-    for line in tsv_reader:
-        try:
-            answer, question, ground_truth = line[0], line[1], line[2]
-            data.append((question, answer, ground_truth))
-        except:
-            print("line is not list or line has less than 3 columns")
-
-with open('output.json', 'w') as file:
-    results = []
+        return {metric: -1 / 5 for metric in METRICS}
+
+
+def combined_judge(question: str, generated: str, answer: str, ground_truth: str, retrieved: list[str]) -> dict:
+    """Score accuracy, relevance and groundedness with a single structured judge call."""
+    content = cached_completion(
+        get_client(), judge_cache, JUDGE_MODEL,
+        combined_messages(question, generated, answer, ground_truth, retrieved),
+        response_format=combined_response_format
+    )
+    return parse_scores(content)
+
+
+async def evaluate_row_async(rag_system, row, limiter: RateLimiter, combined=False) -> dict:
+    question, answer, ground_truth = row
+    # get_response is synchronous (langchain + azure SDK), so run it off the event loop
+    response = await asyncio.to_thread(rag_system.get_response, question)
+    generated_answer = response["answer"]
+    sources = response["sources"]
+    if combined:
+        content = await judge_content_async(
+            combined_messages(question, generated_answer, answer, ground_truth, sources),
+            limiter,
+            response_format=combined_response_format
+        )
+        scores = parse_scores(content)
+        accuracy_score, relevance_score, groundedness_score = (scores[metric] for metric in METRICS)
+    else:
+        accuracy_score, relevance_score, groundedness_score = await asyncio.gather(
+            judge_async(accuracy_messages(question, generated_answer, answer), limiter),
+            judge_async(relevance_messages(question, generated_answer, ground_truth), limiter),
+            judge_async(groundedness_messages(question, generated_answer, sources), limiter)
+        )
+    return {
+        'question': question,
+        'answer': answer,
+        'ground_truth': ground_truth,
+        'generated_answer': generated_answer,
+        'retrieved sources': sources,
+        'accuracy': accuracy_score,
+        'relevance': relevance_score,
+        'groundedness': groundedness_score
+    }
+
+
+def eval_config(rag_system, combined=False) -> dict:
+    """Settings that change evaluation results; rows are re-run when any of these change."""
+    config = {
+        "model": rag_system.model_name,
+        "judge_model": JUDGE_MODEL,
+        "index_name": rag_system.index_name,
+        "k": rag_system.retriever.k
+    }
+    if rag_system.retrieval_mode != "keyword":
+        config["retrieval_mode"] = rag_system.retrieval_mode
+    if rag_system.rerank_scorer is not None:
+        config["reranker"] = type(rag_system.rerank_scorer).__name__
+        config["rerank_fetch_k"] = rag_system.rerank_fetch_k
+    if rag_system.expansion:
+        config["expansion"] = rag_system.expansion
+        config["expansion_window" if rag_system.expansion == "neighbors" else "expansion_max_chars"] = (
+            rag_system.expansion_window if rag_system.expansion == "neighbors" else rag_system.expansion_max_chars
+        )
+    if rag_system.multi_query:
+        config["multi_query"] = rag_system.multi_query
+        if rag_system.multi_query == "llm":
+            config["multi_query_count"] = rag_system.multi_query_count
+    if combined:
+        config["combined_judge"] = True
+    return config
+
+
+async def run_eval(rag_system, data, writer: JsonlResultWriter, concurrency=8, requests_per_minute=None, tokens_per_minute=None, combined=False):
+    """Evaluate every row not already in the checkpoint, appending each result as it completes."""
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+    config = eval_config(rag_system, combined)
+    keys = [row_key(question, config) for question, _, _ in data]
+    pending = [(key, row) for key, row in zip(keys, data) if key not in writer]
+
+    async def evaluate(item):
+        key, row = item
+        result = await evaluate_row_async(rag_system, row, limiter, combined)
+        writer.write(key, result)
+
+    with tqdm.tqdm(total=len(data), initial=len(data) - len(pending), desc="Processing lines") as progress:
+        await run_concurrently(pending, evaluate, concurrency=concurrency, progress=progress)
+    return [writer.get(key) for key in keys]
+
+
+def load_qa(path):
+    data = []
+    with open(path, 'r') as file:
+        tsv_reader = csv.reader(file, delimiter='\t')
+        for line in tsv_reader:
+            try:
+                answer, question, ground_truth = line[0], line[1], line[2]
+                data.append((question, answer, ground_truth))
+            except:
+                print("line is not list or line has less than 3 columns")
+    return data
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the RAG system against a QA set.")
+    parser.add_argument("--qa", default="qa.tsv", help="tab-separated answer/question/ground truth file")
+    parser.add_argument("--output", default="output.json", help="JSON array of results for the eval dashboard")
+    parser.add_argument("--checkpoint", default="output.jsonl", help="per-row JSONL log; completed rows are skipped on rerun")
+    parser.add_argument("--concurrency", type=int, default=8, help="rows evaluated in parallel")
+    parser.add_argument("--rpm", type=int, default=None, help="judge requests per minute")
+    parser.add_argument("--tpm", type=int, default=None, help="judge tokens per minute")
+    parser.add_argument("--combined-judge", action="store_true", help="score all three metrics in one structured judge call")
+    parser.add_argument("--judge-cache", default="judge_cache.sqlite3", help="SQLite cache of judge replies")
+    parser.add_argument("--judge-cache-mb", type=int, default=256, help="evict least recently used judge replies above this size")
+    parser.add_argument("--no-judge-cache", action="store_true")
+    args = parser.parse_args()
+
+    global judge_cache
+    if not args.no_judge_cache:
+        judge_cache = JudgeCache(args.judge_cache, max_bytes=args.judge_cache_mb * 1024 * 1024)
+
+    from RAG_Core import PDFRAGSystem
+    rag_system = PDFRAGSystem(api_key=os.getenv("OPENAI_API_KEY"), search_endpoint=os.getenv("SEARCH_ENDPOINT"), search_api_key=os.getenv("SEARCH_API_KEY"), index_name=os.getenv("INDEX_NAME"), local_index_path=os.getenv("LOCAL_INDEX_PATH"), retrieval_mode=os.getenv("RETRIEVAL_MODE"), reranker=os.getenv("RERANKER"), expansion=os.getenv("EXPANSION"), chunk_store_path=os.getenv("CHUNK_STORE_PATH"), multi_query=os.getenv("MULTI_QUERY"), acronyms_path=os.getenv("ACRONYMS_PATH"))
+    data = load_qa(args.qa)
+
     original_stdout = sys.stdout
     sys.stdout = open(os.devnull, 'w')
-    for line in tqdm.tqdm(data, desc="Processing lines"):
-        question, answer, ground_truth = line
-        response = rag_system.get_response(question)
-        generated_answer = response["answer"]
-        sources = response["sources"]
-        result = {
-            'question': question,
-            'answer': answer,
-            'ground_truth': ground_truth,
-            'generated_answer': generated_answer,
-            'retrieved sources': sources,
-            'accuracy': accuracy(question, generated_answer, answer),
-            'relevance': relevance(question, generated_answer, ground_truth),
-            'groundedness': groundedness(question, generated_answer, sources)
-        }
-        results.append(result)
+    try:
+        with JsonlResultWriter(args.checkpoint) as writer:
+            results = asyncio.run(run_eval(rag_system, data, writer, args.concurrency, args.rpm, args.tpm, args.combined_judge))
+    finally:
+        sys.stdout.close()
+        sys.stdout = original_stdout
+
+    with open(args.output, 'w') as file:
         json.dump(results, file)
-    json.dump(results, file)
-    sys.stdout.close()
-    sys.stdout = original_stdout
\ No newline at end of file
+
+    if judge_cache is not None:
+        print(f"Judge cache: {judge_cache.stats()}")
+        judge_cache.close()
+
+
+if __name__ == "__main__":
+    main()
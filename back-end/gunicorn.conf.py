@@ -0,0 +1,53 @@
+# Production serving for App.py: gunicorn -c gunicorn.conf.py App:app
+# Requests spend nearly all their time waiting on Azure Search and OpenAI, so each worker
+# process runs a pool of threads; a slow generation only occupies one thread, not the worker.
+import os
+import tempfile
+
+bind = os.getenv("BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_CONCURRENCY", "2"))
+worker_class = "gthread"
+threads = int(os.getenv("THREADS", "32"))
+
+# Seconds a request may run before the worker is restarted; keep above REQUEST_TIMEOUT
+timeout = int(os.getenv("WORKER_TIMEOUT", "120"))
+# Seconds in-flight requests get to finish after SIGTERM
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+
+# Importing App is cheap (the RAG system and its clients are built lazily), so the master
+# imports it once and workers fork from it; each worker builds its own clients after fork, as
+# sockets must not be shared across processes
+preload_app = True
+
+accesslog = "-"
+errorlog = "-"
+loglevel = os.getenv("LOG_LEVEL", "info")
+
+# Each worker keeps its metrics in memory and writes them to METRICS_DIR every second; a
+# /metrics scrape, whichever worker it reaches, sums the files of all workers
+os.environ.setdefault("METRICS_DIR", tempfile.mkdtemp(prefix="rag-metrics-"))
+
+
+def on_starting(server):
+    # Totals from a previous run of the server would otherwise be added to this one's
+    from instrumentation import clear_metrics_dir
+    clear_metrics_dir()
+
+
+def post_worker_init(worker):
+    from instrumentation import start_metrics_flusher
+    start_metrics_flusher()
+    # Open connections before the worker takes traffic; /ready keeps reporting 503 if this fails
+    from App import get_rag_system
+    try:
+        get_rag_system().warm_up()
+    except Exception as e:
+        worker.log.warning(f"Warm-up failed, /ready will retry: {e}")
+
+
+def worker_exit(server, worker):
+    from App import close_rag_system
+    from instrumentation import flush_metrics
+    close_rag_system()
+    flush_metrics()
@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+import contextvars
+import math
+import re
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from retrievers import BaseRetriever
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[.\-][a-z0-9]+)*")
+
+
+def tokenize(text: str) -> list[str]:
+    # Keeps section numbers ("2.4.1") and hyphenated terms ("day-ahead") together
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """Okapi BM25 over an in-memory inverted index of postings arrays."""
+    def __init__(self, texts, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.n_docs = len(texts)
+        lengths = np.zeros(self.n_docs, dtype=np.float32)
+        postings = defaultdict(lambda: ([], []))
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            lengths[doc_id] = sum(counts.values())
+            for term, count in counts.items():
+                ids, tfs = postings[term]
+                ids.append(doc_id)
+                tfs.append(count)
+        average_length = lengths.mean() if self.n_docs else 0.0
+        self._length_norm = k1 * (1 - b + b * lengths / (average_length or 1.0))
+        self.postings = {
+            term: (np.array(ids, dtype=np.int64), np.array(tfs, dtype=np.float32))
+            for term, (ids, tfs) in postings.items()
+        }
+
+    def idf(self, term):
+        df = len(self.postings[term][0]) if term in self.postings else 0
+        return math.log(1 + (self.n_docs - df + 0.5) / (df + 0.5))
+
+    def search(self, query, k=5):
+        """Return (doc ids, scores) of the k best-scoring documents, best first."""
+        scores = np.zeros(self.n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            ids, tfs = self.postings[term]
+            scores[ids] += self.idf(term) * tfs * (self.k1 + 1) / (tfs + self._length_norm[ids])
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = np.argsort(-scores[candidates], kind="stable")
+        return candidates[order], scores[candidates[order]]
+
+
+class BM25Retriever(BaseRetriever):
+    """Keyword retriever over a list of {"page_content", "metadata"} documents."""
+    def __init__(self, documents, k=5):
+        super().__init__(k)
+        self.documents = documents
+        self.index = BM25Index([document["page_content"] for document in documents])
+
+    def get_relevant_documents(self, query, k=None):
+        ids, scores = self.index.search(query, k or self.k)
+        return [
+            {**self.documents[row], "score": float(score)}
+            for row, score in zip(ids, scores)
+        ]
+
+
+def document_key(doc):
+    return doc["metadata"].get("chunk_id") or doc["page_content"]
+
+
+def reciprocal_rank_fusion(rankings, k=5, rrf_k=60, weights=None):
+    """
+    Fuse several ranked document lists: each document scores sum(weight / (rrf_k + rank)).
+    Returns the top k documents with the fused value in "score".
+    """
+    weights = weights or [1.0] * len(rankings)
+    fused = {}
+    scores = defaultdict(float)
+    for ranking, weight in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, start=1):
+            key = document_key(doc)
+            fused.setdefault(key, doc)
+            scores[key] += weight / (rrf_k + rank)
+    best = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [{**fused[key], "score": scores[key]} for key in best]
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Runs a keyword and a vector retriever in parallel, each fetching fetch_k candidates,
+    and fuses the two rankings with reciprocal-rank fusion. The vector search goes to a pool
+    shared by all requests while the keyword search runs on the calling thread, so size
+    workers to the number of requests searching at once (the server's request threads).
+    """
+    def __init__(self, keyword_retriever, vector_retriever, k=5, fetch_k=20, rrf_k=60, weights=None, workers=32):
+        super().__init__(k)
+        self.keyword_retriever = keyword_retriever
+        self.vector_retriever = vector_retriever
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.weights = weights
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hybrid")
+
+    def get_relevant_documents(self, query, k=None):
+        k = k or self.k
+        fetch_k = max(self.fetch_k, k)
+        # Copy the caller's context so the vector search's spans land in the request trace
+        vector = self._executor.submit(
+            contextvars.copy_context().run, self.vector_retriever.get_relevant_documents, query, fetch_k
+        )
+        keyword = self.keyword_retriever.get_relevant_documents(query, fetch_k)
+        return reciprocal_rank_fusion(
+            [keyword, vector.result()], k=k, rrf_k=self.rrf_k, weights=self.weights
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.keyword_retriever.close()
+        self.vector_retriever.close()
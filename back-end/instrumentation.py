@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+import bisect
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger("rag.trace")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Seconds between a process's writes of its metrics to METRICS_DIR
+FLUSH_SECONDS = 1.0
+
+_current_trace = ContextVar("rag_trace", default=None)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in sorted(labels)) + "}"
+
+
+def _series_key(labels):
+    # JSON-safe form of a sorted label tuple, so snapshots can be written to disk and merged
+    return json.dumps([list(pair) for pair in labels])
+
+
+def _series_labels(key):
+    return tuple(tuple(pair) for pair in json.loads(key))
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set, in the Prometheus exposition model."""
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.setdefault(key, {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0})
+            series["counts"][index] += 1
+            series["sum"] += value
+
+    def snapshot(self):
+        with self._lock:
+            return {_series_key(labels): {"counts": list(series["counts"]), "sum": series["sum"]}
+                    for labels, series in self._series.items()}
+
+    def render(self, snapshots=None):
+        """Exposition lines for this process's values, or for the sum of several snapshot()s."""
+        merged = {}
+        for snapshot in [self.snapshot()] if snapshots is None else snapshots:
+            for key, series in snapshot.items():
+                total = merged.setdefault(_series_labels(key), {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0})
+                total["counts"] = [a + b for a, b in zip(total["counts"], series["counts"])]
+                total["sum"] += series["sum"]
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for labels, series in sorted(merged.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series["counts"]):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(labels)} {series['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return {_series_key(labels): value for labels, value in self._values.items()}
+
+    def render(self, snapshots=None):
+        """Exposition lines for this process's values, or for the sum of several snapshot()s."""
+        merged = {}
+        for snapshot in [self.snapshot()] if snapshots is None else snapshots:
+            for key, value in snapshot.items():
+                labels = _series_labels(key)
+                merged[labels] = merged.get(labels, 0) + value
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(merged.items()):
+            lines.append(f"{self.name}{_format_labels(labels)} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent in each stage of the query path.")
+REQUEST_SECONDS = Histogram("rag_request_seconds", "End-to-end HTTP request latency by endpoint.")
+REQUESTS = Counter("rag_requests_total", "HTTP requests by endpoint and status code.")
+TOKENS = Counter("rag_tokens_total", "LLM tokens by kind (prompt, completion, context).")
+CACHE_LOOKUPS = Counter("rag_cache_lookups_total", "Response cache lookups by result (exact, semantic, miss).")
+
+METRICS = (STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, TOKENS, CACHE_LOOKUPS)
+
+
+_process_file = None
+_flusher_pid = None
+
+
+def _metrics_dir():
+    return os.getenv("METRICS_DIR")
+
+
+def _own_metrics_file(directory):
+    # Named per process start rather than by pid alone, so a reused pid can't overwrite an
+    # exited worker's totals; works across fork since the pid is checked on every call
+    global _process_file
+    if _process_file is None or _process_file[0] != os.getpid():
+        _process_file = (os.getpid(), os.path.join(directory, f"{os.getpid()}-{uuid.uuid4().hex[:8]}.json"))
+    return _process_file[1]
+
+
+def flush_metrics():
+    """Write this process's metric values to METRICS_DIR (if set) for other processes' scrapes."""
+    directory = _metrics_dir()
+    if not directory:
+        return
+    path = _own_metrics_file(directory)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as file:
+        json.dump({metric.name: metric.snapshot() for metric in METRICS}, file)
+    os.replace(tmp_path, path)
+
+
+def start_metrics_flusher():
+    """Flush this process's metrics every FLUSH_SECONDS from a daemon thread; once per process."""
+    global _flusher_pid
+    if not _metrics_dir() or _flusher_pid == os.getpid():
+        return
+    _flusher_pid = os.getpid()
+
+    def run():
+        while True:
+            time.sleep(FLUSH_SECONDS)
+            try:
+                flush_metrics()
+            except OSError as e:
+                logger.warning("Writing metrics to %s failed: %s", _metrics_dir(), e)
+
+    threading.Thread(target=run, name="metrics-flush", daemon=True).start()
+
+
+def clear_metrics_dir():
+    """Remove every process's metrics file from METRICS_DIR; call when the server starts."""
+    directory = _metrics_dir()
+    if directory:
+        for path in glob.glob(os.path.join(directory, "*.json")):
+            os.remove(path)
+
+
+def _read_snapshots(directory):
+    snapshots = []
+    for path in glob.glob(os.path.join(directory, "*.json")):
+        try:
+            with open(path, "r") as file:
+                snapshots.append(json.load(file))
+        except (OSError, ValueError):
+            # Removed since the listing, or not ours
+            continue
+    return snapshots
+
+
+def render_metrics():
+    """
+    Prometheus text exposition of every metric. With METRICS_DIR set (gunicorn.conf.py does),
+    values are summed over every process that has written there, including exited workers, so
+    counters never go backwards; other workers' values lag by up to FLUSH_SECONDS. Without it
+    they are this process's own.
+    """
+    directory = _metrics_dir()
+    snapshots = None
+    if directory:
+        flush_metrics()
+        snapshots = _read_snapshots(directory)
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render(None if snapshots is None else [snapshot.get(metric.name, {}) for snapshot in snapshots]))
+    return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def trace_request(name):
+    """
+    Collect the spans, token counts and cache result of one request. The trace is logged as a
+    single JSON line on the "rag.trace" logger at DEBUG, so it costs nothing when that is off.
+    """
+    trace = {"request": name, "spans": {}, "tokens": {}, "cache": None}
+    token = _current_trace.set(trace)
+    start = time.perf_counter()
+    try:
+        yield trace
+    finally:
+        trace["seconds"] = time.perf_counter() - start
+        _current_trace.reset(token)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(trace))
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace["spans"][stage] = trace["spans"].get(stage, 0.0) + seconds
+
+
+@contextmanager
+def span(stage):
+    """Time a stage of the query path into rag_stage_seconds and the current request trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(stage, time.perf_counter() - start)
+
+
+def record_tokens(**counts):
+    trace = _current_trace.get()
+    for kind, count in counts.items():
+        if count is None:
+            continue
+        TOKENS.inc(count, kind=kind)
+        if trace is not None:
+            trace["tokens"][kind] = trace["tokens"].get(kind, 0) + count
+
+
+def record_cache(result):
+    CACHE_LOOKUPS.inc(result=result)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace["cache"] = result
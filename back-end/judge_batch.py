@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Offline judging through the OpenAI Batch API, and a benchmark of the combined judge.
+
+    python judge_batch.py write output.json batch_requests.jsonl [--three-call]
+    python judge_batch.py ingest output.json batch_results.jsonl judged.json
+    python judge_batch.py compare output.json [--limit 20]
+
+`write` turns evaluated rows (eval_script.py output) into Batch API request lines, which can
+be uploaded with `client.files.create(purpose="batch")` and `client.batches.create(...)`.
+`ingest` merges the downloaded batch output back into the rows. `compare` re-judges rows with
+both the three-call and combined judges and reports score agreement and token usage.
+"""
+import argparse
+import json
+import statistics
+
+import eval_script
+from eval_script import (
+    JUDGE_MODEL, METRICS, accuracy_messages, relevance_messages, groundedness_messages,
+    combined_messages, parse_score, parse_scores
+)
+from metrics_config import combined_response_format
+
+
+def row_messages(row, combined=True):
+    """Judge requests for one evaluated row, as (suffix, messages, params) tuples."""
+    question, generated = row["question"], row["generated_answer"]
+    answer, ground_truth, sources = row["answer"], row["ground_truth"], row["retrieved sources"]
+    if combined:
+        return [("combined", combined_messages(question, generated, answer, ground_truth, sources),
+                 {"response_format": combined_response_format})]
+    return [
+        ("accuracy", accuracy_messages(question, generated, answer), {}),
+        ("relevance", relevance_messages(question, generated, ground_truth), {}),
+        ("groundedness", groundedness_messages(question, generated, sources), {})
+    ]
+
+
+def write_batch_requests(rows, path, combined=True):
+    count = 0
+    with open(path, "w", encoding="utf-8") as file:
+        for i, row in enumerate(rows):
+            for suffix, messages, params in row_messages(row, combined):
+                request = {
+                    "custom_id": f"row-{i}-{suffix}",
+                    "method": "POST",
+                    "url": "/v1/chat/completions",
+                    "body": {"model": JUDGE_MODEL, "messages": messages, **params}
+                }
+                file.write(json.dumps(request) + "\n")
+                count += 1
+    return count
+
+
+def ingest_batch_results(rows, path):
+    """Merge Batch API output lines into copies of rows; returns (rows, usage totals)."""
+    rows = [dict(row) for row in rows]
+    usage = {"prompt_tokens": 0, "completion_tokens": 0}
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            _, index, suffix = record["custom_id"].split("-", 2)
+            row = rows[int(index)]
+            response = record.get("response") or {}
+            if record.get("error") or response.get("status_code") != 200:
+                content = ""
+            else:
+                body = response["body"]
+                content = body["choices"][0]["message"]["content"]
+                for field in usage:
+                    usage[field] += body.get("usage", {}).get(field, 0)
+            if suffix == "combined":
+                row.update(parse_scores(content))
+            else:
+                row[suffix] = parse_score(content)
+    return rows, usage
+
+
+def compare(rows):
+    """Judge each row both ways (uncached) and report agreement and token usage."""
+    three_call = {metric: [] for metric in METRICS}
+    combined = {metric: [] for metric in METRICS}
+    usage = {"three_call": 0, "combined": 0}
+    for row in rows:
+        for suffix, messages, params in row_messages(row, combined=False):
+            response = eval_script.get_client().chat.completions.create(model=JUDGE_MODEL, messages=messages, **params)
+            three_call[suffix].append(parse_score(response.choices[0].message.content))
+            usage["three_call"] += response.usage.total_tokens
+        for _, messages, params in row_messages(row, combined=True):
+            response = eval_script.get_client().chat.completions.create(model=JUDGE_MODEL, messages=messages, **params)
+            for metric, score in parse_scores(response.choices[0].message.content).items():
+                combined[metric].append(score)
+            usage["combined"] += response.usage.total_tokens
+
+    report = {"rows": len(rows), "tokens": usage}
+    for metric in METRICS:
+        pairs = list(zip(three_call[metric], combined[metric]))
+        report[metric] = {
+            "exact_agreement": statistics.mean(a == b for a, b in pairs) if pairs else 0.0,
+            "mean_abs_diff": statistics.mean(abs(a - b) for a, b in pairs) if pairs else 0.0,
+            "mean_three_call": statistics.mean(three_call[metric]) if pairs else 0.0,
+            "mean_combined": statistics.mean(combined[metric]) if pairs else 0.0
+        }
+    if usage["three_call"]:
+        report["token_ratio"] = usage["combined"] / usage["three_call"]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    write = commands.add_parser("write", help="write Batch API request JSONL")
+    write.add_argument("rows")
+    write.add_argument("requests")
+    write.add_argument("--three-call", action="store_true", help="one request per metric instead of a combined one")
+
+    ingest = commands.add_parser("ingest", help="merge Batch API output JSONL into the rows")
+    ingest.add_argument("rows")
+    ingest.add_argument("results")
+    ingest.add_argument("output")
+
+    bench = commands.add_parser("compare", help="benchmark the combined judge against three calls")
+    bench.add_argument("rows")
+    bench.add_argument("--limit", type=int, default=20)
+
+    args = parser.parse_args()
+    with open(args.rows, "r") as file:
+        rows = json.load(file)
+
+    if args.command == "write":
+        count = write_batch_requests(rows, args.requests, combined=not args.three_call)
+        print(f"Wrote {count} requests for {len(rows)} rows to {args.requests}")
+    elif args.command == "ingest":
+        judged, usage = ingest_batch_results(rows, args.results)
+        with open(args.output, "w") as file:
+            json.dump(judged, file)
+        print(f"Merged scores for {len(judged)} rows into {args.output} (usage: {usage})")
+    else:
+        print(json.dumps(compare(rows[:args.limit]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+
+class JudgeCache:
+    """
+    Persistent cache of LLM judge completions, keyed by a hash of model + messages.
+    Least recently used entries are evicted once the stored payload exceeds max_bytes.
+    """
+    def __init__(self, path="judge_cache.sqlite3", max_bytes=256 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS judgments ("
+            "key TEXT PRIMARY KEY, content TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS judgments_last_used ON judgments (last_used)")
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM judgments").fetchone()[0]
+
+    @staticmethod
+    def key(model: str, messages: list[dict], **params) -> str:
+        request = {"model": model, "messages": messages}
+        if params:
+            request["params"] = params
+        payload = json.dumps(request, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT content FROM judgments WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE judgments SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            return row[0]
+
+    def put(self, key, content: str):
+        size = len(key) + len(content.encode("utf-8"))
+        with self._lock:
+            previous = self._conn.execute("SELECT size FROM judgments WHERE key = ?", (key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO judgments (key, content, size, last_used) VALUES (?, ?, ?, ?)",
+                (key, content, size, time.time())
+            )
+            self._size += size - (previous[0] if previous else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+            self._conn.commit()
+
+    def _evict(self):
+        # Trim to 90% of the limit so a full cache doesn't evict on every insert
+        target = self.max_bytes * 0.9
+        while self._size > target:
+            rows = self._conn.execute(
+                "SELECT key, size FROM judgments ORDER BY last_used LIMIT 256"
+            ).fetchall()
+            if not rows:
+                self._size = 0
+                break
+            self._conn.executemany("DELETE FROM judgments WHERE key = ?", [(key,) for key, _ in rows])
+            self._size -= sum(size for _, size in rows)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "bytes": self._size
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+def cached_completion(client, cache, model: str, messages: list[dict], **params) -> str:
+    """Return the judge's reply content, going to the API only on a cache miss."""
+    key = None
+    if cache is not None:
+        key = cache.key(model, messages, **params)
+        content = cache.get(key)
+        if content is not None:
+            return content
+    response = client.chat.completions.create(model=model, messages=messages, **params)
+    content = response.choices[0].message.content
+    if cache is not None:
+        cache.put(key, content)
+    return content
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+import threading
+
+_MISSING = object()
+
+
+class Lazy:
+    """
+    A value built by factory on first get(), once, however many threads ask for it concurrently.
+    If the factory raises, nothing is stored and the next get() tries again.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self._value = _MISSING
+        self._lock = threading.Lock()
+
+    @property
+    def built(self):
+        return self._value is not _MISSING
+
+    def get(self):
+        if self._value is _MISSING:
+            with self._lock:
+                if self._value is _MISSING:
+                    self._value = self.factory()
+        return self._value
+
+
+class lazy_property:
+    """
+    functools.cached_property that also builds the value only once under concurrent first access
+    (cached_property stopped locking in Python 3.12). Assigning the attribute replaces the value.
+    """
+    def __init__(self, factory):
+        self.factory = factory
+        self.name = factory.__name__
+        self.__doc__ = factory.__doc__
+        self._lock = threading.RLock()
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        with self._lock:
+            if self.name not in instance.__dict__:
+                instance.__dict__[self.name] = self.factory(instance)
+            return instance.__dict__[self.name]
+
+
+def is_built(instance, name):
+    """Whether a lazy_property of instance has been built (or assigned), without building it."""
+    return name in instance.__dict__
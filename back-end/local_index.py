@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+import argparse
+import glob
+import os
+import shutil
+import time
+
+import numpy as np
+
+from retrievers import BaseRetriever
+from instrumentation import span
+from corpus_store import CORPUS_DIR, DOCUMENTS_FILE, CorpusWriter, load_documents
+from quantization import CODES_FILE, QUANTIZER_FILE, approximate_search, load_quantizer, quantize_index, remove_quantization, rescore
+
+EMBEDDINGS_FILE = "embeddings.npy"
+HNSW_FILE = "hnsw.bin"
+
+
+class LocalVectorIndex:
+    """
+    In-process vector index stored in a directory:
+      embeddings.npy   unit-normalized (n, dim) float32 or float16 matrix, memory-mapped on load
+      corpus/          memory-mapped CorpusStore of chunk text and metadata, one entry per row
+                       (indexes written before it existed have documents.jsonl instead)
+      hnsw.bin         optional HNSW graph (requires hnswlib)
+      codes.npy, quantizer.npz
+                       optional int8 or product-quantized codes (see quantization.py)
+    Search is exact brute-force cosine similarity unless an HNSW graph or quantized codes are
+    present. With codes, every row is scored from its codes and the best rescore * k are then
+    re-scored exactly from the embeddings (rescore=0 returns the approximate scores).
+    Brute-force and code scans convert block_rows rows to float32 at a time, which bounds the
+    per-query scratch memory (about 24 MB at 1536 dims).
+    """
+    def __init__(self, path, use_hnsw=True, block_rows=4096, use_quantization=True, rescore=4):
+        self.path = path
+        self.block_rows = block_rows
+        self.rescore = rescore
+        self.embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+        self.documents = load_documents(path)
+        self.quantizer = self.codes = None
+        if use_quantization and os.path.exists(os.path.join(path, QUANTIZER_FILE)):
+            self.quantizer = load_quantizer(path)
+            self.codes = np.load(os.path.join(path, CODES_FILE), mmap_mode="r")
+        self.hnsw = None
+        if use_hnsw and os.path.exists(os.path.join(path, HNSW_FILE)):
+            import hnswlib
+            self.hnsw = hnswlib.Index(space="ip", dim=self.embeddings.shape[1])
+            self.hnsw.load_index(os.path.join(path, HNSW_FILE), max_elements=len(self))
+
+    def __len__(self):
+        return self.embeddings.shape[0]
+
+    @staticmethod
+    def build(path, embeddings, documents, dtype="float32", hnsw=False, ef_construction=200, m=16, quantization=None, subvectors=96):
+        """Write an index directory from an (n, dim) embedding array and n document dicts."""
+        if len(embeddings) != len(documents):
+            raise ValueError(f"{len(embeddings)} embeddings for {len(documents)} documents")
+        writer = IndexWriter(path, dtype=dtype)
+        writer.append(embeddings, documents)
+        writer.close(hnsw=hnsw, ef_construction=ef_construction, m=m, quantization=quantization, subvectors=subvectors)
+
+    def search(self, query_vector, k=5):
+        """Return (row ids, cosine scores) of the k nearest rows, best first."""
+        query = np.asarray(query_vector, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1.0)
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        if self.hnsw is not None:
+            self.hnsw.set_ef(max(50, 2 * k))
+            labels, distances = self.hnsw.knn_query(query, k=k)
+            # hnswlib's inner-product "distance" is 1 - similarity
+            return labels[0].astype(np.int64), (1.0 - distances[0]).astype(np.float32)
+
+        if self.quantizer is not None:
+            if not self.rescore:
+                return approximate_search(self.quantizer, self.codes, query, k, self.block_rows)
+            candidates, _ = approximate_search(self.quantizer, self.codes, query, min(len(self), self.rescore * k), self.block_rows)
+            return rescore(self.embeddings, query, candidates, k)
+
+        # Score the memory-mapped matrix in blocks so float16 rows are upcast a block at a time
+        best_ids = np.empty(0, dtype=np.int64)
+        best_scores = np.empty(0, dtype=np.float32)
+        for start in range(0, len(self), self.block_rows):
+            block = np.asarray(self.embeddings[start:start + self.block_rows], dtype=np.float32)
+            scores = block @ query
+            if len(scores) > k:
+                top = np.argpartition(-scores, k - 1)[:k]
+            else:
+                top = np.arange(len(scores))
+            best_ids = np.concatenate([best_ids, top + start])
+            best_scores = np.concatenate([best_scores, scores[top]])
+            if len(best_scores) > k:
+                keep = np.argpartition(-best_scores, k - 1)[:k]
+                best_ids, best_scores = best_ids[keep], best_scores[keep]
+        order = np.argsort(-best_scores, kind="stable")
+        return best_ids[order], best_scores[order]
+
+
+class IndexWriter:
+    """
+    Builds a LocalVectorIndex directory incrementally, so a corpus can be embedded batch by batch
+    without holding every vector in memory. Rows are normalized and written to a raw file as they
+    arrive; close() copies them into embeddings.npy block by block. An index with no rows is
+    written without an HNSW graph or quantized codes, since there is nothing to train them on.
+    """
+    def __init__(self, path, dtype="float32"):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.rows = 0
+        self.dim = None
+        os.makedirs(path, exist_ok=True)
+        self._raw_path = os.path.join(path, EMBEDDINGS_FILE + ".raw")
+        self._raw = open(self._raw_path, "wb")
+        self._corpus = CorpusWriter(os.path.join(path, CORPUS_DIR + ".tmp"))
+
+    def append(self, embeddings, documents):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if len(embeddings) != len(documents):
+            raise ValueError(f"{len(embeddings)} embeddings for {len(documents)} documents")
+        if len(embeddings) == 0:
+            return
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"expected {self.dim}-dim embeddings, got {embeddings.shape[1]}")
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms > 0, norms, 1.0)
+        self._raw.write(embeddings.astype(self.dtype).tobytes())
+        self._corpus.append(documents)
+        self.rows += len(embeddings)
+
+    def close(self, hnsw=False, ef_construction=200, m=16, block_rows=65536, quantization=None, subvectors=96):
+        self._raw.close()
+        self._corpus.close()
+        matrix = np.lib.format.open_memmap(
+            os.path.join(self.path, EMBEDDINGS_FILE), mode="w+", dtype=self.dtype, shape=(self.rows, self.dim or 0)
+        )
+        # An empty raw file can't be memory-mapped, and an empty index has nothing to copy
+        if self.rows:
+            raw = np.memmap(self._raw_path, dtype=self.dtype, mode="r", shape=(self.rows, self.dim))
+            for start in range(0, self.rows, block_rows):
+                matrix[start:start + block_rows] = raw[start:start + block_rows]
+            del raw
+        matrix.flush()
+        os.remove(self._raw_path)
+        corpus_path = os.path.join(self.path, CORPUS_DIR)
+        if os.path.exists(corpus_path):
+            shutil.rmtree(corpus_path)
+        os.replace(corpus_path + ".tmp", corpus_path)
+        if os.path.exists(os.path.join(self.path, DOCUMENTS_FILE)):
+            # Rows from a previous build in the old format would no longer match either
+            os.remove(os.path.join(self.path, DOCUMENTS_FILE))
+
+        hnsw_path = os.path.join(self.path, HNSW_FILE)
+        if hnsw and self.rows:
+            import hnswlib
+            graph = hnswlib.Index(space="ip", dim=self.dim)
+            graph.init_index(max_elements=self.rows, ef_construction=ef_construction, M=m)
+            for start in range(0, self.rows, block_rows):
+                block = np.asarray(matrix[start:start + block_rows], dtype=np.float32)
+                graph.add_items(block, np.arange(start, start + len(block)))
+            graph.save_index(hnsw_path)
+        elif os.path.exists(hnsw_path):
+            # A graph from a previous build would no longer match the rows
+            os.remove(hnsw_path)
+        del matrix
+        if quantization and self.rows:
+            quantize_index(self.path, quantization, subvectors)
+        else:
+            remove_quantization(self.path)
+
+
+class LocalVectorRetriever(BaseRetriever):
+    """
+    Drop-in replacement for AzureCognitiveSearchRetriever backed by a LocalVectorIndex.
+    embedding_fn embeds a single query string (e.g. OpenAIEmbeddings.embed_query).
+    """
+    def __init__(self, index, embedding_fn, k=5):
+        super().__init__(k)
+        self.index = index
+        self.embedding_fn = embedding_fn
+
+    def get_relevant_documents(self, query, k=None):
+        with span("embedding"):
+            vector = self.embedding_fn(query)
+        ids, scores = self.index.search(vector, k or self.k)
+        docs = []
+        for row, score in zip(ids, scores):
+            document = self.index.documents[row]
+            docs.append({
+                "page_content": document["page_content"],
+                "metadata": document["metadata"],
+                "score": float(score)
+            })
+        return docs
+
+
+def new_index_version(path):
+    """A fresh directory name beside path for building the next version of the index at path."""
+    return f"{path}.v{time.time_ns()}"
+
+
+def publish_index(path, version_path, keep=2):
+    """
+    Make path, a symlink, point at the index directory version_path (from new_index_version) in
+    one atomic rename, so readers never find path missing or half-written. Then delete all but
+    the newest keep versions; processes still on the previous one keep working until they
+    reload. A plain directory at path, from before versioning, is first moved aside as version 0.
+    """
+    if os.path.isdir(path) and not os.path.islink(path):
+        os.replace(path, f"{path}.v0")
+    link = path + ".link"
+    if os.path.lexists(link):
+        os.remove(link)
+    os.symlink(os.path.basename(version_path), link)
+    os.replace(link, path)
+    versions = [version for version in glob.glob(glob.escape(path) + ".v*") if version.rsplit(".v", 1)[1].isdigit()]
+    versions.sort(key=lambda version: int(version.rsplit(".v", 1)[1]))
+    for version in versions[:-keep]:
+        if os.path.realpath(version) != os.path.realpath(path):
+            shutil.rmtree(version, ignore_errors=True)
+
+
+def export_azure_index(search_client, path, embed_documents=None, vector_field="text_vector", dtype="float32", hnsw=False, quantization=None):
+    """
+    Copy every chunk of an Azure Cognitive Search index into a LocalVectorIndex.
+    Chunks whose vector field isn't retrievable are embedded with embed_documents instead.
+    """
+    documents, vectors, missing = [], [], []
+    for result in search_client.search(search_text="*", select=["chunk_id", "parent_id", "title", "chunk", vector_field]):
+        documents.append({
+            "page_content": result["chunk"],
+            "metadata": {
+                "chunk_id": result.get("chunk_id"),
+                "parent_id": result.get("parent_id"),
+                "title": result.get("title")
+            }
+        })
+        vectors.append(result.get(vector_field))
+        if vectors[-1] is None:
+            missing.append(len(vectors) - 1)
+
+    if missing:
+        if embed_documents is None:
+            raise ValueError(f"{len(missing)} chunks have no '{vector_field}' and no embedding function was given")
+        for row, vector in zip(missing, embed_documents([documents[row]["page_content"] for row in missing])):
+            vectors[row] = vector
+
+    LocalVectorIndex.build(path, np.array(vectors, dtype=np.float32), documents, dtype=dtype, hnsw=hnsw, quantization=quantization)
+    return len(documents)
+
+
+def main():
+    from langchain_openai import OpenAIEmbeddings
+    from azure.core.credentials import AzureKeyCredential
+    from azure.search.documents import SearchClient
+
+    parser = argparse.ArgumentParser(description="Export the Azure search index into a local vector index.")
+    parser.add_argument("path", help="output directory")
+    parser.add_argument("--dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--hnsw", action="store_true", help="also build an HNSW graph (requires hnswlib)")
+    parser.add_argument("--quantization", choices=["int8", "pq"], help="also write compressed codes to search with")
+    args = parser.parse_args()
+
+    search_client = SearchClient(
+        endpoint=os.getenv("SEARCH_ENDPOINT"),
+        index_name=os.getenv("INDEX_NAME"),
+        credential=AzureKeyCredential(os.getenv("SEARCH_API_KEY"))
+    )
+    embeddings = OpenAIEmbeddings(openai_api_key=os.getenv("OPENAI_API_KEY"))
+    count = export_azure_index(search_client, args.path, embeddings.embed_documents, dtype=args.dtype, hnsw=args.hnsw, quantization=args.quantization)
+    print(f"Exported {count} chunks to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,21 @@
 #Dataset Interface:
+import json
 import math
 import statistics
 import pandas as pd
-import openai
-from metrics_config import accuracy_prompt, relevance_prompt, groundedness_prompt
+from openai_transport import openai_client
+from metrics_config import accuracy_prompt, relevance_prompt, groundedness_prompt, combined_prompt, combined_response_format
+from judge_cache import cached_completion
+from retrieval_metrics import batch_metrics
 
 class Metrics:
 
     #you only need to worry about init, eval_row, and macro_metrics. Ignore the rest.
 
-    def __init__(self):
+    def __init__(self, judge_cache=None):
         self.results = []
-        self.open_ai = openai.OpenAI()
+        self.open_ai = openai_client() #retries, rate limiting and coalescing of identical judge calls
+        self.judge_cache = judge_cache #optional JudgeCache, skips repeat judge calls
 
     def precision(self, retrieved: list, relevant: list) -> float:
         if len(retrieved) == 0: return 0
@@ -55,25 +59,29 @@ class Metrics:
 
     #generation metrics:
     def accuracy(self, generated: str, correct: str) -> float:
-        response = self.open_ai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        content = cached_completion(
+            self.open_ai,
+            self.judge_cache,
+            "gpt-4o-mini",
+            [
                 {
-                "role": "system",
-                "content": accuracy_prompt
+                    "role": "system",
+                    "content": accuracy_prompt
                 },
                 {
-                "role": "user",
-                "content": "llm generated answer: " + generated + "\n correct answer: " + correct
+                    "role": "user",
+                    "content": "llm generated answer: " + generated + "\n correct answer: " + correct
                 }
             ]
         )
-        accuracy = int(response.choices[0].message.content[0])
+        accuracy = int(content[0])
         return accuracy/5
     def relevance(self, generated: str, ground_truth: list) -> float:
-        response = self.open_ai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        content = cached_completion(
+            self.open_ai,
+            self.judge_cache,
+            "gpt-4o-mini",
+            [
                 {
                     "role": "system",
                     "content": relevance_prompt
@@ -84,12 +92,14 @@ class Metrics:
                 }
             ]
         )
-        relevance = int(response.choices[0].message.content[0])
+        relevance = int(content[0])
         return relevance / 5
     def groundedness(self, generated: str, retrieved: list) -> float:
-        response = self.open_ai.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
+        content = cached_completion(
+            self.open_ai,
+            self.judge_cache,
+            "gpt-4o-mini",
+            [
                 {
                     "role": "system",
                     "content": groundedness_prompt
@@ -100,8 +110,28 @@ class Metrics:
                 }
             ]
         )
-        groundedness = int(response.choices[0].message.content[0])
+        groundedness = int(content[0])
         return groundedness / 5
+    def combined(self, question: str, generated: str, correct: str, ground_truth: list, retrieved: list) -> dict:
+        #accuracy, relevance and groundedness from one structured judge call
+        content = cached_completion(
+            self.open_ai,
+            self.judge_cache,
+            "gpt-4o-mini",
+            [
+                {
+                    "role": "system",
+                    "content": combined_prompt
+                },
+                {
+                    "role": "user",
+                    "content": "original question: " + question + "\n llm generated answer: " + generated + "\n correct answer: " + correct + "\n  ground truth: " + "".join(ground_truth) + "\n   retrieved context: " + "".join(retrieved)
+                }
+            ],
+            response_format=combined_response_format
+        )
+        scores = json.loads(content)
+        return {metric: int(scores[metric]) / 5 for metric in ("accuracy", "relevance", "groundedness")}
 
     #running eval:
     def eval_row(
@@ -113,21 +143,28 @@ class Metrics:
             retrieved_docs: list, #retrieved document IDs
             retrieved_chunks: list, #retrieved chunks of text
             ground_truth: list[str],  # list of ground truth phrases from the dataset
+            combined_judge: bool = False, #score the generation metrics with one judge call instead of three
     ):
 
         #retrieval metrics:
+        #all cutoffs in one cumulative pass, same values as precision_at_k/recall_at_k
+        at_k = batch_metrics([retrieved_docs], [relevant_docs])
         p = self.precision(retrieved_docs, relevant_docs)
-        p_at_k = [self.precision_at_k(retrieved_docs, relevant_docs, i+1) for i in range(len(retrieved_docs))]
+        p_at_k = at_k["precision_at_k"][0].tolist()
 
         r = self.recall(retrieved_docs, relevant_docs)
-        r_at_k = [self.recall_at_k(retrieved_docs, relevant_docs, i+1) for i in range(len(retrieved_docs))]
+        r_at_k = at_k["recall_at_k"][0].tolist()
 
         f1 = self.f1(retrieved_docs, relevant_docs)
         #generation metrics:
 
-        a = self.accuracy(generated_answer, correct_answer)
-        rel = self.relevance(generated_answer, ground_truth)
-        g = self.groundedness(generated_answer, retrieved_chunks)
+        if combined_judge:
+            scores = self.combined(question, generated_answer, correct_answer, ground_truth, retrieved_chunks)
+            a, rel, g = scores["accuracy"], scores["relevance"], scores["groundedness"]
+        else:
+            a = self.accuracy(generated_answer, correct_answer)
+            rel = self.relevance(generated_answer, ground_truth)
+            g = self.groundedness(generated_answer, retrieved_chunks)
 
         #return:
         result = {
@@ -10,4 +10,35 @@ relevance_prompt = """
 groundedness_prompt = """
 
 
-"""
\ No newline at end of file
+"""
+
+combined_prompt = """
+You are an AI assistant tasked with evaluating an LLM-generated answer to a given question on three criteria at once. You will be provided with the question, the LLM-generated answer, a human-labeled correct answer, ground truth phrases, and the retrieved context the answer was generated from.
+
+Score each criterion with an integer between 0 and 5:
+accuracy: how well the generated answer aligns with the human-labeled answer. 5 means completely accurate and matching in all essential details, 0 means entirely incorrect, irrelevant, or nonsensical.
+relevance: how well the generated answer addresses the question and aligns with the ground truth phrases. 5 means perfectly relevant and comprehensive, 0 means completely irrelevant or incorrect.
+groundedness: how well the generated answer is supported by the retrieved context. 5 means perfectly grounded and fully supported, 0 means completely ungrounded or contradictory to the context.
+
+Respond only with a JSON object of the form {"accuracy": <int>, "relevance": <int>, "groundedness": <int>}.
+
+Here is your input:
+"""
+
+combined_response_format = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "judge_scores",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "accuracy": {"type": "integer"},
+                "relevance": {"type": "integer"},
+                "groundedness": {"type": "integer"}
+            },
+            "required": ["accuracy", "relevance", "groundedness"],
+            "additionalProperties": False
+        }
+    }
+}
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+import asyncio
+import hashlib
+import json
+import threading
+import time
+
+import httpx
+
+from eval_runner import RateLimiter, backoff_delay, server_delay
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RETRY_ERRORS = (httpx.ConnectError, httpx.RemoteProtocolError)
+
+
+class ThreadRateLimiter(RateLimiter):
+    """eval_runner.RateLimiter for threads: acquire() blocks the calling thread instead of awaiting."""
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self._lock = threading.Lock()
+
+    def update_from_headers(self, headers, headroom=0.9):
+        with self._lock:
+            super().update_from_headers(headers, headroom)
+
+    def acquire(self, tokens=0):
+        while True:
+            with self._lock:
+                self._refill()
+                wait = self._wait_time(tokens)
+                if wait <= 0:
+                    if self.requests_per_minute:
+                        self._request_budget -= 1
+                    if self.tokens_per_minute:
+                        self._token_budget -= min(tokens, self.tokens_per_minute)
+                    return
+            # Sleep without the lock so responses can still update the limits meanwhile
+            time.sleep(wait)
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key: the first caller runs fn, the others block
+    until it finishes and share its result (or its exception). Nothing is kept afterwards.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event(), "result": None, "error": None}
+            else:
+                self.coalesced += 1
+        if not leader:
+            call["done"].wait()
+            if call["error"] is not None:
+                raise call["error"]
+            return call["result"]
+        try:
+            call["result"] = fn(*args, **kwargs)
+            return call["result"]
+        except BaseException as e:
+            call["error"] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+class _OpenAITransportBase:
+    """
+    Policy shared by the sync and async transports below, which sit under the OpenAI SDK's
+    httpx client (and so under langchain's ChatOpenAI/OpenAIEmbeddings as well):
+      - identical in-flight non-streaming requests are sent once and the response is shared;
+      - each (endpoint, model) has a token bucket tuned from the x-ratelimit-* headers, and a
+        429 pauses that bucket for everyone until the server's reset time;
+      - 429s, 5xx and dropped connections are retried with jittered exponential backoff.
+    Clients on top should use max_retries=0 so retries aren't stacked. limiter_factory makes
+    the per-(endpoint, model) buckets: ThreadRateLimiter for the sync transport, RateLimiter
+    for the async one.
+    """
+    def __init__(self, transport, limiter_factory, max_retries=6, base_delay=0.5, max_delay=30.0, coalesce=True):
+        self.transport = transport
+        self.limiter_factory = limiter_factory
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.coalesce = coalesce
+        self.retries = 0
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+    def _inspect(self, request):
+        """Return (limiter, estimated tokens, coalescing key or None) for a request."""
+        body = request.read()
+        model, stream = None, False
+        if body and request.headers.get("content-type", "").startswith("application/json"):
+            try:
+                payload = json.loads(body)
+                model, stream = payload.get("model"), bool(payload.get("stream"))
+            except ValueError:
+                pass
+        limiter_key = (request.url.path, model)
+        with self._limiters_lock:
+            limiter = self._limiters.get(limiter_key)
+            if limiter is None:
+                limiter = self._limiters[limiter_key] = self.limiter_factory()
+        key = None
+        if self.coalesce and request.method == "POST" and not stream:
+            identity = f"{request.headers.get('authorization', '')}\0{request.url.path}\0".encode("utf-8")
+            key = hashlib.sha256(identity + body).hexdigest()
+        # ~4 bytes of JSON per token is a rough but cheap estimate
+        return limiter, len(body) // 4, key
+
+    def _retry_delay(self, attempt, limiter, response=None):
+        """Seconds to wait before retrying, or None when the attempt should not be retried."""
+        if attempt >= self.max_retries:
+            return None
+        if response is None:
+            delay = backoff_delay(attempt, None, self.base_delay, self.max_delay)
+        elif response.status_code in RETRY_STATUSES:
+            rate_limited = response.status_code == 429
+            delay = backoff_delay(attempt, response.headers, self.base_delay, self.max_delay, rate_limited)
+            if rate_limited:
+                # Everyone waits out the server's reset exactly; only this caller's retry is jittered,
+                # so the callers held by the pause don't all resume at one jittered instant
+                reset = server_delay(response.headers, rate_limited=True)
+                limiter.pause(min(self.max_delay, delay if reset is None else reset))
+        else:
+            return None
+        self.retries += 1
+        return delay
+
+    @staticmethod
+    def _copy(response, content, request):
+        return httpx.Response(response.status_code, headers=response.headers, content=content,
+                              request=request, extensions=response.extensions)
+
+
+class OpenAITransport(_OpenAITransportBase, httpx.BaseTransport):
+    def __init__(self, transport=None, **kwargs):
+        super().__init__(transport or httpx.HTTPTransport(), ThreadRateLimiter, **kwargs)
+        self.flight = SingleFlight()
+
+    def handle_request(self, request):
+        limiter, tokens, key = self._inspect(request)
+        if key is None:
+            return self._send(request, limiter, tokens)
+        # Buffer the raw (still encoded) body so every coalesced caller gets its own response
+        response, content = self.flight.do(key, self._send_buffered, request, limiter, tokens)
+        return self._copy(response, content, request)
+
+    def _send_buffered(self, request, limiter, tokens):
+        response = self._send(request, limiter, tokens)
+        try:
+            # A response built in memory (e.g. by httpx.MockTransport) is already read; its stream replays the raw body
+            return response, b"".join(response.stream if response.is_stream_consumed else response.iter_raw())
+        finally:
+            response.close()
+
+    def _send(self, request, limiter, tokens):
+        attempt = 0
+        while True:
+            limiter.acquire(tokens)
+            try:
+                response = self.transport.handle_request(request)
+            except RETRY_ERRORS:
+                delay = self._retry_delay(attempt, limiter)
+                if delay is None:
+                    raise
+            else:
+                limiter.update_from_headers(response.headers)
+                delay = self._retry_delay(attempt, limiter, response)
+                if delay is None:
+                    return response
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def close(self):
+        self.transport.close()
+
+
+class AsyncOpenAITransport(_OpenAITransportBase, httpx.AsyncBaseTransport):
+    """Async counterpart of OpenAITransport for AsyncOpenAI; use it from a single event loop."""
+    def __init__(self, transport=None, **kwargs):
+        super().__init__(transport or httpx.AsyncHTTPTransport(), RateLimiter, **kwargs)
+        self._in_flight = {}
+        self.coalesced = 0
+
+    async def handle_async_request(self, request):
+        limiter, tokens, key = self._inspect(request)
+        if key is None:
+            return await self._send(request, limiter, tokens)
+        future = self._in_flight.get(key)
+        if future is None:
+            future = self._in_flight[key] = asyncio.ensure_future(self._send_buffered(request, limiter, tokens))
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        else:
+            self.coalesced += 1
+        response, content = await asyncio.shield(future)
+        return self._copy(response, content, request)
+
+    async def _send_buffered(self, request, limiter, tokens):
+        response = await self._send(request, limiter, tokens)
+        try:
+            chunks = response.stream if response.is_stream_consumed else response.aiter_raw()
+            return response, b"".join([chunk async for chunk in chunks])
+        finally:
+            await response.aclose()
+
+    async def _send(self, request, limiter, tokens):
+        attempt = 0
+        while True:
+            await limiter.acquire(tokens)
+            try:
+                response = await self.transport.handle_async_request(request)
+            except RETRY_ERRORS:
+                delay = self._retry_delay(attempt, limiter)
+                if delay is None:
+                    raise
+            else:
+                limiter.update_from_headers(response.headers)
+                delay = self._retry_delay(attempt, limiter, response)
+                if delay is None:
+                    return response
+                await response.aclose()
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def openai_client(pool_size=64, timeout=60.0, **transport_args):
+    """openai.OpenAI with retries, rate limiting and coalescing handled by OpenAITransport."""
+    import openai
+    http_client = httpx.Client(
+        transport=OpenAITransport(httpx.HTTPTransport(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)), **transport_args),
+        timeout=httpx.Timeout(timeout, connect=10)
+    )
+    return openai.OpenAI(http_client=http_client, max_retries=0)
+
+
+def async_openai_client(pool_size=64, timeout=60.0, **transport_args):
+    """openai.AsyncOpenAI counterpart of openai_client."""
+    import openai
+    http_client = httpx.AsyncClient(
+        transport=AsyncOpenAITransport(httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size)), **transport_args),
+        timeout=httpx.Timeout(timeout, connect=10)
+    )
+    return openai.AsyncOpenAI(http_client=http_client, max_retries=0)
@@ -1,32 +1,184 @@
 #!/usr/bin/env python3
+import argparse
+import hashlib
+import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from urllib.parse import unquote, urljoin, urlparse
+
 import requests
 from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse
-import time
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+MANIFEST_FILE = ".download_manifest.json"
+
+
+def make_session(pool_size=16):
+    """A pooled keep-alive session that retries transient failures with backoff."""
+    session = requests.Session()
+    retry = Retry(total=3, backoff_factor=1, status_forcelist=(429, 500, 502, 503, 504), respect_retry_after_header=True)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HostLimiter:
+    """
+    Per-host politeness: at most max_per_host requests in flight to a host, and at least
+    delay seconds between the starts of consecutive requests to it. Other hosts are unaffected.
+    """
+    def __init__(self, max_per_host=2, delay=1.0):
+        self.max_per_host = max_per_host
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._semaphores = {}
+        self._next_start = {}
+
+    @contextmanager
+    def slot(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            semaphore = self._semaphores.setdefault(host, threading.Semaphore(self.max_per_host))
+        with semaphore:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+            yield
+
+
+class Manifest:
+    """Thread-safe record of url -> {path, etag, last_modified, size} persisted as JSON."""
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, "r") as file:
+                self.entries = json.load(file)
+
+    def get(self, url):
+        with self._lock:
+            return dict(self.entries.get(url, {}))
+
+    def set(self, url, entry):
+        with self._lock:
+            self.entries[url] = entry
+
+    def save(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as file:
+                json.dump(self.entries, file, indent=1, sort_keys=True)
+            os.replace(tmp_path, self.path)
 
-def download_pdf(url, output_dir):
+
+def content_range_start(value):
+    """First byte offset of a "bytes start-end/total" Content-Range header, or None if unparseable."""
+    unit, _, spec = (value or "").partition(" ")
     try:
-        response = requests.get(url, stream=True)
-        if response.status_code == 200:
-            content_type = response.headers.get('content-type', '').lower()
-            if 'application/pdf' in content_type:
-                filename = os.path.join(output_dir, url.split('/')[-1])
-                with open(filename, 'wb') as f:
-                    for chunk in response.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                print(f"Downloaded: {filename}")
-            else:
-                print(f"Not a PDF: {url}")
-        else:
-            print(f"Failed to download: {url}")
+        return int(spec.split("-", 1)[0]) if unit == "bytes" else None
+    except ValueError:
+        return None
+
+
+def target_path(url, output_dir):
+    """
+    Where url is saved: its path mirrored under output_dir, so same-named files in different
+    folders of a site don't share a file. A query string adds a hash of it to the name.
+    """
+    parsed = urlparse(url)
+    parts = [part for part in unquote(parsed.path).split("/") if part not in ("", ".", "..")] or ["index.pdf"]
+    if parsed.query:
+        stem, extension = os.path.splitext(parts[-1])
+        parts[-1] = f"{stem}-{hashlib.sha1(parsed.query.encode('utf-8')).hexdigest()[:8]}{extension}"
+    return os.path.join(output_dir, *parts)
+
+
+def download_pdf(session, url, output_dir, manifest, limiter):
+    """
+    Download url into output_dir unless it is unchanged since the last run (ETag/Last-Modified
+    conditional GET). Interrupted downloads are kept as .part files and resumed with a Range request;
+    if the server's partial response doesn't start where the .part file ends, it is downloaded
+    again from scratch. Returns "downloaded", "unchanged", "skipped" or "failed".
+    """
+    filename = target_path(url, output_dir)
+    part = filename + ".part"
+    entry = manifest.get(url)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    old_path = entry.get("path")
+    if old_path and old_path != filename and os.path.exists(old_path) and os.path.getsize(old_path) == entry.get("size"):
+        # Saved under its bare file name by an earlier version; move it instead of fetching it again
+        os.replace(old_path, filename)
+
+    headers = {}
+    if os.path.exists(filename) and entry:
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+    offset = os.path.getsize(part) if os.path.exists(part) else 0
+    if offset and entry.get("partial_validator"):
+        headers["Range"] = f"bytes={offset}-"
+        # The server only honors the range if the file hasn't changed since the partial download
+        headers["If-Range"] = entry["partial_validator"]
+
+    try:
+        with limiter.slot(url):
+            response = session.get(url, headers=headers, stream=True, timeout=(10, 60))
+            with response:
+                if response.status_code == 304:
+                    return "unchanged"
+                if response.status_code not in (200, 206):
+                    print(f"Failed to download: {url}")
+                    return "failed"
+                content_type = response.headers.get('content-type', '').lower()
+                if 'application/pdf' not in content_type:
+                    print(f"Not a PDF: {url}")
+                    return "skipped"
+
+                etag = response.headers.get("ETag")
+                last_modified = response.headers.get("Last-Modified")
+                resume = response.status_code == 206
+                misaligned = resume and content_range_start(response.headers.get("Content-Range")) != offset
+                if not misaligned:
+                    # Remember the validator before writing so an interrupted transfer can be resumed
+                    manifest.set(url, {**entry, "partial_validator": etag or last_modified})
+                    with open(part, "ab" if resume else "wb") as f:
+                        for chunk in response.iter_content(chunk_size=65536):
+                            if chunk:
+                                f.write(chunk)
+        if misaligned:
+            # Appending would corrupt the file; retry (outside the host slot) without a Range
+            print(f"Range mismatch for {url}, restarting the download")
+            os.remove(part)
+            manifest.set(url, {key: value for key, value in entry.items() if key != "partial_validator"})
+            return download_pdf(session, url, output_dir, manifest, limiter)
+        os.replace(part, filename)
+        manifest.set(url, {
+            "path": filename,
+            "etag": etag,
+            "last_modified": last_modified,
+            "size": os.path.getsize(filename)
+        })
+        print(f"Downloaded: {filename}" + (f" (resumed at {offset} bytes)" if resume else ""))
+        return "downloaded"
     except Exception as e:
         print(f"Error downloading {url}: {str(e)}")
+        return "failed"
+
 
-def get_pdf_links(url):
+def get_pdf_links(session, url, limiter):
     try:
-        response = requests.get(url)
+        with limiter.slot(url):
+            response = session.get(url, timeout=(10, 60))
         soup = BeautifulSoup(response.text, 'html.parser')
         links = soup.find_all('a')
         pdf_links = []
@@ -40,6 +192,7 @@ def get_pdf_links(url):
         print(f"Error fetching links from {url}: {str(e)}")
         return []
 
+
 def main():
     urls = [
         "https://www.iso-ne.com/participate/rules-procedures/tariff",
@@ -52,21 +205,44 @@ def main():
         "https://www.nerc.com/Pages/default.aspx"
     ]
 
-    base_output_dir = "downloaded_pdfs"
+    parser = argparse.ArgumentParser(description="Download PDFs linked from the ISO-NE/NERC rule pages.")
+    parser.add_argument("--output-dir", default="downloaded_pdfs")
+    parser.add_argument("--workers", type=int, default=8, help="downloads in flight across all hosts")
+    parser.add_argument("--per-host", type=int, default=2, help="concurrent requests per host")
+    parser.add_argument("--delay", type=float, default=1.0, help="seconds between request starts per host")
+    args = parser.parse_args()
+
+    base_output_dir = args.output_dir
+    os.makedirs(base_output_dir, exist_ok=True)
+    session = make_session(pool_size=args.workers)
+    limiter = HostLimiter(max_per_host=args.per_host, delay=args.delay)
+    manifest = Manifest(os.path.join(base_output_dir, MANIFEST_FILE))
+    counts = {"downloaded": 0, "unchanged": 0, "skipped": 0, "failed": 0}
+    start = time.perf_counter()
 
-    for url in urls:
-        print(f"Processing: {url}")
-        domain = urlparse(url).netloc
-        output_dir = os.path.join(base_output_dir, domain)
-        os.makedirs(output_dir, exist_ok=True)
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            pages = {executor.submit(get_pdf_links, session, url, limiter): url for url in urls}
+            downloads = []
+            seen = set()
+            for future in as_completed(pages):
+                url = pages[future]
+                print(f"Processing: {url}")
+                domain = urlparse(url).netloc
+                output_dir = os.path.join(base_output_dir, domain)
+                os.makedirs(output_dir, exist_ok=True)
+                for pdf_url in future.result():
+                    if pdf_url not in seen:
+                        seen.add(pdf_url)
+                        downloads.append(executor.submit(download_pdf, session, pdf_url, output_dir, manifest, limiter))
+            for future in as_completed(downloads):
+                counts[future.result()] += 1
+    finally:
+        manifest.save()
 
-        pdf_links = get_pdf_links(url)
-        for pdf_url in pdf_links:
-            download_pdf(pdf_url, output_dir)
-            time.sleep(3)
+    print("---")
+    print(f"{counts} in {time.perf_counter() - start:.1f}s")
 
-        print(f"Finished processing: {url}")
-        print("---")
 
 if __name__ == "__main__":
     main()
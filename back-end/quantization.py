@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Compressed embeddings for LocalVectorIndex, and a recall-vs-memory benchmark to choose one.
+
+    python quantization.py build local_index --method pq --subvectors 96
+    python quantization.py bench --index local_index [--queries 200] [--k 5]
+    python quantization.py bench --synthetic 100000 --dim 1536
+
+Methods:
+    int8   per-dimension scalar quantization to one byte per value (4x smaller than float32)
+    pq     product quantization: each of `subvectors` slices is replaced by the index of its
+           nearest of 256 centroids, so a vector costs `subvectors` bytes
+The codes are what a worker keeps resident. A query scores every code approximately, then
+re-scores the best rescore * k candidates exactly against the float embeddings, of which only
+those rows are read from the memory-mapped matrix.
+
+bench compares float32, float16, int8 and a few pq sizes, each with and without re-scoring,
+against exact float32 search: recall@k, bytes per vector (and the resident size they imply
+for the index, an estimate rather than a measured RSS) and mean query latency.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+QUANTIZER_FILE = "quantizer.npz"
+CODES_FILE = "codes.npy"
+
+
+class ScalarQuantizer:
+    """int8 codes: each dimension is mapped linearly from its [low, high] range onto 0..255."""
+    method = "int8"
+
+    def __init__(self, low=None, step=None):
+        self.low = low
+        self.step = step
+
+    def train(self, vectors):
+        self.low = vectors.min(axis=0).astype(np.float32)
+        self.step = ((vectors.max(axis=0) - self.low) / 255.0).astype(np.float32)
+        self.step[self.step == 0] = 1.0
+        return self
+
+    def encode(self, vectors):
+        codes = np.rint((np.asarray(vectors, dtype=np.float32) - self.low) / self.step)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes):
+        return self.low + codes.astype(np.float32) * self.step
+
+    def scorer(self, query):
+        """A function scoring a block of codes against query: x . q = low . q + codes . (step * q)."""
+        weights = self.step * query
+        offset = float(self.low @ query)
+        return lambda codes: codes.astype(np.float32) @ weights + offset
+
+    def state(self):
+        return {"low": self.low, "step": self.step}
+
+
+class ProductQuantizer:
+    """pq codes: one byte per subvector, the index of its nearest centroid in that subspace."""
+    method = "pq"
+
+    def __init__(self, subvectors=96, centroids=None, iterations=20, seed=0):
+        self.subvectors = subvectors
+        self.centroids = centroids
+        self.iterations = iterations
+        self.seed = seed
+
+    def train(self, vectors):
+        n, dim = vectors.shape
+        if dim % self.subvectors:
+            raise ValueError(f"{dim} dimensions don't split into {self.subvectors} subvectors")
+        rng = np.random.default_rng(self.seed)
+        size = min(256, n)
+        width = dim // self.subvectors
+        self.centroids = np.empty((self.subvectors, size, width), dtype=np.float32)
+        for m in range(self.subvectors):
+            self.centroids[m] = _kmeans(vectors[:, m * width:(m + 1) * width], size, self.iterations, rng)
+        return self
+
+    def encode(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        width = self.centroids.shape[2]
+        codes = np.empty((len(vectors), self.subvectors), dtype=np.uint8)
+        for m in range(self.subvectors):
+            codes[:, m] = _nearest(vectors[:, m * width:(m + 1) * width], self.centroids[m])
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.centroids[m][codes[:, m]] for m in range(self.subvectors)], axis=1)
+
+    def scorer(self, query):
+        """Asymmetric distance: a (subvectors, 256) table of query-slice . centroid, summed per code."""
+        width = self.centroids.shape[2]
+        table = np.einsum("mcw,mw->mc", self.centroids, query.reshape(self.subvectors, width))
+        columns = np.arange(self.subvectors)
+        return lambda codes: table[columns, codes].sum(axis=1)
+
+    def state(self):
+        return {"centroids": self.centroids}
+
+
+QUANTIZERS = {"int8": ScalarQuantizer, "pq": ProductQuantizer}
+
+
+def _nearest(vectors, centroids):
+    # argmin ||x - c||^2 == argmin ||c||^2 - 2 x . c
+    distances = (centroids * centroids).sum(axis=1) - 2.0 * (vectors @ centroids.T)
+    return distances.argmin(axis=1)
+
+
+def _kmeans(vectors, size, iterations, rng):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), size, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(vectors, centroids)
+        counts = np.bincount(labels, minlength=size)
+        sums = np.stack([np.bincount(labels, weights=vectors[:, j], minlength=size) for j in range(vectors.shape[1])], axis=1)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Restart empty clusters on random points rather than letting them die
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+
+def save_quantizer(path, quantizer):
+    np.savez(os.path.join(path, QUANTIZER_FILE), method=quantizer.method, **quantizer.state())
+
+
+def load_quantizer(path):
+    with np.load(os.path.join(path, QUANTIZER_FILE)) as state:
+        method = str(state["method"])
+        arrays = {name: state[name] for name in state.files if name != "method"}
+    if method == "pq":
+        return ProductQuantizer(subvectors=arrays["centroids"].shape[0], centroids=arrays["centroids"])
+    return ScalarQuantizer(**arrays)
+
+
+def train_quantizer(embeddings, method="int8", subvectors=96, sample_size=50000, block_rows=65536, seed=0):
+    """Train a quantizer on a random sample of an (n, dim) matrix and return (quantizer, codes)."""
+    if len(embeddings) == 0:
+        raise ValueError("Can't train a quantizer without any embeddings")
+    rng = np.random.default_rng(seed)
+    rows = np.sort(rng.choice(len(embeddings), min(sample_size, len(embeddings)), replace=False))
+    sample = np.asarray(embeddings[rows], dtype=np.float32)
+    if method == "pq":
+        quantizer = ProductQuantizer(subvectors, seed=seed).train(sample)
+    elif method == "int8":
+        quantizer = ScalarQuantizer().train(sample)
+    else:
+        raise ValueError(f"Unknown quantization method: {method}")
+    codes = [
+        quantizer.encode(np.asarray(embeddings[start:start + block_rows], dtype=np.float32))
+        for start in range(0, len(embeddings), block_rows)
+    ]
+    return quantizer, np.concatenate(codes)
+
+
+def quantize_index(path, method="int8", subvectors=96, sample_size=50000):
+    """Write codes.npy and quantizer.npz next to the embeddings of a local index directory."""
+    from local_index import EMBEDDINGS_FILE
+    embeddings = np.load(os.path.join(path, EMBEDDINGS_FILE), mmap_mode="r")
+    if len(embeddings) == 0:
+        raise ValueError(f"The index at {path} is empty; there is nothing to quantize")
+    quantizer, codes = train_quantizer(embeddings, method, subvectors, sample_size)
+    np.save(os.path.join(path, CODES_FILE), codes)
+    save_quantizer(path, quantizer)
+    return quantizer
+
+
+def remove_quantization(path):
+    for name in (CODES_FILE, QUANTIZER_FILE):
+        if os.path.exists(os.path.join(path, name)):
+            os.remove(os.path.join(path, name))
+
+
+def approximate_search(quantizer, codes, query, k, block_rows=4096):
+    """
+    (row ids, approximate scores) of the k best codes for a unit query, best first. Codes are
+    scored block_rows at a time, so a query's float32 scratch is block_rows x dim, not n x dim.
+    """
+    score = quantizer.scorer(query)
+    best_ids = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for start in range(0, len(codes), block_rows):
+        scores = score(np.asarray(codes[start:start + block_rows]))
+        top = np.argpartition(-scores, k - 1)[:k] if len(scores) > k else np.arange(len(scores))
+        best_ids = np.concatenate([best_ids, top + start])
+        best_scores = np.concatenate([best_scores, scores[top].astype(np.float32)])
+        if len(best_scores) > k:
+            keep = np.argpartition(-best_scores, k - 1)[:k]
+            best_ids, best_scores = best_ids[keep], best_scores[keep]
+    order = np.argsort(-best_scores, kind="stable")
+    return best_ids[order], best_scores[order]
+
+
+def rescore(embeddings, query, candidates, k):
+    """Exact scores of the candidate rows; reads only those rows of the (memory-mapped) matrix."""
+    rows = np.sort(candidates)
+    scores = np.asarray(embeddings[rows], dtype=np.float32) @ query
+    order = np.argsort(-scores, kind="stable")[:k]
+    return rows[order], scores[order]
+
+
+def synthetic_embeddings(n, dim, clusters=200, seed=0):
+    """Unit vectors drawn around random cluster centres, roughly as clumpy as text embeddings."""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(clusters, size=n)] + 0.6 * rng.standard_normal((n, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def exact_search(embeddings, query, k):
+    scores = np.asarray(embeddings, dtype=np.float32) @ query
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top], kind="stable")]
+
+
+def bench(embeddings, queries, k=5, subvectors=(48, 96, 192), rescore_factors=(0, 4, 10)):
+    """Recall@k against exact float32 search for each storage setting; one row per setting."""
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    n, dim = embeddings.shape
+    truth = [set(exact_search(embeddings, query, k).tolist()) for query in queries]
+
+    def measure(name, bytes_per_vector, search):
+        start = time.perf_counter()
+        found = [search(query) for query in queries]
+        seconds = (time.perf_counter() - start) / len(queries)
+        recall = np.mean([len(truth_set & set(np.asarray(ids).tolist())) / k for truth_set, ids in zip(truth, found)])
+        return {"setting": name, "bytes_per_vector": bytes_per_vector,
+                "resident_mb_estimate": round(bytes_per_vector * n / 2 ** 20, 1),
+                "recall": round(float(recall), 4), "query_ms": round(1000 * seconds, 3)}
+
+    results = [measure("float32", 4 * dim, lambda query: exact_search(embeddings, query, k))]
+    half = embeddings.astype(np.float16)
+    results.append(measure("float16", 2 * dim, lambda query: exact_search(half, query, k)))
+
+    quantizers = [("int8", "int8", None)]
+    quantizers += [(f"pq{m}", "pq", m) for m in subvectors if dim % m == 0]
+    for name, method, m in quantizers:
+        quantizer, codes = train_quantizer(embeddings, method, m or 0)
+        for factor in rescore_factors:
+            label = f"{name}+rescore{factor}" if factor else name
+            if factor:
+                def search(query, quantizer=quantizer, codes=codes, factor=factor):
+                    candidates, _ = approximate_search(quantizer, codes, query, min(n, factor * k))
+                    return rescore(embeddings, query, candidates, k)[0]
+            else:
+                def search(query, quantizer=quantizer, codes=codes):
+                    return approximate_search(quantizer, codes, query, k)[0]
+            results.append(measure(label, codes.shape[1], search))
+    return results
+
+
+def format_table(results):
+    header = ["setting", "bytes/vector", "est. resident MB", "recall", "query ms"]
+    rows = [[r["setting"], r["bytes_per_vector"], r["resident_mb_estimate"], f"{r['recall']:.3f}", f"{r['query_ms']:.2f}"] for r in results]
+    widths = [max(len(str(value)) for value in column) for column in zip(header, *rows)]
+    return "\n".join("  ".join(str(value).ljust(width) for value, width in zip(row, widths)) for row in [header] + rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="quantize the embeddings of a local index")
+    build.add_argument("index_path")
+    build.add_argument("--method", choices=sorted(QUANTIZERS), default="int8")
+    build.add_argument("--subvectors", type=int, default=96, help="pq bytes per vector; must divide the dimension")
+    build.add_argument("--sample-size", type=int, default=50000, help="vectors the quantizer is trained on")
+
+    measure = commands.add_parser("bench", help="recall vs memory of each storage setting")
+    source = measure.add_mutually_exclusive_group(required=True)
+    source.add_argument("--index", help="local index whose embeddings to use")
+    source.add_argument("--synthetic", type=int, metavar="N", help="generate N clustered unit vectors instead")
+    measure.add_argument("--dim", type=int, default=1536, help="dimension of --synthetic vectors")
+    measure.add_argument("--queries", type=int, default=200, help="held-out rows used as queries")
+    measure.add_argument("--k", type=int, default=5)
+    measure.add_argument("--subvectors", type=int, nargs="+", default=[48, 96, 192])
+    measure.add_argument("--rescore", type=int, nargs="+", default=[0, 4, 10], help="shortlist sizes as multiples of k (0: no re-scoring)")
+    measure.add_argument("--output", help="also write the results as JSON")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        quantizer = quantize_index(args.index_path, args.method, args.subvectors, args.sample_size)
+        print(f"Wrote {quantizer.method} codes to {os.path.join(args.index_path, CODES_FILE)}")
+        return
+
+    if args.index:
+        from local_index import EMBEDDINGS_FILE
+        vectors = np.asarray(np.load(os.path.join(args.index, EMBEDDINGS_FILE), mmap_mode="r"), dtype=np.float32)
+    else:
+        vectors = synthetic_embeddings(args.synthetic + args.queries, args.dim)
+    # Hold the query rows out of the corpus, as a real question wouldn't be one of the chunks
+    rng = np.random.default_rng(1)
+    held_out = rng.choice(len(vectors), min(args.queries, len(vectors) // 10 or 1), replace=False)
+    queries = vectors[held_out]
+    corpus = np.delete(vectors, held_out, axis=0)
+    results = bench(corpus, queries, args.k, args.subvectors, args.rescore)
+    print(f"{len(corpus)} vectors x {corpus.shape[1]} dims, {len(queries)} queries, recall@{args.k} vs exact float32\n")
+    print(format_table(results))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
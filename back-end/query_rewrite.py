@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import contextvars
+import json
+import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from retrievers import BaseRetriever
+from hybrid import reciprocal_rank_fusion
+from response_cache import normalize_query
+from instrumentation import span
+
+logger = logging.getLogger(__name__)
+
+# Terms the ISO-NE and NERC documents spell out where questions tend to abbreviate, and vice versa
+DEFAULT_ACRONYMS = {
+    "AGC": "Automatic Generation Control",
+    "ARR": "Auction Revenue Right",
+    "BES": "Bulk Electric System",
+    "CIP": "Critical Infrastructure Protection",
+    "CSO": "Capacity Supply Obligation",
+    "DAM": "Day-Ahead Energy Market",
+    "DER": "Distributed Energy Resource",
+    "DR": "Demand Response",
+    "FCA": "Forward Capacity Auction",
+    "FCM": "Forward Capacity Market",
+    "FERC": "Federal Energy Regulatory Commission",
+    "FTR": "Financial Transmission Right",
+    "ICR": "Installed Capacity Requirement",
+    "ISO-NE": "ISO New England",
+    "LMP": "Locational Marginal Price",
+    "NCPC": "Net Commitment Period Compensation",
+    "NERC": "North American Electric Reliability Corporation",
+    "NPCC": "Northeast Power Coordinating Council",
+    "OATT": "Open Access Transmission Tariff",
+    "PFP": "Pay-for-Performance",
+    "RMR": "Reliability Must-Run",
+    "RTM": "Real-Time Energy Market",
+    "RTO": "Regional Transmission Organization"
+}
+
+
+def load_acronyms(path=None):
+    """DEFAULT_ACRONYMS, extended or overridden by a JSON {"ACRONYM": "expansion"} file."""
+    acronyms = dict(DEFAULT_ACRONYMS)
+    if path:
+        with open(path, "r", encoding="utf-8") as file:
+            acronyms.update(json.load(file))
+    return acronyms
+
+
+class AcronymRewriter:
+    """
+    Rule-based rewrites from an acronym dictionary, with no model call: the question with its
+    acronyms spelled out, and the question with spelled-out terms abbreviated.
+    """
+    def __init__(self, acronyms=None):
+        self.acronyms = acronyms or DEFAULT_ACRONYMS
+        # Acronyms match case-sensitively so that e.g. "DR" doesn't fire on "dr"
+        self._short = [(re.compile(rf"(?<![\w-]){re.escape(short)}(?![\w-])"), long) for short, long in self.acronyms.items()]
+        self._long = [(re.compile(rf"\b{re.escape(long)}s?\b", re.IGNORECASE), short) for short, long in self.acronyms.items()]
+
+    def rewrite(self, query):
+        expanded, contracted = query, query
+        for pattern, long in self._short:
+            expanded = pattern.sub(long, expanded)
+        for pattern, short in self._long:
+            contracted = pattern.sub(short, contracted)
+        return [rewrite for rewrite in dict.fromkeys([expanded, contracted]) if rewrite != query]
+
+
+class LLMRewriter:
+    """Asks the chat model for `count` alternative phrasings of the question in the documents' terms."""
+    PROMPT = """Rewrite the question below as {count} different search queries for finding the answer in
+ISO New England and NERC regulatory documents (tariffs, market rules, manuals, reliability standards).
+Use the terminology those documents use, spelling out or abbreviating terms where that helps.
+Return only the queries, one per line, without numbering.
+
+Question: {query}"""
+
+    def __init__(self, llm, count=3):
+        self.llm = llm
+        self.count = count
+
+    def rewrite(self, query):
+        try:
+            text = self.llm.invoke(self.PROMPT.format(count=self.count, query=query)).content
+        except Exception as e:
+            logger.warning("Query rewriting failed, searching with the question only: %s", e)
+            return []
+        lines = [re.sub(r"^\s*(?:[-*•]|\d+[.)])\s*", "", line).strip() for line in text.splitlines()]
+        return [line for line in dict.fromkeys(lines) if line and line != query][:self.count]
+
+
+def make_rewriter(name, llm=None, count=3, acronyms_path=None):
+    if name == "llm":
+        return LLMRewriter(llm, count)
+    if name == "acronyms":
+        return AcronymRewriter(load_acronyms(acronyms_path))
+    raise ValueError(f"Unknown multi_query rewriter: {name}")
+
+
+class MultiQueryRetriever(BaseRetriever):
+    """
+    Searches with the question and each of its rewrites concurrently (fetch_k candidates each)
+    and fuses the rankings with reciprocal-rank fusion, the original weighted original_weight.
+    The question's own search runs on the calling thread while the rewrites are produced (or,
+    when cached, searched) on a pool shared by all requests, so the added latency is about one
+    search round trip. Each request uses up to rewrites + 1 pool threads, so size workers to
+    that times the server's request threads. Rewrites are cached per normalized question in
+    an LRU of cache_size entries; a failed rewrite search only drops that ranking.
+    """
+    def __init__(self, retriever, rewriter, k=5, fetch_k=20, rrf_k=60, original_weight=1.0, cache_size=1024, workers=128):
+        super().__init__(k)
+        self.retriever = retriever
+        self.rewriter = rewriter
+        self.fetch_k = fetch_k
+        self.rrf_k = rrf_k
+        self.original_weight = original_weight
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="multi-query")
+
+    def _cached_rewrites(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            rewrites = self._cache.get(key)
+            if rewrites is not None:
+                self._cache.move_to_end(key)
+            return rewrites
+
+    def rewrites(self, query):
+        rewrites = self._cached_rewrites(query)
+        if rewrites is not None:
+            return rewrites
+        key = normalize_query(query)
+        with span("rewrite"):
+            rewrites = self.rewriter.rewrite(query)
+        with self._lock:
+            self._cache[key] = rewrites
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return rewrites
+
+    def _submit(self, fn, *args):
+        # Run in the caller's context so the spans land in the request trace
+        return self._executor.submit(contextvars.copy_context().run, fn, *args)
+
+    def get_relevant_documents(self, query, k=None):
+        k = k or self.k
+        fetch_k = max(self.fetch_k, k)
+        rewrites = self._cached_rewrites(query)
+        if rewrites is None:
+            pending = self._submit(self.rewrites, query)
+        else:
+            pending = None
+            searches = [self._submit(self.retriever.get_relevant_documents, rewrite, fetch_k) for rewrite in rewrites]
+        rankings = [self.retriever.get_relevant_documents(query, fetch_k)]
+        if pending is not None:
+            searches = [self._submit(self.retriever.get_relevant_documents, rewrite, fetch_k) for rewrite in pending.result()]
+        for search in searches:
+            try:
+                rankings.append(search.result())
+            except Exception as e:
+                logger.warning("Search for a query rewrite failed: %s", e)
+        if len(rankings) == 1:
+            return rankings[0][:k]
+        weights = [self.original_weight] + [1.0] * (len(rankings) - 1)
+        return reciprocal_rank_fusion(rankings, k=k, rrf_k=self.rrf_k, weights=weights)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.retriever.close()
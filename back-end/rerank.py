@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import logging
+import math
+import threading
+import time
+from collections import Counter, OrderedDict
+
+from retrievers import BaseRetriever
+from hybrid import tokenize, document_key
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderScorer:
+    """Scores (query, passage) pairs with a sentence-transformers cross-encoder on CPU."""
+    def __init__(self, model_name="cross-encoder/ms-marco-MiniLM-L-6-v2", batch_size=32, max_length=512):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.batch_size = batch_size
+
+    def score(self, query, texts):
+        return [float(score) for score in self.model.predict([(query, text) for text in texts], batch_size=self.batch_size)]
+
+
+class LexicalScorer:
+    """
+    Dependency-free scorer: idf-weighted coverage of the query terms in each passage, with the
+    idf computed over the candidate set. Much weaker than a cross-encoder, but takes microseconds.
+    """
+    def score(self, query, texts):
+        terms = set(tokenize(query))
+        passages = [Counter(tokenize(text)) for text in texts]
+        n = len(passages)
+        idf = {term: math.log(1 + n / (1 + sum(term in passage for passage in passages))) for term in terms}
+        total = sum(idf.values()) or 1.0
+        return [
+            sum(idf[term] * (1 + math.log(passage[term])) for term in terms if passage[term]) / total
+            for passage in passages
+        ]
+
+
+def make_scorer(name):
+    if name == "cross-encoder":
+        return CrossEncoderScorer()
+    if name == "lexical":
+        return LexicalScorer()
+    raise ValueError(f"Unknown reranker: {name}")
+
+
+class RerankingRetriever(BaseRetriever):
+    """
+    Over-fetches fetch_k candidates from a first-stage retriever and reorders them with scorer,
+    returning the top k. Scores are cached per (query, chunk) in an LRU. Scoring runs on the
+    calling thread in batches of batch_size passages; if it hasn't finished latency_budget
+    seconds after it started (or fails), it stops at the next batch and the first-stage order
+    is returned instead. The batches already scored stay cached for the next identical query.
+    latency_budget=None scores every candidate however long it takes.
+    """
+    def __init__(self, retriever, scorer, k=5, fetch_k=50, latency_budget=0.5, cache_size=50000, batch_size=16):
+        super().__init__(k)
+        self.retriever = retriever
+        self.scorer = scorer
+        self.fetch_k = fetch_k
+        self.latency_budget = latency_budget
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.fallbacks = 0
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _score(self, query, docs, deadline=None):
+        """Scores for docs, or None if deadline (a perf_counter time) passed before all were scored."""
+        keys = [(query, document_key(doc)) for doc in docs]
+        with self._lock:
+            scores = [self._cache.get(key) for key in keys]
+            for key, score in zip(keys, scores):
+                if score is not None:
+                    self._cache.move_to_end(key)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        for start in range(0, len(missing), self.batch_size):
+            if deadline is not None and time.perf_counter() > deadline:
+                return None
+            batch = missing[start:start + self.batch_size]
+            fresh = self.scorer.score(query, [docs[i]["page_content"] for i in batch])
+            with self._lock:
+                for i, score in zip(batch, fresh):
+                    scores[i] = score
+                    self._cache[keys[i]] = score
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def get_relevant_documents(self, query, k=None):
+        k = k or self.k
+        candidates = self.retriever.get_relevant_documents(query, max(self.fetch_k, k))
+        # The budget covers the scoring itself, which starts now
+        deadline = None if self.latency_budget is None else time.perf_counter() + self.latency_budget
+        try:
+            scores = self._score(query, candidates, deadline)
+        except Exception as e:
+            logger.warning("Reranking failed, using first-stage order: %s", e)
+            scores = None
+        if scores is None:
+            self.fallbacks += 1
+            return candidates[:k]
+        order = sorted(range(len(candidates)), key=lambda i: -scores[i])[:k]
+        return [{**candidates[i], "score": scores[i]} for i in order]
+
+    def close(self):
+        self.retriever.close()
+
+
+def main():
+    import argparse
+    import os
+    import time
+    from RAG_Core import PDFRAGSystem
+    from retrieval_metrics import batch_metrics, load_qa_relevance, summarize
+
+    parser = argparse.ArgumentParser(description="Compare first-stage retrieval with reranked retrieval on qa.tsv.")
+    parser.add_argument("--reranker", default="cross-encoder", choices=["cross-encoder", "lexical"])
+    parser.add_argument("--fetch-k", type=int, default=50)
+    parser.add_argument("--budget", type=float, default=2.0, help="rerank latency budget in seconds")
+    args = parser.parse_args()
+
+    rag_system = PDFRAGSystem(api_key=os.getenv("OPENAI_API_KEY"), search_endpoint=os.getenv("SEARCH_ENDPOINT"), search_api_key=os.getenv("SEARCH_API_KEY"), index_name=os.getenv("INDEX_NAME"), local_index_path=os.getenv("LOCAL_INDEX_PATH"), retrieval_mode=os.getenv("RETRIEVAL_MODE"))
+    first_stage = rag_system.retriever
+    reranker = RerankingRetriever(first_stage, make_scorer(args.reranker), k=first_stage.k, fetch_k=args.fetch_k, latency_budget=args.budget)
+    qa = load_qa_relevance("qa.tsv")
+    relevant = [titles for _, titles in qa]
+
+    for name, retriever in (("first stage", first_stage), (f"rerank ({args.reranker})", reranker)):
+        retrieved, start = [], time.perf_counter()
+        for question, _ in qa:
+            # Metrics are over distinct documents, as in sweep.py; several chunks can share a title
+            retrieved.append(list(dict.fromkeys(doc["metadata"]["title"] for doc in retriever.get_relevant_documents(question))))
+        elapsed = time.perf_counter() - start
+        print(name, f"{elapsed / len(qa) * 1000:.0f} ms/query", summarize(batch_metrics(retrieved, relevant)))
+    print(f"rerank fallbacks: {reranker.fallbacks}")
+
+
+if __name__ == "__main__":
+    main()
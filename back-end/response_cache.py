@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold, collapse whitespace and drop trailing punctuation so trivial variants share an entry."""
+    return re.sub(r"\s+", " ", query).strip().lower().rstrip("?.! ")
+
+
+class ResponseCache:
+    """
+    Two-tier cache of RAG responses.
+    The exact tier matches on the normalized query string. The optional semantic tier embeds the
+    query with embed_fn and returns a cached response whose query embedding has cosine similarity
+    of at least similarity_threshold. Entries expire after ttl seconds; the least recently used
+    entry is evicted once max_entries is reached.
+    """
+    def __init__(self, max_entries=1024, ttl=3600, embed_fn=None, similarity_threshold=0.95):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.embed_fn = embed_fn
+        self.similarity_threshold = similarity_threshold
+        self._entries = OrderedDict()
+        self._matrix = None
+        self._matrix_keys = []
+        self._lock = threading.Lock()
+        self._stats = {
+            tier: {"hits": 0, "latency_saved": 0.0} for tier in ("exact", "semantic")
+        }
+        self._misses = 0
+
+    @property
+    def semantic(self):
+        return self.embed_fn is not None and self.similarity_threshold is not None
+
+    def lookup(self, query: str):
+        """Return (response, tier, embedding); response and tier are None on a miss."""
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._get_live(key)
+            if entry is not None:
+                return self._hit(key, entry, "exact"), "exact", entry["embedding"]
+
+        if not self.semantic:
+            with self._lock:
+                self._misses += 1
+            return None, None, None
+
+        embedding = self._embed(query)
+        with self._lock:
+            match = self._nearest(embedding)
+            if match is not None:
+                return self._hit(match, self._entries[match], "semantic"), "semantic", embedding
+            self._misses += 1
+        return None, None, embedding
+
+    def put(self, query: str, response: dict, cost: float = 0.0, embedding=None):
+        """Store a response; cost is the seconds it took to compute, credited on later hits."""
+        key = normalize_query(query)
+        if self.semantic and embedding is None:
+            embedding = self._embed(query)
+        with self._lock:
+            self._entries[key] = {
+                "response": response,
+                "embedding": embedding,
+                "created": time.monotonic(),
+                "cost": cost
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def invalidate(self):
+        """Drop every entry, e.g. after the search index has been refreshed."""
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self):
+        with self._lock:
+            hits = sum(tier["hits"] for tier in self._stats.values())
+            lookups = hits + self._misses
+            report = {
+                "entries": len(self._entries),
+                "misses": self._misses,
+                "hit_rate": hits / lookups if lookups else 0.0
+            }
+            for name, tier in self._stats.items():
+                report[name] = {
+                    "hits": tier["hits"],
+                    "hit_rate": tier["hits"] / lookups if lookups else 0.0,
+                    "latency_saved": tier["latency_saved"]
+                }
+            return report
+
+    def _embed(self, query):
+        vector = np.asarray(self.embed_fn(query), dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _get_live(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self.ttl is not None and time.monotonic() - entry["created"] > self.ttl:
+            del self._entries[key]
+            self._matrix = None
+            return None
+        return entry
+
+    def _hit(self, key, entry, tier):
+        self._entries.move_to_end(key)
+        self._stats[tier]["hits"] += 1
+        self._stats[tier]["latency_saved"] += entry["cost"]
+        return dict(entry["response"])
+
+    def _nearest(self, embedding):
+        if self._matrix is None:
+            self._matrix_keys = [key for key, entry in self._entries.items() if entry["embedding"] is not None]
+            if not self._matrix_keys:
+                return None
+            self._matrix = np.stack([self._entries[key]["embedding"] for key in self._matrix_keys])
+        if not self._matrix_keys:
+            return None
+        similarities = self._matrix @ embedding
+        # Walk candidates best-first, skipping ones that have expired since the matrix was built
+        for index in np.argsort(-similarities):
+            if similarities[index] < self.similarity_threshold:
+                return None
+            key = self._matrix_keys[index]
+            if key in self._entries and self._get_live(key) is not None:
+                return key
+        return None
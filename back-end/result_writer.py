@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import os
+
+
+def row_key(question: str, config: dict) -> str:
+    """Stable identifier for an evaluated row: the question plus the configuration it was run with."""
+    payload = json.dumps({"question": question, "config": config}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class JsonlResultWriter:
+    """
+    Append-only JSONL checkpoint for evaluation results.
+    Each completed row is written as one line and flushed to disk, so a rerun can
+    skip rows that were already evaluated instead of rewriting the whole result list.
+    """
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self._completed = self._load()
+        # A crash mid-write can leave a truncated last line; start the next record on a fresh one
+        self._needs_newline = self._has_partial_line()
+        self._file = open(self.path, "a", encoding="utf-8")
+
+    def _load(self):
+        completed = {}
+        if not os.path.exists(self.path):
+            return completed
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                # A partial line can still parse (e.g. as a number), and other tools may append to the file
+                if isinstance(record, dict) and "key" in record and "result" in record:
+                    completed[record["key"]] = record["result"]
+        return completed
+
+    def __contains__(self, key):
+        return key in self._completed
+
+    def __len__(self):
+        return len(self._completed)
+
+    def get(self, key, default=None):
+        return self._completed.get(key, default)
+
+    def write(self, key, result):
+        line = json.dumps({"key": key, "result": result})
+        if self._needs_newline:
+            line = "\n" + line
+            self._needs_newline = False
+        self._file.write(line + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._completed[key] = result
+
+    def _has_partial_line(self):
+        if not os.path.exists(self.path) or os.path.getsize(self.path) == 0:
+            return False
+        with open(self.path, "rb") as file:
+            file.seek(-1, os.SEEK_END)
+            return file.read(1) != b"\n"
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+import csv
+import os
+from urllib.parse import urlparse
+
+import numpy as np
+
+
+def load_qa_relevance(path="qa.tsv"):
+    """
+    (question, relevant document titles) pairs from the QA set. The relevant document is the
+    file named by the source URL in the fourth column, matching the "title" metadata of chunks.
+    """
+    rows = []
+    with open(path, "r") as file:
+        for line in csv.reader(file, delimiter="\t"):
+            if len(line) < 4:
+                continue
+            title = os.path.basename(urlparse(line[3].strip()).path)
+            rows.append((line[1], [title]))
+    return rows
+
+
+def hit_matrix(retrieved_batch: list[list], relevant_batch: list[list], max_k: int = None):
+    """
+    Pad a batch of ragged retrieved lists into a (rows, max_k) boolean matrix of hits.
+    Returns (hits, first_hits, lengths, n_relevant, n_relevant_unique); first_hits only marks
+    the first retrieval of each relevant document in a row, not its repeats further down.
+    """
+    n = len(retrieved_batch)
+    lengths = np.array([len(retrieved) for retrieved in retrieved_batch], dtype=np.int64)
+    if max_k is None:
+        max_k = int(lengths.max()) if n else 0
+    lengths = np.minimum(lengths, max_k)
+
+    # Encode every (row, document) pair as a single integer so membership is one np.isin call
+    ids = {}
+    retrieved_codes = np.full((n, max_k), -1, dtype=np.int64)
+    relevant_codes = []
+    for row, (retrieved, relevant) in enumerate(zip(retrieved_batch, relevant_batch)):
+        for col, doc in enumerate(retrieved[:max_k]):
+            retrieved_codes[row, col] = ids.setdefault(doc, len(ids))
+        relevant_codes.append([ids.setdefault(doc, len(ids)) for doc in relevant])
+    vocabulary = max(len(ids), 1)
+    flat_relevant = np.array(
+        [row * vocabulary + code for row, codes in enumerate(relevant_codes) for code in codes],
+        dtype=np.int64
+    )
+    rows = np.arange(n, dtype=np.int64)[:, None]
+    hits = np.isin(rows * vocabulary + retrieved_codes, flat_relevant) & (retrieved_codes >= 0)
+    # np.unique's indices are of first occurrences in row-major order, i.e. earliest rank per row
+    _, first = np.unique((rows * vocabulary + retrieved_codes).ravel(), return_index=True)
+    first_seen = np.zeros(hits.size, dtype=bool)
+    first_seen[first] = True
+    first_hits = hits & first_seen.reshape(hits.shape)
+
+    n_relevant = np.array([len(relevant) for relevant in relevant_batch], dtype=np.int64)
+    n_relevant_unique = np.array([len(set(relevant)) for relevant in relevant_batch], dtype=np.int64)
+    return hits, first_hits, lengths, n_relevant, n_relevant_unique
+
+
+def batch_metrics(retrieved_batch: list[list], relevant_batch: list[list], max_k: int = None) -> dict:
+    """
+    Retrieval metrics for every row and every cutoff k in one pass.
+
+    precision/recall/f1 at k follow Metrics.precision_at_k/recall_at_k exactly (including their
+    empty-list conventions and the cutoff saturating at the number retrieved). The "*_at_k"
+    arrays are (rows, max_k) with column j holding the value at k = j + 1; mrr and map are per row.
+    """
+    hits, first_hits, lengths, n_relevant, n_relevant_unique = hit_matrix(retrieved_batch, relevant_batch, max_k)
+    n, max_k = hits.shape
+    ks = np.arange(1, max_k + 1, dtype=np.int64)
+
+    true_positives = np.cumsum(hits, axis=1, dtype=np.float64)
+    retrieved_at_k = np.minimum(ks[None, :], lengths[:, None]).astype(np.float64)
+    has_retrieved = lengths[:, None] > 0
+    has_relevant = n_relevant[:, None] > 0
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(has_retrieved & has_relevant, true_positives / retrieved_at_k, 0.0)
+        recall = np.where(
+            ~has_retrieved, 0.0,
+            np.where(has_relevant, true_positives / np.maximum(n_relevant[:, None], 1), 1.0)
+        )
+        denominator = precision + recall
+        f1 = np.where(denominator > 0, 2 * precision * recall / denominator, 0.0)
+
+    # Rank-aware metrics use binary gains and count each relevant document once
+    if max_k:
+        first_hit = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, 0)
+    else:
+        first_hit = np.zeros(n, dtype=np.int64)
+    mrr = np.where(first_hit > 0, 1.0 / np.maximum(first_hit, 1), 0.0)
+
+    discounts = 1.0 / np.log2(ks + 1)
+    dcg = np.cumsum(first_hits * discounts[None, :], axis=1)
+    ideal_counts = np.minimum(ks[None, :], n_relevant_unique[:, None])
+    ideal_dcg = np.concatenate([[0.0], np.cumsum(discounts)])[ideal_counts]
+    ndcg = np.where(ideal_dcg > 0, dcg / np.where(ideal_dcg > 0, ideal_dcg, 1.0), 0.0)
+
+    precision_at_rank = np.cumsum(first_hits, axis=1, dtype=np.float64) / ks[None, :]
+    average_precision = np.where(
+        n_relevant_unique > 0,
+        (precision_at_rank * first_hits).sum(axis=1) / np.maximum(n_relevant_unique, 1),
+        0.0
+    )
+
+    return {
+        "precision_at_k": precision,
+        "recall_at_k": recall,
+        "f1_at_k": f1,
+        "ndcg_at_k": ndcg,
+        "mrr": mrr,
+        "map": average_precision,
+        "lengths": lengths
+    }
+
+
+def summarize(metrics: dict, ks=(1, 3, 5, 10)) -> dict:
+    """Mean of each metric over the batch, at the requested cutoffs."""
+    summary = {"mrr": float(metrics["mrr"].mean()) if len(metrics["mrr"]) else 0.0,
+               "map": float(metrics["map"].mean()) if len(metrics["map"]) else 0.0}
+    max_k = metrics["precision_at_k"].shape[1]
+    for k in ks:
+        if k > max_k:
+            continue
+        for name in ("precision", "recall", "f1", "ndcg"):
+            summary[f"{name}@{k}"] = float(metrics[f"{name}_at_k"][:, k - 1].mean())
+    return summary
@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+
+class BaseRetriever:
+    """
+    Interface shared by every retriever PDFRAGSystem can use.
+    get_relevant_documents returns up to k documents (self.k unless the call passes k), best first,
+    each a dict of the form {"page_content": str, "metadata": {"chunk_id", "parent_id", "title"}}
+    with an optional "score". Wrappers pass their fetch size as k rather than setting it on the
+    retriever they wrap, which other requests are searching with at the same time.
+    """
+    def __init__(self, k=5):
+        self.k = k
+
+    def get_relevant_documents(self, query, k=None):
+        raise NotImplementedError
+
+    def close(self):
+        """Release the retriever's threads, and those of any retriever it wraps."""
@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Retrieval parameter sweep over qa.tsv: no LLM calls, only retrieval and retrieval metrics.
+
+    python sweep.py --set k=3,5,10 --set retrieval_mode=keyword,vector,hybrid
+    python sweep.py --grid grid.json [--workers 16] [--sort ndcg] [--output sweep.json]
+
+A grid is the cartesian product of the --set values, or a JSON file holding either such a
+{"param": [values]} mapping or a list of config dicts. Parameters:
+    retrieval_mode   keyword | vector | hybrid
+    k                documents returned
+    fetch_k, rrf_k   hybrid candidates per retriever and RRF constant
+    reranker         none | lexical | cross-encoder, with rerank_fetch_k candidates
+    chunk_size, chunk_overlap
+                     re-chunk --pdf-folder into a local index per setting (embeddings are cached)
+Unset parameters take PDFRAGSystem's defaults. Retrieval runs once per (question, retrieval
+setting) in a thread pool; configs that differ only in k share one retrieval at the largest k
+when that is exact. Results are cached in SQLite, so re-running with extra configs only
+retrieves what is new. Scores use retrieval_metrics, which match Metrics' precision/recall,
+over the distinct documents (titles) among each config's top k chunks.
+"""
+import argparse
+import copy
+import hashlib
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from retrieval_metrics import batch_metrics, load_qa_relevance
+from rerank import RerankingRetriever, make_scorer
+from hybrid import BM25Retriever, HybridRetriever
+from local_index import LocalVectorIndex, LocalVectorRetriever
+
+DEFAULTS = {
+    "retrieval_mode": None,
+    "k": 5,
+    "fetch_k": 20,
+    "rrf_k": 60,
+    "reranker": "none",
+    "rerank_fetch_k": 50,
+    "chunk_size": None,
+    "chunk_overlap": None
+}
+
+
+class RetrievalCache:
+    """Retrieved (title, chunk_id, score) lists per (retrieval setting, question), in SQLite."""
+    def __init__(self, path="sweep_cache.sqlite3"):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS retrievals (key TEXT PRIMARY KEY, docs TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(setting: dict, question: str) -> str:
+        return hashlib.sha256(json.dumps([setting, question], sort_keys=True).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT docs FROM retrievals WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, docs):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO retrievals (key, docs) VALUES (?, ?)", (key, json.dumps(docs)))
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def parse_value(value):
+    for cast in (int, float):
+        try:
+            return cast(value)
+        except ValueError:
+            pass
+    return None if value in ("", "None", "null") else value
+
+
+def load_grid(path=None, settings=()):
+    """Expand a grid file and/or --set name=v1,v2 options into a list of complete configs."""
+    grid = {}
+    configs = None
+    if path:
+        with open(path, "r") as file:
+            loaded = json.load(file)
+        if isinstance(loaded, list):
+            configs = loaded
+        else:
+            grid.update(loaded)
+    for setting in settings:
+        name, _, values = setting.partition("=")
+        grid[name] = [parse_value(value) for value in values.split(",")]
+    if configs is None:
+        configs = [dict(zip(grid, values)) for values in itertools.product(*grid.values())]
+    elif grid:
+        configs = [{**config, **dict(zip(grid, values))} for config in configs for values in itertools.product(*grid.values())]
+    for config in configs:
+        unknown = set(config) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown sweep parameters: {', '.join(sorted(unknown))}")
+    return [{**DEFAULTS, **config} for config in configs]
+
+
+def shares_k(config, k, exact_vectors=True):
+    """
+    True when the top k of a retrieval at a larger k is exactly what retrieving at k returns.
+    Hybrid and reranked configs query their first stage at fetch_k whatever k is; a plain vector
+    search is queried at k itself, which is only a prefix of a larger search when the search is
+    exact (exact_vectors). HNSW depends on ef, which grows with k, and quantized codes shortlist
+    rescore * k rows, so either can rank a larger k's top k differently.
+    """
+    if config["retrieval_mode"] == "hybrid" and k > config["fetch_k"]:
+        return False
+    if config["reranker"] != "none":
+        return k <= config["rerank_fetch_k"]
+    if config["retrieval_mode"] == "vector" and not exact_vectors:
+        return False
+    return True
+
+
+def memoize(fn):
+    """Memoize a one-argument embedding function; every config embeds the same questions."""
+    memo = {}
+    lock = threading.Lock()
+
+    def wrapper(text):
+        key = json.dumps(text)
+        with lock:
+            if key in memo:
+                return memo[key]
+        value = fn(text)
+        with lock:
+            memo[key] = value
+        return value
+    return wrapper
+
+
+class RetrieverFactory:
+    """
+    Builds a fresh retriever per retrieval setting on top of shared, loaded indexes: each config's
+    retrievers carry its own k, so parallel configs must not share instances, but the BM25 and vector
+    indexes behind them are read-only and loaded once per index path.
+    """
+    def __init__(self, rag_system, pdf_folder="downloaded_pdfs", index_root="sweep_indexes"):
+        self.rag_system = rag_system
+        # load_pdfs repoints the system at each index it builds, so remember the original
+        self.base_index_path = rag_system.local_index_path
+        self.pdf_folder = pdf_folder
+        self.index_root = index_root
+        self.embed_query = memoize(rag_system.embeddings.embed_query)
+        self.embed_documents = memoize(lambda texts: rag_system.embeddings.embed_documents(texts))
+        self._local = {}
+        self._scorers = {}
+
+    def index_path(self, config):
+        """Local index for the config's chunk settings (built on first use), or the system's own."""
+        if config["chunk_size"] is None and config["chunk_overlap"] is None:
+            return self.base_index_path
+        chunk_size = config["chunk_size"] or 2000
+        chunk_overlap = config["chunk_overlap"] if config["chunk_overlap"] is not None else 200
+        path = os.path.join(self.index_root, f"chunks_{chunk_size}_{chunk_overlap}")
+        if not os.path.exists(path):
+            print(self.rag_system.load_pdfs(self.pdf_folder, index_path=path, chunk_size=chunk_size, chunk_overlap=chunk_overlap))
+        return path
+
+    def fingerprint(self, path):
+        """Identifies an index's contents, so cached retrievals are dropped when it is rebuilt."""
+        if path is None:
+            return f"azure:{self.rag_system.index_name}"
+        stat = os.stat(os.path.join(path, "embeddings.npy"))
+        return f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+
+    def _load(self, path):
+        if path not in self._local:
+            index = LocalVectorIndex(path)
+            self._local[path] = (BM25Retriever(index.documents), LocalVectorRetriever(index, self.embed_query))
+        return self._local[path]
+
+    def exact_vectors(self, path):
+        """Whether vector search over the index at path is exact; Azure's (HNSW) is not."""
+        if path is None:
+            return False
+        index = self._load(path)[1].index
+        return index.hnsw is None and index.quantizer is None
+
+    def _first_stage(self, path, k):
+        if path is None:
+            from RAG_Core import AzureCognitiveSearchRetriever
+            search_client = self.rag_system.search_client
+            keyword = AzureCognitiveSearchRetriever(search_client, self.embed_documents, k=k)
+            vector = AzureCognitiveSearchRetriever(search_client, self.embed_documents, k=k, query_mode="vector")
+            return keyword, vector
+        keyword, vector = (copy.copy(retriever) for retriever in self._load(path))
+        keyword.k = vector.k = k
+        return keyword, vector
+
+    def build(self, config, path, k):
+        mode = config["retrieval_mode"] or ("vector" if path else "keyword")
+        keyword, vector = self._first_stage(path, k)
+        if mode == "keyword":
+            retriever = keyword
+        elif mode == "vector":
+            retriever = vector
+        elif mode == "hybrid":
+            retriever = HybridRetriever(keyword, vector, k=k, fetch_k=config["fetch_k"], rrf_k=config["rrf_k"])
+        else:
+            raise ValueError(f"Unknown retrieval_mode: {mode}")
+        if config["reranker"] != "none":
+            if config["reranker"] not in self._scorers:
+                self._scorers[config["reranker"]] = make_scorer(config["reranker"])
+            # No latency budget: the sweep measures ranking quality, not fallbacks
+            retriever = RerankingRetriever(retriever, self._scorers[config["reranker"]], k=k,
+                                           fetch_k=config["rerank_fetch_k"], latency_budget=None)
+        return retriever
+
+
+def run_sweep(rag_system, configs, qa, workers=16, cache=None, pdf_folder="downloaded_pdfs"):
+    """Return one summary dict per config, in config order."""
+    factory = RetrieverFactory(rag_system, pdf_folder)
+    questions = [question for question, _ in qa]
+    relevant = [titles for _, titles in qa]
+
+    # Resolve each config to a retrieval setting; configs differing only in k share one where exact
+    settings = {}
+    plans = []
+    for config in configs:
+        path = factory.index_path(config)
+        base = {name: value for name, value in config.items() if name not in ("k", "chunk_size", "chunk_overlap")}
+        base["index"] = factory.fingerprint(path)
+        plans.append((config, path, base))
+    group_k = {}
+    for config, _, base in plans:
+        group = json.dumps(base, sort_keys=True)
+        group_k[group] = max(group_k.get(group, 0), config["k"])
+    resolved = []
+    for config, path, base in plans:
+        k = group_k[json.dumps(base, sort_keys=True)]
+        mode = config["retrieval_mode"] or ("vector" if path else "keyword")
+        if not shares_k({**config, "retrieval_mode": mode}, k, factory.exact_vectors(path)):
+            k = config["k"]
+        setting = {**base, "k": k}
+        settings.setdefault(json.dumps(setting, sort_keys=True), (setting, config, path))
+        resolved.append(json.dumps(setting, sort_keys=True))
+
+    retrieved = {}
+    seconds = {key: [] for key in settings}
+    retrievers = {key: factory.build(config, path, setting["k"]) for key, (setting, config, path) in settings.items()}
+
+    def retrieve(task):
+        key, question = task
+        setting = settings[key][0]
+        cache_key = RetrievalCache.key(setting, question)
+        docs = cache.get(cache_key) if cache is not None else None
+        if docs is None:
+            start = time.perf_counter()
+            results = retrievers[key].get_relevant_documents(question)
+            seconds[key].append(time.perf_counter() - start)
+            docs = [[doc["metadata"].get("title"), doc["metadata"].get("chunk_id"), doc.get("score")] for doc in results]
+            if cache is not None:
+                cache.put(cache_key, docs)
+        retrieved[task] = docs
+
+    tasks = [(key, question) for key in settings for question in questions]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(retrieve, tasks))
+
+    summaries = []
+    for config, key in zip(configs, resolved):
+        k = config["k"]
+        # Score at document level: several chunks of the relevant PDF count as one hit
+        titles = [list(dict.fromkeys(title for title, _, _ in retrieved[(key, question)][:k])) for question in questions]
+        metrics = batch_metrics(titles, relevant, max_k=k)
+        column = k - 1
+        summaries.append({
+            "config": {name: value for name, value in config.items() if value != DEFAULTS[name] or name == "k"},
+            "precision": float(metrics["precision_at_k"][:, column].mean()) if k else 0.0,
+            "recall": float(metrics["recall_at_k"][:, column].mean()) if k else 0.0,
+            "f1": float(metrics["f1_at_k"][:, column].mean()) if k else 0.0,
+            "ndcg": float(metrics["ndcg_at_k"][:, column].mean()) if k else 0.0,
+            "mrr": float(metrics["mrr"].mean()),
+            "map": float(metrics["map"].mean()),
+            # Mean latency of the retrievals actually run (None when everything came from the cache)
+            "ms_per_query": 1000 * sum(seconds[key]) / len(seconds[key]) if seconds[key] else None
+        })
+    return summaries
+
+
+def format_table(summaries, sort="ndcg"):
+    summaries = sorted(summaries, key=lambda summary: -summary[sort])
+    labels = [", ".join(f"{name}={value}" for name, value in summary["config"].items()) for summary in summaries]
+    width = max([len(label) for label in labels] + [6])
+    columns = ("precision", "recall", "f1", "ndcg", "mrr", "map")
+    lines = [f"{'config':<{width}}  " + "  ".join(f"{column:>9}" for column in columns) + f"  {'ms/query':>9}"]
+    for label, summary in zip(labels, summaries):
+        latency = f"{summary['ms_per_query']:9.1f}" if summary["ms_per_query"] is not None else f"{'cached':>9}"
+        lines.append(f"{label:<{width}}  " + "  ".join(f"{summary[column]:9.3f}" for column in columns) + f"  {latency}")
+    return "\n".join(lines)
+
+
+def main():
+    from RAG_Core import PDFRAGSystem
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--grid", help="JSON grid file")
+    parser.add_argument("--set", action="append", default=[], metavar="NAME=V1,V2", help="sweep a parameter over values")
+    parser.add_argument("--qa", default="qa.tsv")
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument("--pdf-folder", default="downloaded_pdfs", help="PDFs to re-chunk for chunk_size/chunk_overlap")
+    parser.add_argument("--cache", default="sweep_cache.sqlite3")
+    parser.add_argument("--no-cache", action="store_true")
+    parser.add_argument("--sort", default="ndcg", choices=["precision", "recall", "f1", "ndcg", "mrr", "map"])
+    parser.add_argument("--output", help="also write the summaries as JSON")
+    args = parser.parse_args()
+
+    configs = load_grid(args.grid, args.set)
+    rag_system = PDFRAGSystem(api_key=os.getenv("OPENAI_API_KEY"), search_endpoint=os.getenv("SEARCH_ENDPOINT"), search_api_key=os.getenv("SEARCH_API_KEY"), index_name=os.getenv("INDEX_NAME"), local_index_path=os.getenv("LOCAL_INDEX_PATH"))
+    cache = None if args.no_cache else RetrievalCache(args.cache)
+    qa = load_qa_relevance(args.qa)
+
+    start = time.perf_counter()
+    try:
+        summaries = run_sweep(rag_system, configs, qa, workers=args.workers, cache=cache, pdf_folder=args.pdf_folder)
+    finally:
+        if cache is not None:
+            cache.close()
+        rag_system.close()
+    print(format_table(summaries, args.sort))
+    print(f"{len(configs)} configs x {len(qa)} questions in {time.perf_counter() - start:.1f}s")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(summaries, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
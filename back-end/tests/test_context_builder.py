@@ -0,0 +1,73 @@
+import pytest
+
+import context_builder
+from context_builder import ContextBuilder
+
+
+def doc(chunk_id, text, score=None):
+    doc = {"page_content": text, "metadata": {"chunk_id": chunk_id}}
+    if score is not None:
+        doc["score"] = score
+    return doc
+
+
+def ids(docs):
+    return [doc["metadata"]["chunk_id"] for doc in docs]
+
+
+class WordEncoding:
+    """Stands in for a tiktoken encoding (which needs a download) with one token per word."""
+    def encode(self, text):
+        return text.split(" ")
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture
+def builder(monkeypatch):
+    monkeypatch.setattr(context_builder.tiktoken, "encoding_for_model", lambda model_name: WordEncoding())
+    return lambda **kwargs: ContextBuilder(**kwargs)
+
+
+PASSAGE = "the forward capacity auction procures capacity three years ahead of the delivery period for new england"
+
+
+def test_near_duplicates_are_dropped(builder):
+    docs = [doc("a", PASSAGE, 0.9), doc("b", PASSAGE + " region", 0.8), doc("c", "locational marginal prices are set every five minutes", 0.7)]
+    result = builder(token_budget=None, dedup_threshold=0.5).build(docs)
+    assert ids(result["docs"]) == ["a", "c"]
+    assert result["duplicates"] == 1
+
+
+def test_dedup_keeps_the_higher_scored_copy_and_retrieval_order(builder):
+    docs = [doc("a", "unrelated passage about transmission rights auctions", 0.1), doc("b", PASSAGE, 0.2), doc("c", PASSAGE, 0.9)]
+    result = builder(token_budget=None).build(docs)
+    assert ids(result["docs"]) == ["a", "c"]
+    # The context is ordered by score
+    assert result["context"].startswith(PASSAGE)
+
+
+def test_dedup_disabled_keeps_identical_chunks(builder):
+    result = builder(token_budget=None, dedup_threshold=None).build([doc("a", PASSAGE), doc("b", PASSAGE)])
+    assert ids(result["docs"]) == ["a", "b"]
+    assert result["duplicates"] == 0
+
+
+def test_budget_truncates_the_last_chunk(builder):
+    docs = [doc("a", "one two three four", 0.9), doc("b", "five six seven eight nine ten", 0.8)]
+    result = builder(token_budget=7, min_chunk_tokens=2, separator="\n").build(docs)
+    assert result["context"] == "one two three four\nfive six"
+    assert result["tokens"] == 7
+    assert result["truncated"]
+
+
+def test_falls_back_to_a_character_estimate_without_the_tokenizer(monkeypatch):
+    def unavailable(model_name):
+        raise OSError("no network")
+    monkeypatch.setattr(context_builder.tiktoken, "encoding_for_model", unavailable)
+    builder = ContextBuilder(token_budget=3, min_chunk_tokens=1, dedup_threshold=None)
+    assert builder.count_tokens("twelve chars") == 3
+    result = builder.build([doc("a", "sixteen characters")])
+    assert result["context"] == "sixteen char"
+    assert result["truncated"]
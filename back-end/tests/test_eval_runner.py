@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+
+from eval_runner import RateLimiter, backoff_delay, parse_duration, run_concurrently, server_delay
+
+
+def test_requests_beyond_the_budget_wait_for_a_refill():
+    # 1200 requests/minute: the full bucket goes immediately, then one request every 50 ms
+    limiter = RateLimiter(requests_per_minute=1200)
+
+    async def acquire_all():
+        for _ in range(1200):
+            await limiter.acquire()
+        start = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire()
+        return time.monotonic() - start
+
+    assert 0.12 <= asyncio.run(acquire_all()) < 0.5
+
+
+def test_token_budget_caps_an_oversized_request_at_a_full_bucket():
+    limiter = RateLimiter(tokens_per_minute=600)
+    asyncio.run(limiter.acquire(tokens=10000))
+    assert limiter._token_budget == pytest.approx(0, abs=1)
+    # Refilling 600 tokens takes a minute; 10 tokens take a second
+    assert limiter._wait_time(10) == pytest.approx(1.0, abs=0.05)
+    assert limiter._wait_time(10000) == pytest.approx(60.0, abs=0.5)
+
+
+def test_unbounded_limiter_never_waits():
+    limiter = RateLimiter()
+    assert limiter._wait_time(10 ** 9) == 0
+
+
+def test_run_concurrently_bounds_concurrency_and_keeps_input_order():
+    in_flight, peak = 0, 0
+
+    async def work(item):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.01 * (5 - item % 5))
+        in_flight -= 1
+        return item * 2
+
+    results = asyncio.run(run_concurrently(list(range(20)), work, concurrency=4))
+    assert results == [item * 2 for item in range(20)]
+    assert peak == 4
+
+
+def test_pause_holds_back_every_caller():
+    limiter = RateLimiter()
+    limiter.pause(0.1)
+    start = time.monotonic()
+    asyncio.run(limiter.acquire())
+    assert time.monotonic() - start >= 0.09
+
+
+def test_update_from_headers_adopts_limits_with_headroom():
+    limiter = RateLimiter()
+    limiter.update_from_headers({"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": "5",
+                                 "x-ratelimit-limit-tokens": "1000"}, headroom=0.5)
+    assert limiter.requests_per_minute == 50
+    assert limiter._request_budget == pytest.approx(5, abs=0.1)
+    assert limiter.tokens_per_minute == 500
+    assert limiter._token_budget == pytest.approx(500, abs=1)
+    # The server's remaining count only ever lowers the local budget
+    limiter.update_from_headers({"x-ratelimit-limit-requests": "100", "x-ratelimit-remaining-requests": "40"}, headroom=0.5)
+    assert limiter._request_budget < 6
+
+
+@pytest.mark.parametrize("value, seconds", [("20ms", 0.02), ("1s", 1), ("6m0s", 360), ("1h2m3.5s", 3723.5), ("", None), (None, None), ("soon", None)])
+def test_parse_duration(value, seconds):
+    assert parse_duration(value) == (pytest.approx(seconds) if seconds is not None else None)
+
+
+def test_backoff_uses_retry_after_with_a_little_jitter():
+    assert 2.0 <= backoff_delay(0, {"retry-after": "2"}) <= 2.4
+    assert 0.5 <= backoff_delay(0, {"retry-after-ms": "500", "retry-after": "9"}) <= 0.6
+    assert backoff_delay(0, {"retry-after": "600"}, max_delay=30) == 30
+
+
+def test_backoff_uses_the_rate_limit_reset_for_429s_only():
+    headers = {"x-ratelimit-reset-requests": "1s", "x-ratelimit-reset-tokens": "3s"}
+    assert 3.0 <= backoff_delay(0, headers, rate_limited=True) <= 3.6
+    assert backoff_delay(0, headers, base_delay=0.01) <= 0.01
+
+
+def test_backoff_is_exponential_with_full_jitter_and_capped():
+    delays = [backoff_delay(3, base_delay=1.0, max_delay=60) for _ in range(200)]
+    assert all(0 <= delay <= 8 for delay in delays)
+    assert max(delays) > 4
+    assert all(backoff_delay(20, base_delay=1.0, max_delay=5) <= 5 for _ in range(50))
+
+
+def test_server_delay_is_unjittered_and_none_when_unsaid():
+    assert server_delay({"retry-after": "2"}) == 2
+    assert server_delay({"x-ratelimit-reset-tokens": "1.5s"}, rate_limited=True) == 1.5
+    assert server_delay({"x-ratelimit-reset-tokens": "1.5s"}) is None
+    assert server_delay({}) is None
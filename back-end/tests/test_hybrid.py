@@ -0,0 +1,77 @@
+import pytest
+
+from hybrid import BM25Index, BM25Retriever, HybridRetriever, reciprocal_rank_fusion
+from retrievers import BaseRetriever
+
+
+def doc(chunk_id, text=None, score=None):
+    doc = {"page_content": text or f"text of {chunk_id}", "metadata": {"chunk_id": chunk_id}}
+    if score is not None:
+        doc["score"] = score
+    return doc
+
+
+def ids(docs):
+    return [doc["metadata"]["chunk_id"] for doc in docs]
+
+
+class FixedRetriever(BaseRetriever):
+    def __init__(self, chunk_ids, k=5):
+        super().__init__(k)
+        self.chunk_ids = chunk_ids
+        self.requested = []
+
+    def get_relevant_documents(self, query, k=None):
+        self.requested.append(k)
+        return [doc(chunk_id) for chunk_id in self.chunk_ids[:k or self.k]]
+
+
+def test_rrf_sums_reciprocal_ranks_across_rankings():
+    fused = reciprocal_rank_fusion([[doc("a"), doc("b")], [doc("b"), doc("c")]], k=3, rrf_k=60)
+    assert ids(fused) == ["b", "a", "c"]
+    assert fused[0]["score"] == pytest.approx(1 / 62 + 1 / 61)
+    assert fused[1]["score"] == pytest.approx(1 / 61)
+
+
+def test_rrf_weights_and_top_k():
+    rankings = [[doc("a"), doc("b")], [doc("b"), doc("a")]]
+    assert ids(reciprocal_rank_fusion(rankings, k=1, weights=[2.0, 1.0])) == ["a"]
+    assert ids(reciprocal_rank_fusion(rankings, k=1, weights=[1.0, 2.0])) == ["b"]
+
+
+def test_rrf_keeps_the_first_ranking_copy_of_a_document():
+    fused = reciprocal_rank_fusion([[doc("a", "first")], [doc("a", "second")]], k=5)
+    assert len(fused) == 1
+    assert fused[0]["page_content"] == "first"
+
+
+def test_bm25_ranks_by_term_rarity_and_frequency():
+    index = BM25Index(["capacity auction rules", "energy market rules", "capacity capacity auction", "unrelated text"])
+    ids, scores = index.search("capacity auction", k=3)
+    assert ids.tolist() == [2, 0]
+    assert scores[0] > scores[1] > 0
+    # "rules" is in half the documents, so it is worth less than the rarer "energy"
+    assert index.idf("rules") < index.idf("energy")
+
+
+def test_bm25_keeps_section_numbers_and_hyphenated_terms_whole():
+    index = BM25Index(["see section 2.4.1 of the day-ahead rules", "section 2 of the real-time rules"])
+    assert index.search("2.4.1", k=5)[0].tolist() == [0]
+    assert index.search("day-ahead", k=5)[0].tolist() == [0]
+
+
+def test_bm25_retriever_returns_documents_with_scores():
+    retriever = BM25Retriever([doc("a", "locational marginal price"), doc("b", "forward capacity market")], k=1)
+    results = retriever.get_relevant_documents("capacity")
+    assert ids(results) == ["b"]
+    assert results[0]["score"] > 0
+
+
+def test_hybrid_passes_its_fetch_size_without_changing_the_legs_k():
+    keyword, vector = FixedRetriever(["a", "b", "c"], k=1), FixedRetriever(["c", "d"], k=1)
+    hybrid = HybridRetriever(keyword, vector, k=2, fetch_k=3, workers=1)
+    assert ids(hybrid.get_relevant_documents("q")) == ["c", "a"]
+    assert ids(hybrid.get_relevant_documents("q", k=4)) == ["c", "a", "b", "d"]
+    assert keyword.requested == vector.requested == [3, 4]
+    assert keyword.k == vector.k == 1
+    hybrid.close()
@@ -0,0 +1,42 @@
+import json
+
+import instrumentation
+from instrumentation import Counter, Histogram
+
+
+def test_histogram_render_sums_snapshots_from_several_processes():
+    histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    histogram.observe(0.05, stage="search")
+    other = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1))
+    other.observe(0.5, stage="search")
+    other.observe(5, stage="llm")
+    lines = histogram.render([json.loads(json.dumps(histogram.snapshot())), other.snapshot()])
+    assert 'latency_seconds_bucket{le="0.1",stage="search"} 1' in lines
+    assert 'latency_seconds_bucket{le="1.0",stage="search"} 2' in lines
+    assert 'latency_seconds_count{stage="search"} 2' in lines
+    assert 'latency_seconds_bucket{le="+Inf",stage="llm"} 1' in lines
+
+
+def test_render_metrics_aggregates_every_process_file(tmp_path, monkeypatch):
+    monkeypatch.setenv("METRICS_DIR", str(tmp_path))
+    requests = Counter("requests_total", "Requests.")
+    monkeypatch.setattr(instrumentation, "METRICS", (requests,))
+    # Another worker's flushed values, including an integer label as status codes are
+    (tmp_path / "123-abcd.json").write_text(json.dumps({"requests_total": {'[["status", 200]]': 3}}))
+    requests.inc(status=200)
+    requests.inc(status=500)
+    text = instrumentation.render_metrics()
+    assert 'requests_total{status="200"} 4' in text
+    assert 'requests_total{status="500"} 1' in text
+    # This process's own file was written too, so other workers' scrapes include it
+    assert len(list(tmp_path.glob("*.json"))) == 2
+    instrumentation.clear_metrics_dir()
+    assert not list(tmp_path.glob("*.json"))
+
+
+def test_without_metrics_dir_values_are_per_process(monkeypatch):
+    monkeypatch.delenv("METRICS_DIR", raising=False)
+    requests = Counter("requests_total", "Requests.")
+    monkeypatch.setattr(instrumentation, "METRICS", (requests,))
+    requests.inc(2, endpoint="retrieve")
+    assert instrumentation.render_metrics().splitlines()[-1] == 'requests_total{endpoint="retrieve"} 2'
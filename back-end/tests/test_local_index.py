@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pytest
+
+from local_index import LocalVectorIndex, new_index_version, publish_index
+from quantization import QUANTIZER_FILE, quantize_index
+
+
+def make_version(path, name):
+    os.makedirs(path)
+    with open(os.path.join(path, "name"), "w") as file:
+        file.write(name)
+    return path
+
+
+def read(path):
+    with open(os.path.join(path, "name")) as file:
+        return file.read()
+
+
+def test_publish_repoints_the_symlink_and_keeps_the_previous_version(tmp_path):
+    path = str(tmp_path / "index")
+    versions = [make_version(f"{path}.v{i}", str(i)) for i in range(1, 4)]
+    for version in versions:
+        publish_index(path, version)
+        assert read(path) == os.path.basename(version)[-1]
+    assert os.path.islink(path)
+    # The oldest version is gone; the previous one stays for processes that haven't reloaded
+    assert sorted(os.listdir(tmp_path)) == ["index", "index.v2", "index.v3"]
+
+
+def test_publish_moves_a_plain_index_directory_aside(tmp_path):
+    path = str(tmp_path / "index")
+    make_version(path, "legacy")
+    version = make_version(new_index_version(path), "new")
+    publish_index(path, version)
+    assert read(path) == "new"
+    assert read(f"{path}.v0") == "legacy"
+
+
+def test_an_empty_index_builds_without_codes_and_searches_to_nothing(tmp_path):
+    path = str(tmp_path / "index")
+    LocalVectorIndex.build(path, np.empty((0, 4), dtype=np.float32), [], quantization="int8")
+    assert not os.path.exists(os.path.join(path, QUANTIZER_FILE))
+    index = LocalVectorIndex(path)
+    assert len(index) == 0
+    assert index.search(np.ones(4), k=5)[0].tolist() == []
+    with pytest.raises(ValueError, match="empty"):
+        quantize_index(path)
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+from openai_transport import AsyncOpenAITransport, OpenAITransport
+
+URL = "https://api.openai.test/v1/chat/completions"
+
+
+def body(content="hi", **extra):
+    return {"model": "gpt-4o-mini", "messages": [{"role": "user", "content": content}], **extra}
+
+
+def replies(*responses):
+    """A MockTransport handler returning the given (status, headers) in turn, recording request times."""
+    calls = []
+
+    def handler(request):
+        calls.append(time.monotonic())
+        status, headers = responses[min(len(calls), len(responses)) - 1]
+        return httpx.Response(status, headers=headers, json={"call": len(calls)})
+    return handler, calls
+
+
+def client(handler, **kwargs):
+    transport = OpenAITransport(httpx.MockTransport(handler), base_delay=0.01, max_delay=0.5, **kwargs)
+    return httpx.Client(transport=transport), transport
+
+
+def test_identical_concurrent_requests_are_sent_once():
+    callers = 8
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        # Hold the leader until every other caller has joined its flight
+        deadline = time.monotonic() + 5
+        while transport.flight.coalesced < callers - 1 and time.monotonic() < deadline:
+            time.sleep(0.001)
+        return httpx.Response(200, json={"answer": 42})
+
+    http, transport = client(handler)
+    with ThreadPoolExecutor(callers) as pool:
+        responses = list(pool.map(lambda _: http.post(URL, json=body()), range(callers)))
+    assert len(calls) == 1
+    assert transport.flight.coalesced == callers - 1
+    assert [response.json() for response in responses] == [{"answer": 42}] * callers
+
+
+def test_different_and_streaming_requests_are_not_coalesced():
+    handler, calls = replies((200, {}))
+    http, transport = client(handler)
+    http.post(URL, json=body("a"))
+    http.post(URL, json=body("b"))
+    http.post(URL, json=body("a", stream=True))
+    http.post(URL, json=body("a", stream=True))
+    assert len(calls) == 4
+    assert transport.flight.coalesced == 0
+
+
+def test_coalesced_callers_share_the_leaders_error():
+    started, release = threading.Event(), threading.Event()
+
+    def handler(request):
+        started.set()
+        release.wait(5)
+        raise httpx.ReadTimeout("slow", request=request)
+
+    http, transport = client(handler)
+    with ThreadPoolExecutor(2) as pool:
+        leader = pool.submit(http.post, URL, json=body())
+        started.wait(5)
+        follower = pool.submit(http.post, URL, json=body())
+        while transport.flight.coalesced < 1:
+            time.sleep(0.001)
+        release.set()
+        for future in (leader, follower):
+            with pytest.raises(httpx.ReadTimeout):
+                future.result()
+
+
+def test_429_is_retried_after_retry_after_and_pauses_the_bucket():
+    handler, calls = replies((429, {"retry-after-ms": "100"}), (200, {}))
+    http, transport = client(handler)
+    response = http.post(URL, json=body())
+    assert response.status_code == 200
+    assert response.json() == {"call": 2}
+    assert transport.retries == 1
+    assert calls[1] - calls[0] >= 0.1
+    limiter = transport._limiters[("/v1/chat/completions", "gpt-4o-mini")]
+    assert limiter._paused_until >= calls[0] + 0.1
+
+
+def test_429_pauses_other_callers_for_the_exact_reset_without_jitter(monkeypatch):
+    # Maximum jitter on the retrying caller's own wait
+    monkeypatch.setattr("eval_runner.random.uniform", lambda low, high: high)
+    handler, calls = replies((429, {"retry-after-ms": "200"}), (200, {}))
+    http, transport = client(handler)
+    http.post(URL, json=body())
+    limiter = transport._limiters[("/v1/chat/completions", "gpt-4o-mini")]
+    assert calls[1] - calls[0] >= 0.24
+    assert limiter._paused_until - calls[0] < 0.22
+
+
+def test_429_waits_for_the_rate_limit_reset_without_retry_after():
+    handler, calls = replies((429, {"x-ratelimit-reset-requests": "50ms", "x-ratelimit-reset-tokens": "120ms"}), (200, {}))
+    http, transport = client(handler)
+    assert http.post(URL, json=body()).status_code == 200
+    assert calls[1] - calls[0] >= 0.12
+
+
+def test_5xx_is_retried_until_max_retries():
+    handler, calls = replies((503, {}), (502, {}), (200, {}))
+    http, transport = client(handler)
+    assert http.post(URL, json=body()).status_code == 200
+    assert len(calls) == 3
+
+    handler, calls = replies((500, {}))
+    http, transport = client(handler, max_retries=2)
+    assert http.post(URL, json=body()).status_code == 500
+    assert len(calls) == 3
+    assert transport.retries == 2
+
+
+def test_client_errors_are_not_retried():
+    handler, calls = replies((400, {}))
+    http, transport = client(handler)
+    assert http.post(URL, json=body()).status_code == 400
+    assert len(calls) == 1
+
+
+def test_dropped_connections_are_retried():
+    attempts = []
+
+    def handler(request):
+        attempts.append(request)
+        if len(attempts) == 1:
+            raise httpx.ConnectError("refused", request=request)
+        return httpx.Response(200, json={})
+
+    http, transport = client(handler)
+    assert http.post(URL, json=body()).status_code == 200
+    assert len(attempts) == 2
+
+
+def test_rate_limit_headers_tune_the_bucket():
+    handler, _ = replies((200, {"x-ratelimit-limit-requests": "500", "x-ratelimit-remaining-requests": "499"}))
+    http, transport = client(handler)
+    http.post(URL, json=body())
+    limiter = transport._limiters[("/v1/chat/completions", "gpt-4o-mini")]
+    assert limiter.requests_per_minute == pytest.approx(450)
+
+
+def test_async_transport_coalesces_and_retries():
+    calls = []
+
+    async def handler(request):
+        calls.append(json.loads(request.content)["messages"][0]["content"])
+        await asyncio.sleep(0.05)
+        if len(calls) == 1:
+            return httpx.Response(429, headers={"retry-after-ms": "10"})
+        return httpx.Response(200, json={"content": calls[-1]})
+
+    async def main():
+        transport = AsyncOpenAITransport(httpx.MockTransport(handler), base_delay=0.01, max_delay=0.5)
+        async with httpx.AsyncClient(transport=transport) as http:
+            responses = await asyncio.gather(*(http.post(URL, json=body()) for _ in range(5)))
+        return transport, responses
+
+    transport, responses = asyncio.run(main())
+    assert calls == ["hi", "hi"]
+    assert transport.coalesced == 4
+    assert transport.retries == 1
+    assert [response.json() for response in responses] == [{"content": "hi"}] * 5
@@ -0,0 +1,17 @@
+import os
+
+from pdf_dowloader import target_path
+
+
+def test_same_named_files_in_different_folders_get_different_paths():
+    first = target_path("https://www.iso-ne.com/manuals/m-01.pdf", "out")
+    second = target_path("https://www.iso-ne.com/archive/m-01.pdf", "out")
+    assert first == os.path.join("out", "manuals", "m-01.pdf")
+    assert second == os.path.join("out", "archive", "m-01.pdf")
+
+
+def test_query_strings_and_dot_segments():
+    versioned = target_path("https://h/doc.pdf?rev=2", "out")
+    assert versioned != target_path("https://h/doc.pdf?rev=3", "out")
+    assert versioned.startswith(os.path.join("out", "doc-")) and versioned.endswith(".pdf")
+    assert target_path("https://h/a/../../etc/x%20y.pdf", "out") == os.path.join("out", "a", "etc", "x y.pdf")
@@ -0,0 +1,11 @@
+from result_writer import JsonlResultWriter
+
+
+def test_reload_skips_truncated_and_foreign_lines(tmp_path):
+    path = tmp_path / "results.jsonl"
+    path.write_text('{"key": "a", "result": 1}\n{"key": "b"}\n42\n{"note": "x"}\n{"key": "c", "res', encoding="utf-8")
+    with JsonlResultWriter(str(path), fsync=False) as writer:
+        assert "a" in writer and len(writer) == 1
+        writer.write("d", 2)
+    with JsonlResultWriter(str(path), fsync=False) as writer:
+        assert writer.get("a") == 1 and writer.get("d") == 2 and len(writer) == 2
@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from retrieval_metrics import batch_metrics, summarize
+
+
+def test_duplicate_retrievals_count_once_in_rank_metrics():
+    metrics = batch_metrics([["a", "a", "a"]], [["a"]])
+    assert metrics["map"][0] == pytest.approx(1.0)
+    assert np.allclose(metrics["ndcg_at_k"][0], [1.0, 1.0, 1.0])
+    assert metrics["mrr"][0] == pytest.approx(1.0)
+
+
+def test_repeated_hit_does_not_fill_a_second_relevant_slot():
+    # "a" twice then "b": only two distinct hits, at ranks 1 and 3
+    metrics = batch_metrics([["a", "a", "b"]], [["a", "b"]])
+    assert metrics["map"][0] == pytest.approx((1 / 1 + 2 / 3) / 2)
+    ideal = 1 + 1 / np.log2(3)
+    assert metrics["ndcg_at_k"][0, 2] == pytest.approx((1 + 1 / np.log2(4)) / ideal)
+    assert (metrics["ndcg_at_k"] <= 1.0 + 1e-12).all()
+
+
+def test_precision_recall_and_mrr_at_each_cutoff():
+    metrics = batch_metrics([["x", "a", "b"], []], [["a", "b"], ["a"]])
+    assert np.allclose(metrics["precision_at_k"][0], [0.0, 0.5, 2 / 3])
+    assert np.allclose(metrics["recall_at_k"][0], [0.0, 0.5, 1.0])
+    assert metrics["mrr"].tolist() == [0.5, 0.0]
+    assert metrics["map"][1] == 0.0
+    assert metrics["lengths"].tolist() == [3, 0]
+
+
+def test_summarize_skips_cutoffs_beyond_max_k():
+    summary = summarize(batch_metrics([["a", "b"]], [["a"]]), ks=(1, 5))
+    assert summary["precision@1"] == 1.0
+    assert "precision@5" not in summary
+
+
+def test_max_k_truncates_long_lists_and_pads_short_ones():
+    metrics = batch_metrics([["x", "y", "a"], ["a"]], [["a"], ["a"]], max_k=2)
+    assert metrics["precision_at_k"].shape == (2, 2)
+    assert metrics["mrr"].tolist() == [0.0, 1.0]
+    assert metrics["lengths"].tolist() == [2, 1]
+    assert np.allclose(metrics["recall_at_k"][1], [1.0, 1.0])
@@ -0,0 +1,22 @@
+from sweep import DEFAULTS, shares_k
+
+
+def config(**overrides):
+    return {**DEFAULTS, **overrides}
+
+
+def test_exact_searches_share_a_larger_k():
+    assert shares_k(config(retrieval_mode="keyword"), 10)
+    assert shares_k(config(retrieval_mode="vector"), 10, exact_vectors=True)
+
+
+def test_approximate_vector_search_is_not_shared():
+    assert not shares_k(config(retrieval_mode="vector"), 10, exact_vectors=False)
+    # Hybrid and reranked first stages are queried at fetch_k, whatever k is
+    assert shares_k(config(retrieval_mode="hybrid", fetch_k=20), 10, exact_vectors=False)
+    assert shares_k(config(retrieval_mode="vector", reranker="lexical", rerank_fetch_k=50), 10, exact_vectors=False)
+
+
+def test_k_beyond_the_candidate_pool_is_not_shared():
+    assert not shares_k(config(retrieval_mode="hybrid", fetch_k=20), 30)
+    assert not shares_k(config(retrieval_mode="keyword", reranker="lexical", rerank_fetch_k=50), 60)
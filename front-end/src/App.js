@@ -75,18 +75,43 @@ const App = () => {
   ]);
   const [userInput, setUserInput] = useState('');
 
-  // Function to call the back-end API
-  const fetchRetrievedInfo = async (user_query) => {
+  // Function to call the back-end API; onText receives the answer so far as tokens stream in
+  const fetchRetrievedInfo = async (user_query, onText) => {
     try {
-      const response = await fetch('http://127.0.0.1:5000/retrieve', {
+      const response = await fetch('http://127.0.0.1:5000/retrieve_stream', {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
         },
-        body: JSON.stringify({ user_query: user_query }), // Change this line
-      }); 
-      const data = await response.json();
-      return data.answer; // Access the 'answer' key from the response
+        body: JSON.stringify({ user_query: user_query }),
+      });
+      const reader = response.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let answer = '';
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        // Server-Sent Events are separated by a blank line; keep any partial event in the buffer
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        for (const rawEvent of events) {
+          let event = 'message';
+          let data = '';
+          for (const line of rawEvent.split('\n')) {
+            if (line.startsWith('event: ')) event = line.slice(7);
+            else if (line.startsWith('data: ')) data += line.slice(6);
+          }
+          if (event === 'token') {
+            answer += JSON.parse(data);
+            onText(answer);
+          } else if (event === 'error') {
+            throw new Error(JSON.parse(data));
+          }
+        }
+      }
+      return answer;
     } catch (error) {
       console.error('Error fetching retrieved info:', error);
       return 'Sorry, there was an error retrieving the information.';
@@ -100,11 +125,15 @@ const App = () => {
       setMessages([userMessage, ...messages]);
       setUserInput('');
 
+      // The newest message is first; update the bot reply in place as tokens arrive
+      const setBotText = (text) =>
+        setMessages((prevMessages) => [{ text, isBot: true }, ...prevMessages.slice(1)]);
+
       try {
         // Fetch retrieved information from the back-end
-        const retrievedInfo = await fetchRetrievedInfo(userInput);
-        const botMessage = { text: retrievedInfo, isBot: true };
-        setMessages((prevMessages) => [botMessage, ...prevMessages]);
+        setMessages((prevMessages) => [{ text: '...', isBot: true }, ...prevMessages]);
+        const retrievedInfo = await fetchRetrievedInfo(userInput, setBotText);
+        setBotText(retrievedInfo);
       } catch (error) {
         const errorMessage = { text: 'Error sending message. Please try again.', isBot: true };
         setMessages((prevMessages) => [errorMessage, ...prevMessages]);